@@ -0,0 +1,119 @@
+"""
+Module: clipboard.py
+Excel-style copying and pasting of blocks of table cells as tab-separated
+text.
+
+Author: Daniel Harris
+Title: Data & Procedures Officer
+Organisation: DPI Water
+Date modified: 19/10/2026
+
+External dependencies: PyQt4
+
+Classes:
+TableMimeData: Clipboard data for a block of table cells, formatted as text
+    only when it is requested
+
+Functions:
+format_tsv: format a block of table values as tab-separated text
+format_value: format a table value as it is displayed in the table
+parse_tsv: parse tab-separated text into a block of values
+"""
+
+# Standard library imports
+import datetime
+from itertools import izip
+
+# Related third party imports
+from PyQt4 import QtCore
+
+# Local application imports
+from settings import column_config
+
+__author__ = 'Daniel Harris'
+__date__ = '19 October 2026'
+__email__ = 'daniel.harris@dpi.nsw.gov.au'
+__status__ = 'Production'
+__version__ = '1.1.1'
+
+
+def format_tsv(columns, block):
+    """
+    Formats a block of table values as tab-separated text, with rows
+    separated by newlines.
+    :param columns: List of the column numbers of the block
+    :param block: List of rows, each a list of values as the Python types
+    used in the table's storage
+    :return: Unicode string of the block
+    """
+    return u'\n'.join(u'\t'.join(format_value(column, value) for column, value in izip(columns, row))
+                      for row in block)
+
+
+def format_value(column, value):
+    """
+    Formats a table value as it is displayed in the table.
+    :param column: Column number as defined in column_config.yaml
+    :param value: Value as the Python type used in the table's storage
+    :return: Unicode string of the value
+    """
+    if value is None:
+        return u""
+    elif isinstance(value, datetime.date):
+        return unicode(value.isoformat())
+    elif isinstance(value, datetime.time):
+        return unicode(value.strftime('%H:%M:%S'))
+    elif 'lower_limit' in column_config[column]:
+        return u'%.*f' % (column_config[column]['precision'], value)
+    return unicode(value)
+
+
+def parse_tsv(text):
+    """
+    Parses tab-separated text, such as cells copied from Excel, into a
+    block of values.
+    :param text: Text to parse
+    :return: List of rows, each a list of unicode values. Empty if there is
+    no text.
+    """
+    text = unicode(text).replace(u'\r\n', u'\n')
+    # Excel places an extra newline at the end of everything copied to the
+    # clipboard. To ensure we do not lose data, and to ensure consistency
+    # we remove any extra newline characters from the end of the text.
+    if text.endswith(u'\n'):
+        text = text[:-1]
+    if not text:
+        return []
+    return [line.split(u'\t') for line in text.split(u'\n')]
+
+
+class TableMimeData(QtCore.QMimeData):
+    """
+    Clipboard data for a block of table cells. The values are copied when
+    the cells are copied, but are only formatted as text when an
+    application asks the clipboard for them, so copying a large selection
+    does not block the user interface.
+    """
+    def __init__(self, columns, block):
+        """
+        :param columns: List of the column numbers of the block
+        :param block: List of rows, each a list of values as the Python types
+        used in the table's storage
+        """
+        QtCore.QMimeData.__init__(self)
+        self._columns = columns
+        self._block = block
+        self._text = None
+
+    def formats(self):
+        return QtCore.QStringList([u'text/plain'])
+
+    def hasFormat(self, mimeType):
+        return mimeType == u'text/plain'
+
+    def retrieveData(self, mimeType, preferredType):
+        if mimeType != u'text/plain':
+            return QtCore.QVariant()
+        if self._text is None:
+            self._text = format_tsv(self._columns, self._block)
+        return QtCore.QVariant(self._text)
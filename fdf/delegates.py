@@ -12,6 +12,11 @@ TableDelegate: Delegate for table view that defines editors and validators
 DoubleFixupValidator: Validator for doubles
 FilteredComboBox: Drop-down jQuery-style filtered combo-box
 ListValidator: Validator for list items
+StationLineEdit: Line edit completing station numbers by number or name
+
+Functions:
+get_list_model: get the shared model of a list column's items
+get_validator: get the shared validator of a column
 """
 
 # Related third party imports
@@ -21,6 +26,7 @@ from PyQt4 import QtGui, QtCore
 import functions
 import settings
 from settings import column_config
+from stations import get_station_index
 
 __author__ = 'Daniel Harris'
 __date__ = '12 December 2016'
@@ -29,6 +35,43 @@ __status__ = 'Production'
 __version__ = '1.0.0'
 
 
+# Item models and validators shared by every editor of a column, built the
+# first time an editor is opened in the column
+_listModels = {}
+_validators = {}
+
+
+def get_list_model(column):
+    """
+    Gets the model of the items of a list column, shared by the editors of
+    the column so the items are only added once.
+    :param column: Column number as defined in column_config.yaml
+    :return: QStringListModel of an empty item followed by the list items
+    """
+    if column not in _listModels:
+        items = [""]
+        items.extend(column_config[column]['list_items'])
+        _listModels[column] = QtGui.QStringListModel(items)
+    return _listModels[column]
+
+
+def get_validator(column):
+    """
+    Gets the validator of a list or numeric column, shared by the editors of
+    the column so its pattern is only compiled once.
+    :param column: Column number as defined in column_config.yaml
+    :return: ListValidator for list columns, otherwise DoubleFixupValidator
+    """
+    if column not in _validators:
+        if 'list_items' in column_config[column]:
+            _validators[column] = ListValidator(column)
+        else:
+            validator = DoubleFixupValidator(column, None)
+            validator.setNotation(QtGui.QDoubleValidator.StandardNotation)
+            _validators[column] = validator
+    return _validators[column]
+
+
 ##############################################################################
 # Style delegates
 ##############################################################################
@@ -41,32 +84,25 @@ class TableDelegate(QtGui.QStyledItemDelegate):
     # Reimplemented methods
     ##########################################################################
     def createEditor(self, parent, option, index):
-        items = [""]
-
         # List editor for frozen columns (if the editor is for a frozen column,
         # we need to ensure that no editor is returned for the thawed hidden
         # columns, otherwise we get two comboboxes displayed).
         if 'list_items' in column_config[index.column()] and index.column() < settings.FROZEN_COLUMNS:
             if self.tableFrozen:
-                editor = FilteredComboBox(parent)
-                items.extend(column_config[index.column()]['list_items'])
-                editor.addItems(items)
-                validator = ListValidator(index.column())
-                editor.setValidator(validator)
-                editor.activated.connect(self.commitAndCloseEditor)
-                return editor
+                return self.createListEditor(parent, index.column())
             else:
                 return None
 
         # List editor for thawed columns
         if 'list_items' in column_config[index.column()] and index.column() >= settings.FROZEN_COLUMNS:
-            editor = FilteredComboBox(parent)
-            items.extend(column_config[index.column()]['list_items'])
-            editor.addItems(items)
-            validator = ListValidator(index.column())
-            editor.setValidator(validator)
-            editor.activated.connect(self.commitAndCloseEditor)
-            return editor
+            return self.createListEditor(parent, index.column())
+
+        # Station editor, following the same rules for frozen columns
+        elif index.column() == functions.get_column_number('station_number'):
+            if self.tableFrozen or index.column() >= settings.FROZEN_COLUMNS:
+                return StationLineEdit(parent)
+            else:
+                return None
 
         elif 'date' in column_config[index.column()]['name']:
             editor = QtGui.QDateTimeEdit(parent)
@@ -81,9 +117,7 @@ class TableDelegate(QtGui.QStyledItemDelegate):
 
         elif 'lower_limit' in column_config[index.column()]:
             editor = QtGui.QLineEdit(parent)
-            validator = DoubleFixupValidator(index.column(), editor)
-            validator.setNotation(QtGui.QDoubleValidator.StandardNotation)
-            editor.setValidator(validator)
+            editor.setValidator(get_validator(index.column()))
             return editor
 
         # Generic editor for frozen columns
@@ -97,6 +131,13 @@ class TableDelegate(QtGui.QStyledItemDelegate):
         else:
             return super(TableDelegate, self).createEditor(parent, option, index)
 
+    def paint(self, painter, option, index):
+        # Frozen cells are drawn by the frozen table on top of the main
+        # table, so the main table does not draw them a second time
+        if not self.tableFrozen and index.column() < settings.FROZEN_COLUMNS:
+            return None
+        super(TableDelegate, self).paint(painter, option, index)
+
     def setEditorData(self, editor, index):
         value = index.model().data(index)
 
@@ -135,6 +176,14 @@ class TableDelegate(QtGui.QStyledItemDelegate):
         self.commitData.emit(editor)
         self.closeEditor.emit(editor, QtGui.QAbstractItemDelegate.EditNextItem)
 
+    def createListEditor(self, parent, column):
+        """Creates a filtered combo box over the shared items and validator
+        of a list column."""
+        editor = FilteredComboBox(parent, get_list_model(column))
+        editor.setValidator(get_validator(column))
+        editor.activated.connect(self.commitAndCloseEditor)
+        return editor
+
 
 ##############################################################################
 # Widgets
@@ -144,11 +193,16 @@ class FilteredComboBox(QtGui.QComboBox):
     Creates a combo box that filters the available options based on user
     input, in a similar way to jQuery.
     """
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, model=None):
         super(FilteredComboBox, self).__init__(parent)
 
         self.setFocusPolicy(QtCore.Qt.StrongFocus)
         self.setEditable(True)
+        if model is not None:
+            # Use a shared model of the items, which typed text must not be
+            # added to
+            self.setModel(model)
+            self.setInsertPolicy(QtGui.QComboBox.NoInsert)
 
         # Add a filter model to filter matching items
         self.pFilterModel = QtGui.QSortFilterProxyModel(self)
@@ -174,6 +228,37 @@ class FilteredComboBox(QtGui.QComboBox):
             self.setCurrentIndex(index)
 
 
+class StationLineEdit(QtGui.QLineEdit):
+    """
+    Line edit for station numbers that offers the stations whose number
+    starts with, or whose name contains, the text typed so far. Choosing a
+    station enters its number.
+    """
+    def __init__(self, parent=None):
+        super(StationLineEdit, self).__init__(parent)
+
+        # Model of the current completions, showing the number and name of
+        # each station and completing to the station number
+        self.completionModel = QtGui.QStandardItemModel(self)
+        self.completer = QtGui.QCompleter(self.completionModel, self)
+        self.completer.setCompletionMode(QtGui.QCompleter.UnfilteredPopupCompletion)
+        self.completer.setCompletionRole(QtCore.Qt.UserRole)
+        self.setCompleter(self.completer)
+
+        # Connect signals
+        self.textEdited[unicode].connect(self.updateCompletions)
+
+    def updateCompletions(self, text):
+        """Replaces the completions with the stations matching the text."""
+        self.completionModel.clear()
+        for number, name in get_station_index().complete(text):
+            item = QtGui.QStandardItem(u"%s  %s" % (number, name))
+            item.setData(number, QtCore.Qt.UserRole)
+            self.completionModel.appendRow(item)
+        if self.completionModel.rowCount():
+            self.completer.complete()
+
+
 ##############################################################################
 # Validator classes
 ##############################################################################
@@ -0,0 +1,384 @@
+"""
+Module: export.py
+Incremental export of the table data to the parameter-oriented format
+used for import to KiWQM.
+
+Author: Daniel Harris
+Title: Data & Procedures Officer
+Organisation: DPI Water
+Date modified: 19/10/2026
+
+External dependencies: PyQt4
+
+Exceptions:
+ExportCancelled: Raised when an export is cancelled by the user
+ExportIncomplete: Raised when a failed export cannot restore the files it
+    was replacing
+
+Classes:
+ExportCache: Cache of the previous export, used to re-transform only the
+    sampling events that have changed since.
+ExportWorker: Worker object that runs an export in a background thread.
+TableSnapshot: Typed column data and row versions of the table at a point
+    in time.
+"""
+
+# Standard library imports
+import collections
+import csv
+import hashlib
+import os
+import shutil
+import tempfile
+
+# Related third party imports
+from PyQt4 import QtCore
+
+# Local application imports
+import functions
+from functions import DatetimeError
+from settings import app_config
+
+__author__ = 'Daniel Harris'
+__date__ = '19 October 2026'
+__email__ = 'daniel.harris@dpi.nsw.gov.au'
+__status__ = 'Production'
+__version__ = '1.1.1'
+
+
+# Row versions (tuple) and values (tuple of tuples, one per column in
+# column_config order) of the table, as returned by TableModel.snapshot
+TableSnapshot = collections.namedtuple('TableSnapshot', ['versions', 'columns'])
+
+
+class ExportCancelled(Exception):
+    """
+    Custom exception raised when an export is cancelled by the user
+    """
+    pass
+
+
+class ExportIncomplete(Exception):
+    """
+    Custom exception raised when an export fails while replacing existing
+    files and the previous files cannot all be restored. Its argument is
+    the list of destination files left missing or out of date.
+    """
+    pass
+
+
+class ExportCache(object):
+    """
+    Keeps the output of the previous export for each row and sampling event.
+    Rows are identified by the version numbers maintained by TableModel,
+    which change every time a row is edited, so a sampling event whose rows
+    (and row order) are unchanged since the last export can reuse its
+    previous parameter-oriented output without being transformed again.
+    """
+    def __init__(self):
+        # Row version -> sample-oriented dictionary
+        self._samples = {}
+        # Tuple of row versions in a sampling event -> per-sample output
+        self._events = {}
+        # Sampling event (station, date) -> hash of the last exported output
+        self._hashes = {}
+        # Cache for the export prepared by update, awaiting commit
+        self._pending = None
+
+    def clear(self):
+        """Discard the cached export."""
+        self._samples = {}
+        self._events = {}
+        self._hashes = {}
+        self._pending = None
+
+    def commit(self):
+        """Keep the export prepared by the last call to update as the cached
+        export, once it has been written successfully."""
+        if self._pending:
+            self._samples, self._events, self._hashes = self._pending
+            self._pending = None
+
+    def update(self, snapshot, date_format, progress=None):
+        """
+        Prepare the export for a snapshot of the table data, transforming only
+        the sampling events containing rows that have changed since the last
+        export. The sample-oriented and parameter-oriented data are both
+        prepared in a single pass over the snapshot. The prepared export
+        replaces the cached export when commit is called.
+        :param snapshot: TableSnapshot of the table data
+        :param date_format: Date format of the sample dates
+        :param progress: Optional function called with the export phase
+            ('prepare' or 'transform'), the amount of work done and the
+            total amount of work in the phase.
+        :return: Tuple of (sample-oriented data, parameter-oriented data,
+            parameter-oriented data of the sampling events whose output has
+            changed since the last export)
+        """
+        versions = snapshot.versions
+        columns = list(enumerate(snapshot.columns))
+        column_order = app_config['column_order']
+
+        # Sample-oriented data, reusing the rows that have not changed
+        samples = {}
+        sample_list = []
+        for row, version in enumerate(versions):
+            try:
+                sample = self._samples[version]
+            except KeyError:
+                sample = dict((column_order[column], functions.format_export_value(column, values[row]))
+                              for column, values in columns)
+            samples[version] = sample
+            sample_list.append(sample)
+            if progress:
+                progress('prepare', row + 1, len(versions))
+
+        # Find the sampling events that have changed since the last export
+        groups = functions.get_event_groups(sample_list)
+        signatures = [tuple(versions[i] for i in indexes) for indexes in groups]
+        dirty = [(indexes, signature) for indexes, signature in zip(groups, signatures)
+                 if signature not in self._events]
+
+        # Transform copies so the cached sample-oriented rows are not modified
+        # by the transformation
+        events = {}
+        dirty_samples = []
+        for indexes, signature in dirty:
+            event_samples = [dict(sample_list[i]) for i in indexes]
+            functions.parse_sample_datetimes(event_samples, date_format)
+            dirty_samples.append(event_samples)
+        # Only use a process pool when there are enough rows to be worth it
+        row_count = sum(len(event_samples) for event_samples in dirty_samples)
+        if row_count < app_config['export']['parallel_min_rows']:
+            processes = 1
+        else:
+            processes = app_config['export']['processes']
+        if progress:
+            progress('transform', 0, len(dirty_samples))
+            transformProgress = lambda done, total: progress('transform', done, total)
+        else:
+            transformProgress = None
+        dirty_rows = functions.prepare_events(dirty_samples, date_format, processes, transformProgress)
+        for (indexes, signature), event_rows in zip(dirty, dirty_rows):
+            events[signature] = event_rows
+
+        hashes = {}
+        sample_rows = [None] * len(sample_list)
+        changed_rows = [None] * len(sample_list)
+        for indexes, signature in zip(groups, signatures):
+            event_rows = events.setdefault(signature, self._events.get(signature))
+            key = (sample_list[indexes[0]]['station_number'], sample_list[indexes[0]]['date'])
+            hashes[key] = self._eventHash(event_rows)
+            changed = hashes[key] != self._hashes.get(key)
+            for i, rows in zip(indexes, event_rows):
+                sample_rows[i] = rows
+                changed_rows[i] = rows if changed else []
+
+        # Keep only the current export so the cache does not grow over time
+        self._pending = samples, events, hashes
+
+        data_reformatted = [row for rows in sample_rows for row in rows]
+        data_changed = [row for rows in changed_rows for row in rows]
+        return sample_list, data_reformatted, data_changed
+
+    @staticmethod
+    def _eventHash(event_rows):
+        """
+        Returns a hash of the output of a sampling event. The fraction entry
+        time is excluded as it changes every time an event is transformed.
+        """
+        content = [sorted((k, v) for k, v in row.iteritems() if k != 'fraction_entry_datetime')
+                   for rows in event_rows for row in rows]
+        return hashlib.sha1(repr(content)).hexdigest()
+
+
+class ExportWorker(QtCore.QObject):
+    """
+    Runs an export from an immutable snapshot of the table in a background
+    thread, reporting progress for each phase of the export (prepare,
+    transform, write). The table is validated before the worker is started.
+    The files are written to a temporary directory and only moved to their
+    destination once the export is complete. Files they replace are kept
+    until every file has been moved, and put back if a move fails, so a
+    cancelled or failed export leaves the destination as it was.
+    """
+    progress = QtCore.pyqtSignal(str, int, int)
+    succeeded = QtCore.pyqtSignal()
+    failed = QtCore.pyqtSignal(unicode)
+    cancelled = QtCore.pyqtSignal()
+
+    def __init__(self, snapshot, exportCache, fileName, sampleOriented, parent=None):
+        super(ExportWorker, self).__init__(parent)
+        self.snapshot = snapshot
+        self.exportCache = exportCache
+        self.fileName = fileName
+        self.sampleOriented = sampleOriented
+        self._cancelRequested = False
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        """Runs the export. One of succeeded, failed or cancelled is emitted
+        when the export ends."""
+        tempDir = None
+        try:
+            tableData, data_reformatted, data_changed = self.exportCache.update(
+                self.snapshot, 'YYYY-MM-DD', self.reportProgress)
+            tempDir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(self.fileName)))
+            self.writeFiles(tempDir, tableData, data_reformatted, data_changed)
+            self.moveFiles(tempDir)
+            self.exportCache.commit()
+        except ExportCancelled:
+            self.cancelled.emit()
+        except DatetimeError:
+            self.failed.emit(u"One or more dates or times could not be read. Please check the dates and times "
+                             u"in the table and try again.")
+        except ExportIncomplete as e:
+            self.failed.emit(u"There was an error replacing the existing export files. The following files "
+                             u"may now be missing or out of date:\n" + u"\n".join(e.args[0]))
+        except (IOError, OSError):
+            self.failed.emit(u"There was an error exporting your file.")
+        except Exception:
+            # Any other error, such as a value that cannot be transformed,
+            # must still end the export so the progress dialog is closed
+            self.failed.emit(u"There was an error preparing the data for export. Please check the values "
+                             u"in the table and try again.")
+        else:
+            self.succeeded.emit()
+        finally:
+            if tempDir:
+                shutil.rmtree(tempDir, ignore_errors=True)
+
+    def cancel(self):
+        """Requests that the export stops. Must be called directly rather
+        than through a signal, as the worker thread is busy running the
+        export."""
+        self._cancelRequested = True
+
+    def moveFiles(self, directory):
+        """
+        Moves the completed export files to the destination folder. Files
+        being replaced are first moved aside into the temporary directory,
+        and are put back if any file cannot be moved into place. Chunks of
+        a previous export that the new export does not replace are moved
+        aside with them, so they are deleted along with the temporary
+        directory once the export is complete.
+        :param directory: Temporary directory holding the completed files
+        :return: None
+        """
+        destinationDir = os.path.dirname(os.path.abspath(self.fileName))
+        names = os.listdir(directory)
+        backupDir = os.path.join(directory, 'previous')
+        os.mkdir(backupDir)
+        # Destination, moved aside previous file and whether the new file
+        # has been moved into place, for each file
+        moved = []
+        try:
+            for fn in self.staleFiles(destinationDir, names):
+                backup = os.path.join(backupDir, fn)
+                os.rename(os.path.join(destinationDir, fn), backup)
+                moved.append([os.path.join(destinationDir, fn), backup, False])
+            for fn in names:
+                destination = os.path.join(destinationDir, fn)
+                backup = None
+                if os.path.exists(destination):
+                    backup = os.path.join(backupDir, fn)
+                    os.rename(destination, backup)
+                moved.append([destination, backup, False])
+                os.rename(os.path.join(directory, fn), destination)
+                moved[-1][2] = True
+        except (IOError, OSError):
+            # Put the previous files back, reporting any that cannot be
+            incomplete = []
+            for destination, backup, replaced in reversed(moved):
+                try:
+                    if replaced:
+                        os.remove(destination)
+                    if backup is not None:
+                        os.rename(backup, destination)
+                except (IOError, OSError):
+                    incomplete.append(destination)
+            if incomplete:
+                raise ExportIncomplete(sorted(incomplete))
+            raise
+
+    def staleFiles(self, destinationDir, names):
+        """
+        Finds the files of a previous chunked export that the new export
+        does not replace: the chunks listed in the previous manifest and,
+        if the new export is not chunked, the manifest itself.
+        :param destinationDir: Destination folder of the export
+        :param names: Names of the files of the new export
+        :return: List of file names in the destination folder
+        """
+        name, ext = os.path.splitext(os.path.basename(self.fileName))
+        manifestName = name + '_manifest' + (ext or '.csv')
+        manifestPath = os.path.join(destinationDir, manifestName)
+        if not os.path.exists(manifestPath):
+            return []
+        stale = [] if manifestName in names else [manifestName]
+        try:
+            with open(manifestPath, 'rb') as f:
+                for row in csv.DictReader(f):
+                    # Only files beside the manifest belong to the export
+                    fn = os.path.basename(row.get('file_name') or '')
+                    if fn and fn not in names and fn not in stale and \
+                            os.path.exists(os.path.join(destinationDir, fn)):
+                        stale.append(fn)
+        except (IOError, csv.Error):
+            # An unreadable manifest is replaced without removing any chunks
+            pass
+        return stale
+
+    def reportProgress(self, phase, done, total):
+        """
+        Emits the progress of the export, raising ExportCancelled if the
+        user has cancelled the export.
+        :param phase: Name of the export phase
+        :param done: Amount of work done in the phase
+        :param total: Total amount of work in the phase
+        """
+        if self._cancelRequested:
+            raise ExportCancelled
+        # Limit the number of signals for large tables
+        if done == total or done % max(1, total // 100) == 0:
+            self.progress.emit(phase, done, total)
+
+    def writeFiles(self, directory, tableData, data_reformatted, data_changed):
+        """
+        Writes the export files to the given directory.
+        :param directory: Directory to write the files to
+        :param tableData: Sample-oriented data
+        :param data_reformatted: Parameter-oriented data
+        :param data_changed: Parameter-oriented data of the sampling events
+            changed since the last export
+        :return: None
+        """
+        name, ext = os.path.splitext(os.path.basename(self.fileName))
+        fileName = os.path.join(directory, name + (ext or '.csv'))
+        writeDelta = app_config['export']['write_delta']
+        total = 1 + int(self.sampleOriented) + int(bool(writeDelta))
+        done = 0
+        self.reportProgress('write', done, total)
+
+        # Write to sample oriented file for QA
+        if self.sampleOriented:
+            fn = os.path.join(directory, name + '_sampleOriented' + '.csv')
+            functions.write_to_csv(tableData, fn, app_config['column_order'])
+            done += 1
+            self.reportProgress('write', done, total)
+        # Write the sampling events changed since the last export
+        if writeDelta:
+            fn = os.path.join(directory, name + '_delta' + '.csv')
+            functions.write_to_csv(data_changed, fn, app_config['csv_fieldnames'])
+            done += 1
+            self.reportProgress('write', done, total)
+        # Write to parameter oriented file for import to KiWQM, split into
+        # chunks if an export budget has been configured
+        maxRows = app_config['export']['chunk_max_rows']
+        maxBytes = app_config['export']['chunk_max_bytes']
+        if maxRows or maxBytes:
+            functions.write_chunked_csv(data_reformatted, fileName, app_config['csv_fieldnames'],
+                                        maxRows, maxBytes)
+        else:
+            functions.write_to_csv(data_reformatted, fileName, app_config['csv_fieldnames'])
+        self.reportProgress('write', total, total)
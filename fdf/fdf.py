@@ -12,6 +12,7 @@ External dependencies: PyYAML, PyQT4
 
 Classes:
 MainApp: Constructor for the main application.
+StartupTimer: Records the time taken by each phase of startup
 TableModel: Model part of PyQT MVC framework for storing the tabular data
 
 Functions:
@@ -19,23 +20,37 @@ Main: Runs the Field Data Formatter app.
 """
 
 # Standard library imports
+import time
+# Launch time, taken before the remaining imports for the startup timing report
+LAUNCH_TIME = time.time()
+import array
+import collections
 import datetime
-import operator
+import itertools
+import multiprocessing
 import os
 import sys
-import urllib2
 
 # Related third party imports
-import yaml
 from PyQt4 import QtGui, QtCore
 
 # Local application imports
+import clipboard
 import fdfGui
 import functions
 import settings
+import storage
+import undo
+from export import ExportCache, ExportWorker, TableSnapshot
 from functions import ValidityError, DatetimeError
+from journal import Journal, JournalStore, delete_session, encode_store, find_sessions, get_session_path, \
+    has_session, restore_session
 from settings import app_config, column_config
 from delegates import TableDelegate
+from search import FILTER_BETWEEN, FILTER_IN, SearchIndex, get_filter_description
+from storage import KIND_TEXT, SampleStore, create_store
+from validation import EventIndex, ValidationIndex, validate_value
+from versioncheck import VersionCheckWorker
 
 __author__ = 'Daniel Harris'
 __date__ = '6 December 2017'
@@ -44,21 +59,59 @@ __status__ = 'Production'
 __version__ = '1.1.1'
 
 
+# Shared brushes for cell backgrounds
+BRUSH_INVALID = QtGui.QBrush(QtCore.Qt.red)
+BRUSH_VALID = QtGui.QBrush(QtCore.Qt.white)
+
+
 ###############################################################################
 # Models
 ###############################################################################
 class TableModel(QtCore.QAbstractTableModel):
     # Define a signal for use in the view
     verticalHeaderChanged = QtCore.pyqtSignal()
+    rowsPermuted = QtCore.pyqtSignal()
 
-    def __init__(self, undoStack, samples=[], headers=[], parent=None):
+    def __init__(self, undoStack, samples=None, headers=[], parent=None):
         QtCore.QAbstractTableModel.__init__(self, parent)
-        self._samples = samples
+        # Typed columnar storage. Values are only converted to Qt types at
+        # the data() boundary (see qtValue).
+        self._samples = samples if samples is not None else SampleStore()
         self._headers = headers
         self.undoStack = undoStack
-
-        if not self._samples:
-            self._samples.append(self.defaultData())
+        # Sort requests from the views are ignored while this is set
+        self.sortSuspended = False
+
+        if not len(self._samples):
+            self._samples.insert(0, 1)
+        # Number of rows shown in the views. Rows beyond are held in the
+        # store and validated, but only added to the views a page at a time
+        # as the user scrolls (see fetchMore).
+        self._loaded = len(self._samples)
+
+        # Each row carries a version number that changes whenever the row is
+        # edited, so that unchanged rows can be identified between exports.
+        self._versionCounter = itertools.count(1)
+        self._rowVersions = [next(self._versionCounter) for row in range(len(self._samples))]
+
+        # Invalid and missing required cells, kept up to date with the data
+        self.validationIndex = ValidationIndex(self._samples)
+        # Matrices and sequence numbers of each sampling event
+        self.eventIndex = EventIndex(self._samples)
+        # Indexes of the column values for filtering the rows
+        self.searchIndex = SearchIndex(self._samples)
+
+        # Changed rows of each column, collected between beginChanges and
+        # endChanges so the views are notified once per batch of changes
+        self._changeDepth = 0
+        self._changedRows = {}
+
+        # Cache of the display value, background brush and tooltip of each
+        # rendered cell. Only the most recently drawn pages of rows are kept,
+        # each as a dictionary of rows for each column.
+        self._renderPageRows = app_config['table']['page_rows']
+        self._renderCachePages = max(1, app_config['table']['render_cache_pages'])
+        self.clearRenderCache()
 
     ##########################################################################
     # Reimplemented methods
@@ -66,34 +119,33 @@ class TableModel(QtCore.QAbstractTableModel):
     def columnCount(self, parent=None):
         return len(column_config)
 
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return self._loaded < len(self._samples)
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        self.fetchTo(self._loaded + app_config['table']['page_rows'] - 1)
+
     def rowCount(self, parent=None):
-        return len(self._samples)
+        return self._loaded
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
         row = index.row()
         column = index.column()
-        value = self._samples[row][column]
 
         if role == QtCore.Qt.DisplayRole:
-            # Dates and times
-            if type(value) in (QtCore.QDate, QtCore.QTime):
-                value = value.toString(QtCore.Qt.ISODate)
-            # Floating point numbers
-            if value and 'lower_limit' in column_config[column]:
-                value = QtCore.QString.number(value, 'f', column_config[column]['precision'])
-            return value
+            return self.renderCell(row, column)[0]
 
         if role == QtCore.Qt.EditRole:
-            return value
+            return self.qtValue(row, column)
 
         if role == QtCore.Qt.TextAlignmentRole:
             return QtCore.Qt.AlignCenter | QtCore.Qt.AlignVCenter
 
         if role == QtCore.Qt.BackgroundRole:
-            return self.validateData(value, index)[0]
+            return self.renderCell(row, column)[1]
 
         if role == QtCore.Qt.ToolTipRole:
-            return self.validateData(value, index)[1]
+            return self.renderCell(row, column)[2]
 
     def flags(self, index):
         if index.column() == functions.get_column_number('sampling_number'):
@@ -107,110 +159,44 @@ class TableModel(QtCore.QAbstractTableModel):
             if orientation == QtCore.Qt.Horizontal:
                 return column_config[section]['display_name']
             else:
-                self.verticalHeaderChanged.emit()
                 return section + 1
 
     def insertRows(self, position, rows, parent=QtCore.QModelIndex()):
         self.beginInsertRows(parent, position, position + rows - 1)
+        self._samples.insert(position, rows)
+        self.validationIndex.insert(position, rows)
+        self.eventIndex.insert(position, rows)
+        self.searchIndex.insert(position, rows)
         for i in range(rows):
-            self._samples.insert(position, self.defaultData())
+            self._rowVersions.insert(position, next(self._versionCounter))
+        self._loaded += rows
+        self.clearRenderCache()
         self.endInsertRows()
+        self.verticalHeaderChanged.emit()
         return True
 
     def removeRows(self, position, rows, parent=QtCore.QModelIndex()):
-        self.beginRemoveRows(parent, position, position + rows - 1)
-        for i in range(rows):
-            del self._samples[position + i]
-        self.endRemoveRows()
+        # Rows that have not been fetched yet are removed from the store
+        # without notifying the views
+        shownRows = max(0, min(position + rows, self._loaded) - position)
+        if shownRows:
+            self.beginRemoveRows(parent, position, position + shownRows - 1)
+        self._samples.remove(position, rows)
+        self.validationIndex.remove(position, rows)
+        self.eventIndex.remove(position, rows)
+        self.searchIndex.remove(position, rows)
+        del self._rowVersions[position:position + rows]
+        self._loaded -= shownRows
+        self.clearRenderCache()
+        if shownRows:
+            self.endRemoveRows()
+            self.verticalHeaderChanged.emit()
         return True
 
     def setData(self, index, value, role=QtCore.Qt.EditRole, *args, **kwargs):
         if index.isValid() and role == QtCore.Qt.EditRole:
-            row = index.row()
-            column = index.column()
-
-            dateFormat = kwargs.get('dateFormat')
-
-            # Date as QDate object
-            if column == functions.get_column_number('date'):
-                if type(value) is QtCore.QDate:
-                    pass
-                else:
-                    # Change value to a string so it can be parsed
-                    date = str(value)
-                    try:
-                        dt_dayfirst = True if dateFormat[:2] == 'dd' else False
-                    except TypeError:
-                        dt_dayfirst = False
-                    try:
-                        dt_yearfirst = True if dateFormat[:2] == 'YY' else False
-                    except TypeError:
-                        dt_yearfirst = False
-                    try:
-                        dt = functions.parse_datetime_from_string(date, "", dayfirst=dt_dayfirst, yearfirst=dt_yearfirst)
-                        value = QtCore.QDate(dt.year, dt.month, dt.day)
-                    except DatetimeError:
-                        value = ""
-
-            # Time as QTime object
-            if column == functions.get_column_number('time'):
-                if type(value) is QtCore.QTime:
-                    pass
-                else:
-                    # Change value to a string so it can be parsed
-                    time = str(value)
-                    dt = functions.parse_datetime_from_string("", time)
-                    value = QtCore.QTime(dt.hour, dt.minute, dt.second)
-
-            # Update sampling number
-            if column in (functions.get_column_number('station_number'),
-                          functions.get_column_number('date'),
-                          functions.get_column_number('sample_type')):
-                sampling_number = self.getSamplingNumber(value, index)
-                self._samples[row][functions.get_column_number('sampling_number')] = sampling_number
-                # Tell the view that the sampling number has changed
-                idxChanged = self.index(row, functions.get_column_number('sampling_number'))
-                self.dataChanged.emit(idxChanged, idxChanged)
-
-            # Floating point numbers
-            if value and 'lower_limit' in column_config[column]:
-                value = float(value)
-
-            # Update coordinate values
-            if column in [functions.get_column_number('latitude'), functions.get_column_number('longitude')]:
-                try:
-                    if column == functions.get_column_number('latitude'):
-                        # Ensure latitude is always south (negative)
-                        if value > 0:
-                            value *= -1
-                        latitude = value
-                        longitude = self.data(self.index(row, functions.get_column_number('longitude')),
-                                              QtCore.Qt.EditRole)
-                    else:
-                        latitude = self.data(self.index(row, functions.get_column_number('latitude')),
-                                             QtCore.Qt.EditRole)
-                        longitude = value
-
-                    # Calculate MGA94 coordinates
-                    easting, northing, map_zone = functions.get_mga_coordinates(latitude, longitude)
-
-                    # Set MGA94 coordinates
-                    self._samples[row][functions.get_column_number('easting')] = easting
-                    idxChanged = self.index(row, functions.get_column_number('easting'))
-                    self.dataChanged.emit(idxChanged, idxChanged)
-
-                    self._samples[row][functions.get_column_number('northing')] = northing
-                    idxChanged = self.index(row, functions.get_column_number('northing'))
-                    self.dataChanged.emit(idxChanged, idxChanged)
-
-                    self._samples[row][functions.get_column_number('map_zone')] = map_zone
-                    idxChanged = self.index(row, functions.get_column_number('map_zone'))
-                    self.dataChanged.emit(idxChanged, idxChanged)
-                except ValueError:
-                    pass
-
-            self._samples[row][column] = value
-            self.dataChanged.emit(index, index)
+            # Edits made in the views are undoable
+            self.pushValues([index.row()], [index.column()], [self.toPyValue(value)], u"Item edited")
             return True
 
         return False
@@ -218,31 +204,158 @@ class TableModel(QtCore.QAbstractTableModel):
     ##########################################################################
     # Private methods
     ##########################################################################
+    def appendRows(self, rows, dateFormat=None):
+        """
+        Appends a batch of rows, such as those loaded from an instrument
+        file, to the end of the model in a single insert. Values are
+        converted and the derived values (sampling numbers and MGA94
+        coordinates) calculated a column at a time, and the new rows are
+        validated in one pass, rather than cell by cell through setData.
+        :param rows: List of rows, each a list of values in column order
+        :param dateFormat: Date format of the dates in the rows
+        :return: Tuple of the number of invalid values in the appended rows
+        and the number of values that could not be read as a date, time or
+        number and were left empty
+        """
+        if not rows:
+            return 0, 0
+        count = len(rows)
+        columns = [list(values) for values in zip(*rows)]
+        columns += [[u""] * count for column in range(len(columns), self.columnCount())]
+
+        # Convert values to the types used in storage. Dates and times are
+        # parsed once for each distinct value. Values that cannot be read are
+        # left empty and counted so the user can be warned.
+        unreadable = 0
+        for column, values in enumerate(columns):
+            kind = self._samples.kind(column)
+            if kind == storage.KIND_DATE:
+                parsed = functions.map_distinct(lambda v: self.parseDate(v, dateFormat), values)
+            elif kind == storage.KIND_TIME:
+                parsed = functions.map_distinct(self.parseTime, values)
+            elif kind == storage.KIND_NUMBER:
+                parsed = [self.parseNumber(value) for value in values]
+            else:
+                continue
+            unreadable += sum(1 for value, result in itertools.izip(values, parsed)
+                              if result is None and not self.isBlank(value))
+            columns[column] = parsed
+
+        # Ensure latitude is always south (negative)
+        latitudes = columns[functions.get_column_number('latitude')]
+        longitudes = columns[functions.get_column_number('longitude')]
+        latitudes[:] = [-value if value > 0 else value for value in latitudes]
+
+        # Sampling numbers
+        columns[functions.get_column_number('sampling_number')] = [
+            functions.get_sampling_number(station_number, date, sample_type)
+            for station_number, date, sample_type in zip(columns[functions.get_column_number('station_number')],
+                                                         columns[functions.get_column_number('date')],
+                                                         columns[functions.get_column_number('sample_type')])]
+
+        # MGA94 coordinates, where both latitude and longitude are present
+        eastings = columns[functions.get_column_number('easting')]
+        northings = columns[functions.get_column_number('northing')]
+        mapZones = columns[functions.get_column_number('map_zone')]
+        for i, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+            if latitude is None or longitude is None:
+                continue
+            try:
+                eastings[i], northings[i], mapZones[i] = functions.get_mga_coordinates(latitude, longitude)
+            except (ValueError, TypeError):
+                pass
+
+        # Validation covers all of the appended rows, but only the first page
+        # is shown until the user scrolls to it
+        position = len(self._samples)
+        self._samples.extend(columns)
+        invalid = self.validationIndex.insert(position, count)
+        eventsChanged = self.eventIndex.insert(position, count)
+        self.searchIndex.insert(position, count)
+        self._rowVersions.extend(next(self._versionCounter) for i in range(count))
+        if self._loaded == position:
+            self.fetchMore()
+        if eventsChanged:
+            self.refreshEventColumns()
+        return invalid, unreadable
+
+    def beginChanges(self):
+        """
+        Starts a batch of changes. Change notifications are collected until
+        the matching endChanges. Batches can be nested.
+        :return: None
+        """
+        self._changeDepth += 1
+
+    def endChanges(self):
+        """
+        Ends a batch of changes, notifying the views of the changed cells
+        with as few dataChanged signals as possible. Columns with the same
+        changed rows are combined into a single rectangle.
+        :return: None
+        """
+        self._changeDepth -= 1
+        if self._changeDepth:
+            return None
+        self._samples.flush()
+        changedRows, self._changedRows = self._changedRows, {}
+        rectangles = {}
+        for column, (firstRow, lastRow) in changedRows.iteritems():
+            columns = rectangles.setdefault((firstRow, lastRow), [column, column])
+            columns[0] = min(columns[0], column)
+            columns[1] = max(columns[1], column)
+        for (firstRow, lastRow), (firstColumn, lastColumn) in rectangles.iteritems():
+            # Rows may have been removed since the change
+            lastRow = min(lastRow, self.rowCount() - 1)
+            if firstRow <= lastRow:
+                self.dataChanged.emit(self.index(firstRow, firstColumn), self.index(lastRow, lastColumn))
+
+    def notifyChanged(self, firstRow, lastRow, column):
+        """
+        Notifies the views that a range of rows has changed in a column,
+        at the end of the current batch of changes.
+        :param firstRow: First changed row
+        :param lastRow: Last changed row
+        :param column: Column of the changed rows
+        :return: None
+        """
+        self.beginChanges()
+        rows = self._changedRows.get(column)
+        if rows is None:
+            self._changedRows[column] = [firstRow, lastRow]
+        else:
+            rows[0] = min(rows[0], firstRow)
+            rows[1] = max(rows[1], lastRow)
+        self.endChanges()
+
+    def closeStore(self):
+        """
+        Closes the storage of the samples when the application closes.
+        :return: None
+        """
+        self._samples.close()
+
+    def fetchTo(self, row):
+        """
+        Adds the rows held in the store up to a given row to the views.
+        :param row: Last row to show
+        :return: None
+        """
+        lastRow = min(row, len(self._samples) - 1)
+        if lastRow < self._loaded:
+            return None
+        self.beginInsertRows(QtCore.QModelIndex(), self._loaded, lastRow)
+        self._loaded = lastRow + 1
+        self.endInsertRows()
+        self.verticalHeaderChanged.emit()
+
     def checkMatrixConsistency(self):
         """
         Checks that all samples in a single sampling use the same matrix.
         This is a requirement for KiWQM.
         :return: Boolean indicating if matrix is consistent or not
         """
-        matrix_consistent = True
-        matrix_list = []
-
-        for row in range(self.rowCount()):
-            matrix_list.append(
-                (self._samples[row][functions.get_column_number('mp_number')],
-                 self._samples[row][functions.get_column_number('sample_matrix')],
-                 self._samples[row][functions.get_column_number('sampling_number')])
-            )
-
-        for sample in matrix_list:
-            # Get a list of all matrices in a single sampling.
-            sampling_matrix = [x for (m, x, s) in matrix_list if m == sample[0] and s == sample[2]]
-            # Check that each sampling only has one matrix
-            if len(set(sampling_matrix)) > 1:
-                matrix_consistent = False
-                break
-
-        return matrix_consistent
+        return not self.eventIndex.hasMatrixErrors()
 
     def checkSequenceNumbers(self):
         """
@@ -250,194 +363,702 @@ class TableModel(QtCore.QAbstractTableModel):
         numbers and that they start at 1 and increment sequentially.
         :return: Boolean indicating if sequence numbers are acceptable
         """
-        sequence_correct = True
-        sequence_list = []
+        return not self.eventIndex.hasSequenceErrors()
+
+    def clearRenderCache(self):
+        """
+        Clears the render cache of all cells, for changes that move rows.
+        :return: None
+        """
+        self._renderCache = collections.OrderedDict()
+        # Page last drawn, looked up without reordering the cache
+        self._renderPageNumber = None
+        self._renderPage = None
 
+    def parseDate(self, value, dateFormat):
+        """
+        Parses a date entered or loaded as text.
+        :param value: Date as a string
+        :param dateFormat: Date format used to determine the order of the day,
+        month and year
+        :return: datetime.date object, None if the date cannot be parsed
+        """
         try:
-            for row in range(self.rowCount()):
-                sequence_list.append(
-                    (self._samples[row][functions.get_column_number('mp_number')],
-                     self._samples[row][functions.get_column_number('sample_cid')],
-                     self._samples[row][functions.get_column_number('sampling_number')],
-                     self._samples[row][functions.get_column_number('location_id')],
-                     self._samples[row][functions.get_column_number('sample_collected')])
-                )
-
-            for sample in sequence_list:
-                # Get a list of all sequence numbers at a single location in a
-                # single sampling.
-                sequence_numbers = [
-                    int(s) for (m, s, n, l, c) in sequence_list if
-                    m == sample[0] and
-                    n == sample[2] and
-                    l == sample[3] and
-                    c != "NO"
-                    ]
-                # Check that sequence numbers in a single sampling are distinct,
-                # start at 1, and increment sequentially
-                if not all(a == b for a, b in list(enumerate(sorted(sequence_numbers), start=1))):
-                    sequence_correct = False
-
-        # If we are missing sampling numbers or location IDs then we will get a ValueError
+            dt_dayfirst = True if dateFormat[:2] == 'dd' else False
+        except TypeError:
+            dt_dayfirst = False
+        try:
+            dt_yearfirst = True if dateFormat[:2] == 'YY' else False
+        except TypeError:
+            dt_yearfirst = False
+        try:
+            # Change value to a string so it can be parsed
+            date = unicode(value)
+            return functions.parse_datetime_from_string(date, "", dayfirst=dt_dayfirst, yearfirst=dt_yearfirst).date()
+        except (DatetimeError, UnicodeError):
+            return None
+
+    @staticmethod
+    def parseNumber(value):
+        """
+        Converts a loaded value to a float.
+        :param value: Number as a string or number
+        :return: Float value, None if the value is empty or not a number
+        """
+        if value is None or value == "":
+            return None
+        try:
+            return float(value)
         except ValueError:
-            sequence_correct = False
+            return None
 
-        return sequence_correct
+    @staticmethod
+    def parseTime(value):
+        """
+        Parses a time loaded as text.
+        :param value: Time as a string
+        :return: datetime.time object, None if the time cannot be parsed
+        """
+        try:
+            return functions.parse_datetime_from_string("", unicode(value)).time()
+        except (DatetimeError, UnicodeError):
+            return None
 
-    def defaultData(self):
+    @staticmethod
+    def isBlank(value):
         """
-        Generates a row of empty QStrings to initialise an empty data row
-        :return: List of QStrings
+        Checks whether a loaded value is empty.
+        :param value: Value as loaded
+        :return: True if the value is None or only whitespace
         """
-        defaultValues = [QtCore.QString("") for column in range(len(column_config))]
-        defaultValues[functions.get_column_number('date')] = QtCore.QDate()
-        defaultValues[functions.get_column_number('time')] = QtCore.QTime()
-        return defaultValues
+        return value is None or (isinstance(value, basestring) and not value.strip())
 
-    def getSamplingNumber(self, value, index):
+    def getKind(self, column):
+        """
+        Returns the storage kind of a column.
+        :param column: Column number
+        :return: One of the storage module's KIND constants
+        """
+        return self._samples.kind(column)
+
+    def getRange(self, topRow, leftColumn, rows, columns):
+        """
+        Returns a block of values from the model's storage, clipped to the
+        size of the table.
+        :param topRow: Row of the top left cell
+        :param leftColumn: Column of the top left cell
+        :param rows: Number of rows in the block
+        :param columns: Number of columns in the block
+        :return: List of rows, each a list of values as Python types
+        """
+        rowRange = range(topRow, min(topRow + rows, self.rowCount()))
+        columnRange = range(leftColumn, min(leftColumn + columns, self.columnCount()))
+        return [[self._samples.get(row, column) for column in columnRange] for row in rowRange]
+
+    def getValue(self, row, column):
+        """
+        Returns a value from the model's storage.
+        :param row: Row of the value
+        :param column: Column of the value
+        :return: Value as a Python type
+        """
+        return self._samples.get(row, column)
+
+    def getSamplingNumber(self, row):
         """
         Returns a new sampling number
-        :param value: The value to use for the update. This will be the
-        station number, date or sample type.
-        :index: Model index of the value
+        :param row: Row of the sample
         :return: String of well-formatted sampling identification number
         """
-        row = index.row()
-        column = index.column()
+        return functions.get_sampling_number(
+            self._samples.get(row, functions.get_column_number('station_number')),
+            self._samples.get(row, functions.get_column_number('date')),
+            self._samples.get(row, functions.get_column_number('sample_type')))
 
-        if column == functions.get_column_number('station_number'):
-            station_number = value
-            date = self._samples[row][functions.get_column_number('date')].toPyDate() \
-                .strftime(app_config['datetime_formats']['date']['sampling_number'])
-            sample_type = self._samples[row][functions.get_column_number('sample_type')]
+    def restoreRows(self, position, block):
+        """
+        Inserts rows holding previously removed values, without deriving
+        any values from them.
+        :param position: Row number of the first row to insert
+        :param block: List of rows, each a list of values as Python types for
+        every column
+        :return: None
+        """
+        count = len(block)
+        self.beginInsertRows(QtCore.QModelIndex(), position, position + count - 1)
+        self._samples.insert(position, count)
+        for row, values in enumerate(block, start=position):
+            for column, value in enumerate(values):
+                self._samples.set(row, column, value)
+        self._samples.flush()
+        self.validationIndex.insert(position, count)
+        self.eventIndex.insert(position, count)
+        self.searchIndex.insert(position, count)
+        self._rowVersions[position:position] = [next(self._versionCounter) for i in range(count)]
+        self._loaded += count
+        self.clearRenderCache()
+        self.endInsertRows()
+        self.verticalHeaderChanged.emit()
 
-        elif column == functions.get_column_number('date') and value:
-            station_number = self._samples[row][functions.get_column_number('station_number')]
-            date = value.toPyDate().strftime(app_config['datetime_formats']['date']['sampling_number'])
-            sample_type = self._samples[row][functions.get_column_number('sample_type')]
+    def setCells(self, rows, columns, values, dateFormat=None):
+        """
+        Sets the values of a set of cells, with a single change notification
+        for the views.
+        :param rows: Sequence of the row of each cell
+        :param columns: Sequence of the column of each cell
+        :param values: Iterable of the value for each cell
+        :param dateFormat: Date format of dates given as text
+        :return: None
+        """
+        self.beginChanges()
+        for row, column, value in itertools.izip(rows, columns, values):
+            for changedColumn in self.setValue(row, column, value, dateFormat):
+                self.notifyChanged(row, row, changedColumn)
+        self.endChanges()
 
-        elif column == functions.get_column_number('sample_type'):
-            station_number = self._samples[row][functions.get_column_number('station_number')]
-            date = self._samples[row][functions.get_column_number('date')].toPyDate() \
-                .strftime(app_config['datetime_formats']['date']['sampling_number'])
-            sample_type = value
+    def setRange(self, topRow, leftColumn, block, dateFormat=None):
+        """
+        Sets a block of values, such as a block pasted from Excel, with a
+        single change notification for the views. Values falling outside
+        the table are ignored.
+        :param topRow: Row of the top left cell
+        :param leftColumn: Column of the top left cell
+        :param block: List of rows, each a list of values as text, Qt or
+        Python types
+        :param dateFormat: Date format of dates given as text
+        :return: None
+        """
+        self.beginChanges()
+        rows = block[:max(0, self.rowCount() - topRow)]
+        for row, values in enumerate(rows, start=topRow):
+            for column, value in enumerate(values[:max(0, self.columnCount() - leftColumn)], start=leftColumn):
+                for changedColumn in self.setValue(row, column, value, dateFormat):
+                    self.notifyChanged(row, row, changedColumn)
+        self.endChanges()
+
+    def setValue(self, row, column, value, dateFormat=None):
+        """
+        Sets a single value in the model's storage, converting it to the
+        column's type and updating the values derived from it (the sampling
+        number and MGA94 coordinates). Does not notify the views.
+        :param row: Row of the value
+        :param column: Column of the value
+        :param value: Value as text, a Qt type or a Python type
+        :param dateFormat: Date format of a date given as text
+        :return: List of the columns changed in the row
+        """
+        value = self.toPyValue(value)
+        kind = self._samples.kind(column)
+        if value is not None:
+            # Dates and times given as text
+            if kind == storage.KIND_DATE and not isinstance(value, datetime.date):
+                value = self.parseDate(value, dateFormat)
+            elif kind == storage.KIND_TIME and not isinstance(value, datetime.time):
+                value = self.parseTime(value)
+            # Floating point numbers
+            elif kind == storage.KIND_NUMBER:
+                value = self.parseNumber(value)
+
+        # Ensure latitude is always south (negative)
+        if column == functions.get_column_number('latitude') and value > 0:
+            value *= -1
+
+        self._samples.set(row, column, value)
+        self.invalidateCell(row, column)
+        changedColumns = [column]
+
+        # Update sampling number
+        if column in (functions.get_column_number('station_number'),
+                      functions.get_column_number('date'),
+                      functions.get_column_number('sample_type')):
+            self._samples.set(row, functions.get_column_number('sampling_number'), self.getSamplingNumber(row))
+            self.invalidateCell(row, functions.get_column_number('sampling_number'))
+            changedColumns.append(functions.get_column_number('sampling_number'))
+
+        # Update coordinate values
+        if column in (functions.get_column_number('latitude'), functions.get_column_number('longitude')):
+            latitude = self._samples.get(row, functions.get_column_number('latitude'))
+            longitude = self._samples.get(row, functions.get_column_number('longitude'))
+            coordinates = None
+            if latitude is not None and longitude is not None:
+                try:
+                    # Calculate MGA94 coordinates
+                    coordinates = functions.get_mga_coordinates(latitude, longitude)
+                except (ValueError, TypeError):
+                    pass
+            if coordinates:
+                for name, coordinate in zip(('easting', 'northing', 'map_zone'), coordinates):
+                    self._samples.set(row, functions.get_column_number(name), coordinate)
+                    self.invalidateCell(row, functions.get_column_number(name))
+                    changedColumns.append(functions.get_column_number(name))
 
-        else:
-            station_number = self._samples[row][functions.get_column_number('station_number')]
-            date = self._samples[row][functions.get_column_number('date')].toPyDate() \
-                .strftime(app_config['datetime_formats']['date']['sampling_number'])
-            sample_type = self._samples[row][functions.get_column_number('sample_type')]
-
-        # Create the sampling number in format STATION#-DDMMYY[-SAMPLE_TYPE]
-        # Check if any components are empty or if date is not valid
-        if (not station_number) or (not date) or date == '010123':
-            sampling_number = ""
-        elif sample_type in ["QR", "QB", "QT"]:
-            sampling_number = QtCore.QString("%1-%2-%3").arg(station_number).arg(date).arg(sample_type)
-        else:
-            sampling_number = QtCore.QString("%1-%2").arg(station_number).arg(date)
-        return QtCore.QString(sampling_number)
+        self._rowVersions[row] = next(self._versionCounter)
+        return changedColumns
 
-    def resetData(self):
+    def totalRowCount(self):
         """
-        Reset all data in model
-        :return: None
+        Returns the number of rows in the table, including the rows not yet
+        fetched into the views.
+        :return: Number of rows
         """
-        for i in range(self.rowCount(), 0, -1):
-            self.removeRow(i - 1)
+        return len(self._samples)
 
-    def validateData(self, value, index):
+    def snapshot(self):
         """
-        Validates model data and returns a cell colour and tooltip for
-        invalid cells.
-        :param value: Value to be validated
-        :param index: Model index of the value to be validated
-        :return: QBrush colour and tooltip text
+        Returns a snapshot of the model data as typed Python values, read
+        directly from the model without display formatting. Dates and times
+        are returned as datetime.date and datetime.time objects (None if
+        missing or invalid) and text as unicode.
+        :return: TableSnapshot of the row versions and a tuple of values for
+        each column
         """
-        # Zero values must be test first because second test will return False
-        if value == 0 and 'lower_limit' in column_config[index.column()]:
-            text = "Given value is zero (0). A value of zero generally indicates a sensor failure, " \
-                   "or a non-measured parameter. Please review and adjust before continuing."
-            return QtGui.QBrush(QtCore.Qt.red), text
+        columns = tuple(self._samples.column(column) for column in range(self.columnCount()))
+        return TableSnapshot(tuple(self._rowVersions), columns)
 
-        elif value:
-            if index.column() == functions.get_column_number('date') and value > QtCore.QDate.currentDate():
-                text = "The entered date is in the future. Sampling dates must be in the past.\n" \
-                          "Please enter a different date."
-                return QtGui.QBrush(QtCore.Qt.red), text
+    def qtValue(self, row, column):
+        """
+        Returns a value from the model's storage as the Qt type used by the
+        views and delegates.
+        :param row: Row of the value
+        :param column: Column of the value
+        :return: QDate or QTime for dates and times, a float for numeric
+        values, otherwise a QString (or the stored value if not text)
+        """
+        value = self._samples.get(row, column)
+        kind = self._samples.kind(column)
+        if kind == storage.KIND_DATE:
+            return QtCore.QDate(value.year, value.month, value.day) if value is not None else QtCore.QDate()
+        elif kind == storage.KIND_TIME:
+            return QtCore.QTime(value.hour, value.minute, value.second) if value is not None else QtCore.QTime()
+        elif value is None:
+            return QtCore.QString("")
+        elif isinstance(value, basestring):
+            return QtCore.QString(value)
+        return value
+
+    @staticmethod
+    def toPyValue(value):
+        """
+        Converts a Qt value to the Python type used in the model's storage.
+        :param value: Qt value
+        :return: Python representation of the value
+        """
+        if type(value) is QtCore.QDate:
+            return value.toPyDate() if value.isValid() else None
+        elif type(value) is QtCore.QTime:
+            return value.toPyTime() if value.isValid() else None
+        elif type(value) is QtCore.QString:
+            return unicode(value)
+        return value
+
+    def invalidateCell(self, row, column):
+        """
+        Removes a cell from the render cache and updates the validation and
+        sampling event and search indexes after its value has changed.
+        :param row: Row of the cell
+        :param column: Column of the cell
+        :return: None
+        """
+        page = self._renderCache.get(row // self._renderPageRows)
+        if page is not None:
+            page[column].pop(row, None)
+        self.validationIndex.update(row, column)
+        self.searchIndex.update(row, column)
+        if self.eventIndex.update(row, column):
+            # A sampling event has become valid or invalid, so other rows in
+            # the event need to be redrawn
+            self.refreshEventColumns()
+        elif self.eventIndex.isKeyColumn(column):
+            # The row may have moved to a different sampling event
+            for eventColumn in (functions.get_column_number('sample_matrix'),
+                                functions.get_column_number('sample_cid')):
+                if eventColumn != column and page is not None and page[eventColumn].pop(row, None):
+                    self.notifyChanged(row, row, eventColumn)
+
+    def refreshEventColumns(self):
+        """
+        Redraws the matrix and sequence number columns after the sampling
+        event rules have been broken or fixed.
+        :return: None
+        """
+        if not self.rowCount():
+            return None
+        for column in (functions.get_column_number('sample_matrix'), functions.get_column_number('sample_cid')):
+            for page in self._renderCache.itervalues():
+                page[column] = {}
+            self.notifyChanged(0, self.rowCount() - 1, column)
 
-            if index.column() == functions.get_column_number('date') and not value.isValid():
-                text = "The entered date is invalid. Please enter a valid date."
-                return QtGui.QBrush(QtCore.Qt.red), text
+    def renderCell(self, row, column):
+        """
+        Returns the display value, background brush and tooltip of a cell,
+        from the render cache where possible.
+        :param row: Row of the cell
+        :param column: Column of the cell
+        :return: Tuple of display value, QBrush colour and tooltip text
+        """
+        page = self.renderPage(row)
+        try:
+            return page[column][row]
+        except KeyError:
+            pass
+
+        tooltip = validate_value(column, self._samples.get(row, column)) or self.eventIndex.validate(row, column)
+        brush = BRUSH_INVALID if tooltip else BRUSH_VALID
+        value = self.qtValue(row, column)
+        # Dates and times
+        if type(value) in (QtCore.QDate, QtCore.QTime):
+            value = value.toString(QtCore.Qt.ISODate)
+        # Floating point numbers
+        if value and 'lower_limit' in column_config[column]:
+            value = QtCore.QString.number(value, 'f', column_config[column]['precision'])
+
+        entry = (value, brush, tooltip)
+        page[column][row] = entry
+        return entry
+
+    def renderPage(self, row):
+        """
+        Returns the render cache of the page of rows holding a row, dropping
+        the page drawn least recently if the cache is full.
+        :param row: Row of the page
+        :return: List of dictionaries of rows, one for each column
+        """
+        number = row // self._renderPageRows
+        if number == self._renderPageNumber:
+            return self._renderPage
+        page = self._renderCache.pop(number, None)
+        if page is None:
+            page = [{} for column in range(self.columnCount())]
+            if len(self._renderCache) >= self._renderCachePages:
+                self._renderCache.popitem(last=False)
+        self._renderCache[number] = page
+        self._renderPageNumber = number
+        self._renderPage = page
+        return page
 
-            if index.column() == functions.get_column_number('time') and not value.isValid():
-                text = "The entered time is invalid. Please enter a valid time."
-                return QtGui.QBrush(QtCore.Qt.red), text
+    def resetData(self):
+        """
+        Reset all data in model
+        :return: None
+        """
+        if self.totalRowCount():
+            self.removeRows(0, self.totalRowCount())
 
-            if 'lower_limit' in column_config[index.column()]:
-                 if value < column_config[index.column()]['lower_limit'] or value > column_config[index.column()]['upper_limit']:
-                    lowerLimit = column_config[index.column()]['lower_limit']
-                    upperLimit = column_config[index.column()]['upper_limit']
-                    text = "Value out of range.\nAcceptable range is between %s and %s" % (lowerLimit, upperLimit)
-                    return QtGui.QBrush(QtCore.Qt.red), text
+    def permuteRows(self, order):
+        """
+        Reorders the rows of the model.
+        :param order: List of the current row numbers in their new order
+        :return: None
+        """
+        self.layoutAboutToBeChanged.emit()
+        self._samples.permute(order)
+        self.validationIndex.permute(order)
+        self.eventIndex.permute(order)
+        self.searchIndex.permute(order)
+        self._rowVersions = [self._rowVersions[i] for i in order]
+        self.clearRenderCache()
+        # Keep the selection and current cell on the same samples
+        newRows = [0] * len(order)
+        for newRow, oldRow in enumerate(order):
+            newRows[oldRow] = newRow
+        oldIndexes = self.persistentIndexList()
+        # Rows moved beyond the fetched rows are no longer shown
+        newIndexes = [self.index(newRows[index.row()], index.column()) if newRows[index.row()] < self._loaded
+                      else QtCore.QModelIndex() for index in oldIndexes]
+        self.changePersistentIndexList(oldIndexes, newIndexes)
+        self.layoutChanged.emit()
+        self.rowsPermuted.emit()
 
-            if 'list_items' in column_config[index.column()] and value not in column_config[index.column()]['list_items']:
-                text = "Value is not a valid value from the drop down list.\n" \
-                      "Please select a valid value from the list."
-                return QtGui.QBrush(QtCore.Qt.red), text
+    def assignSequenceNumbers(self, rows):
+        """
+        Numbers the collected samples at each location of the sampling
+        events containing the given rows 1, 2, 3... in table order, in a
+        single pass over the table, as a single undoable step.
+        :param rows: Rows identifying the locations to number
+        :return: None
+        """
+        keys = self.eventIndex.sequenceKeys()
+        counts = dict.fromkeys(set(keys[row] for row in rows if keys[row] is not None), 0)
+        numberedRows = []
+        numbers = []
+        for row, key in enumerate(keys):
+            if key in counts:
+                counts[key] += 1
+                numberedRows.append(row)
+                numbers.append(unicode(counts[key]))
+        column = functions.get_column_number('sample_cid')
+        self.pushValues(numberedRows, [column] * len(numberedRows), numbers, u"Assign sequence numbers")
+
+    def fillDown(self, rows, columns):
+        """
+        Copies the value in the first of the rows to the other rows, in each
+        column, as a single undoable step.
+        :param rows: Sorted list of rows
+        :param columns: List of columns
+        :return: None
+        """
+        cells = [(row, column) for column in columns for row in rows[1:]]
+        values = [self._samples.get(rows[0], column) for column in columns for row in rows[1:]]
+        self.pushValues([row for row, column in cells], [column for row, column in cells], values, u"Fill down")
 
-        return QtGui.QBrush(QtCore.Qt.white), None
+    def fillSeries(self, rows, columns):
+        """
+        Fills each column with a series continuing from the first of the
+        rows, as a single undoable step. The step of the series is the
+        difference between the first two rows if both hold a value, otherwise
+        one (or one day for dates). Columns that do not hold numbers or dates
+        are filled down.
+        :param rows: Sorted list of rows
+        :param columns: List of columns
+        :return: None
+        """
+        cells = []
+        values = []
+        for column in columns:
+            kind = self._samples.kind(column)
+            first = self._samples.get(rows[0], column)
+            second = self._samples.get(rows[1], column) if len(rows) > 1 else None
+            if kind == storage.KIND_DATE and first is not None:
+                step = (second - first).days if second is not None else 1
+                series = [first + datetime.timedelta(days=step * i) for i in range(1, len(rows))]
+            elif kind in (storage.KIND_NUMBER, storage.KIND_TEXT):
+                try:
+                    start = float(first)
+                    step = float(second) - start if second not in (None, u"") else 1
+                except (ValueError, TypeError):
+                    series = [first] * (len(rows) - 1)
+                else:
+                    series = [start + step * i for i in range(1, len(rows))]
+                    if kind == storage.KIND_TEXT:
+                        # Numbers held as text, such as sequence numbers
+                        series = [unicode(int(value)) if value == int(value) else unicode(value)
+                                  for value in series]
+            else:
+                series = [first] * (len(rows) - 1)
+            cells.extend((row, column) for row in rows[1:])
+            values.extend(series)
+        self.pushValues([row for row, column in cells], [column for row, column in cells], values, u"Fill series")
+
+    def pushValues(self, rows, columns, values, description):
+        """
+        Sets the values of a set of cells as a single undoable step. Cells
+        already holding their new value are left out of the step.
+        :param rows: List of the row of each cell
+        :param columns: List of the column of each cell
+        :param values: List of the new value of each cell
+        :param description: Description of the step
+        :return: None
+        """
+        changed = [(row, column, value) for row, column, value in itertools.izip(rows, columns, values)
+                   if self._samples.get(row, column) != value]
+        if changed:
+            self.undoStack.push(CommandSetCells(self, [(row, column) for row, column, value in changed],
+                                                description=description,
+                                                values=[value for row, column, value in changed]))
+
+    def regenerateSamplingNumbers(self, rows):
+        """
+        Derives the sampling number of each of the rows again from its
+        station, date and sample type, as a single undoable step.
+        :param rows: List of rows
+        :return: None
+        """
+        column = functions.get_column_number('sampling_number')
+        self.pushValues(rows, [column] * len(rows), [self.getSamplingNumber(row) for row in rows],
+                        u"Regenerate sampling numbers")
 
     def sort(self, column, order):
         """Sort table by given column number"""
-        # Clear the undo stack
-        self.undoStack.clear()
-        # Begin sorting
-        self.layoutAboutToBeChanged.emit()
-        self._samples = sorted(self._samples, key=operator.itemgetter(column))
-        if order == QtCore.Qt.DescendingOrder:
-            self._samples.reverse()
-        self.layoutChanged.emit()
+        if self.sortSuspended:
+            return None
+        self.sortRows([column], [order])
+
+    def sortRows(self, columns, orders):
+        """
+        Sorts the table by one or more columns as a single undoable step.
+        Empty cells are always sorted last.
+        :param columns: List of column numbers, most significant first
+        :param orders: List of the Qt.SortOrder for each column
+        :return: None
+        """
+        order = self._samples.sortOrder(
+            [(column, sortOrder == QtCore.Qt.DescendingOrder) for column, sortOrder in zip(columns, orders)])
+        # Nothing to do if the table is already sorted
+        if order == range(len(order)):
+            return None
+        names = u", ".join(unicode(column_config[column]['display_name']) for column in columns)
+        self.undoStack.push(CommandSortRows(self, order, u"Sort by %s" % names))
 
     def swapMonthDay(self, listOfIndexes):
         """
         Swaps the month and day values for dates where that results in a
-        valid date.
+        valid date, as a single undoable step.
         :param listOfIndexes: List of model indexes to be swapped.
         :return: None
         """
+        column = functions.get_column_number('date')
+        rows = []
+        dates = []
         for index in listOfIndexes:
-            if index.column() == functions.get_column_number('date'):
-                # Get current settings
-                day = self.data(index, QtCore.Qt.EditRole).day()
-                month = self.data(index, QtCore.Qt.EditRole).month()
-                year = self.data(index, QtCore.Qt.EditRole).year()
+            if index.column() == column:
+                date = self._samples.get(index.row(), column)
                 # Swap day and month
-                if day <= 12:
-                    date = QtCore.QDate(year, day, month)
-                    self.setData(index, date)
+                if date is not None and date.day <= 12:
+                    rows.append(index.row())
+                    dates.append(date.replace(month=date.day, day=date.month))
+        self.pushValues(rows, [column] * len(rows), dates, u"Swap day and month")
 
 
 ###############################################################################
 # Undo action commands
 ###############################################################################
-class CommandSetData(QtGui.QUndoCommand):
-    def __init__(self, model, index, value, previous, description="Item edited", *args, **kwargs):
-        super(CommandSetData, self).__init__(description)
+class CommandAppendRows(object):
+    def __init__(self, model, rows, description="File added", *args, **kwargs):
+        self.text = description
+        self.model = model
+        self.rows = rows
+        self.dateFormat = kwargs.get('dateFormat')
+        # Name of the file the rows were loaded from and the list of current
+        # files to show it in while the rows are in the table
+        self.fileName = kwargs.get('fileName')
+        self.fileList = kwargs.get('fileList')
+        self.position = model.totalRowCount()
+        # Number of invalid values in the appended rows, and of values that
+        # could not be read and were left empty
+        self.invalid = 0
+        self.unreadable = 0
+
+    def byteSize(self):
+        return undo.get_block_size(self.rows)
+
+    def redo(self):
+        self.invalid, self.unreadable = self.model.appendRows(self.rows, dateFormat=self.dateFormat)
+        if self.fileList is not None:
+            self.fileList.addItem(QtGui.QListWidgetItem(self.fileName))
+
+    def undo(self):
+        if self.rows:
+            self.model.removeRows(self.position, len(self.rows))
+        if self.fileList is not None:
+            items = self.fileList.findItems(self.fileName, QtCore.Qt.MatchExactly)
+            if items:
+                self.fileList.takeItem(self.fileList.row(items[-1]))
+
+
+class CommandInsertRows(object):
+    def __init__(self, model, position, count, description="Rows inserted"):
+        self.text = description
+        self.model = model
+        self.position = position
+        self.count = count
+
+    def byteSize(self):
+        return undo.DEFAULT_COMMAND_SIZE
+
+    def redo(self):
+        self.model.insertRows(self.position, self.count)
+
+    def undo(self):
+        self.model.removeRows(self.position, self.count)
+
+
+class CommandRemoveRows(object):
+    def __init__(self, model, rows, description="Rows deleted"):
+        self.text = description
         self.model = model
-        self.index = index
+        # Group the rows into contiguous runs of (first row, typed values)
+        self.runs = []
+        for row in sorted(set(rows)):
+            if self.runs and self.runs[-1][0] + len(self.runs[-1][1]) == row:
+                self.runs[-1][1].extend(model.getRange(row, 0, 1, model.columnCount()))
+            else:
+                self.runs.append((row, model.getRange(row, 0, 1, model.columnCount())))
+
+    def byteSize(self):
+        return sum(undo.get_block_size(block) for position, block in self.runs)
+
+    def redo(self):
+        # Remove from the bottom up so the row numbers stay valid
+        for position, block in reversed(self.runs):
+            self.model.removeRows(position, len(block))
+
+    def undo(self):
+        for position, block in self.runs:
+            self.model.restoreRows(position, block)
+
+
+class CommandSetCells(object):
+    def __init__(self, model, cells, value=None, description="Items edited", *args, **kwargs):
+        self.text = description
+        self.model = model
+        self.dateFormat = kwargs.get('dateFormat')
+        # Cells are held as compact arrays of row and column numbers, with
+        # either a single new value for all cells or a list of the new value
+        # of each cell
+        self.rows = array.array('i', (row for row, column in cells))
+        self.columns = array.array('i', (column for row, column in cells))
         self.value = value
-        self.previous = previous
+        self.values = kwargs.get('values')
+        self.previous = [model.getValue(row, column) for row, column in cells]
+
+    def byteSize(self):
+        size = (self.rows.itemsize * len(self.rows) * 2 + sys.getsizeof(self.previous) +
+                sum(sys.getsizeof(value) for value in self.previous))
+        if self.values is not None:
+            size += sys.getsizeof(self.values) + sum(sys.getsizeof(value) for value in self.values)
+        return size
+
+    def redo(self):
+        values = itertools.repeat(self.value) if self.values is None else self.values
+        self.model.setCells(self.rows, self.columns, values, self.dateFormat)
+
+    def undo(self):
+        self.model.setCells(self.rows, self.columns, self.previous)
+
+
+class CommandSetRange(object):
+    def __init__(self, model, topRow, leftColumn, block, description="Items edited", *args, **kwargs):
+        self.text = description
+        self.model = model
+        self.topRow = topRow
+        self.leftColumn = leftColumn
+        self.block = block
         self.dateFormat = kwargs.get('dateFormat')
+        # Keep the typed values being replaced so they can be restored exactly
+        self.previous = model.getRange(topRow, leftColumn, len(block), max(len(values) for values in block))
+
+    def byteSize(self):
+        return undo.get_block_size(self.block) + undo.get_block_size(self.previous)
 
     def redo(self):
-        if self.dateFormat:
-            self.model.setData(self.index, self.value, dateFormat=self.dateFormat)
-        else:
-            self.model.setData(self.index, self.value)
+        self.model.setRange(self.topRow, self.leftColumn, self.block, self.dateFormat)
 
     def undo(self):
-        self.model.setData(self.index, self.previous)
+        self.model.setRange(self.topRow, self.leftColumn, self.previous)
+
+
+class CommandSortRows(object):
+    def __init__(self, model, order, description="Rows sorted"):
+        self.text = description
+        self.model = model
+        self.order = order
+        # Order that restores the rows to their previous positions
+        self.inverse = [0] * len(order)
+        for newRow, oldRow in enumerate(order):
+            self.inverse[oldRow] = newRow
+
+    def byteSize(self):
+        return sys.getsizeof(self.order) + sys.getsizeof(self.inverse)
+
+    def redo(self):
+        # Rows removed outside the undo stack (by a data reset) invalidate
+        # the order
+        if len(self.order) == self.model.totalRowCount():
+            self.model.permuteRows(self.order)
+
+    def undo(self):
+        if len(self.inverse) == self.model.totalRowCount():
+            self.model.permuteRows(self.inverse)
 
 
 ###############################################################################
@@ -447,18 +1068,32 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
     """
     Constructor for the main application
     """
+    # Emitted by the journal's background thread if journaling stops
+    journalFailed = QtCore.pyqtSignal()
+
     def __init__(self):
         QtGui.QMainWindow.__init__(self)
 
-        # Check we are using the latest version of FDF
-        self.checkVersion()
         # Set up the undo stack
-        self.undoStack = QtGui.QUndoStack(self)
-        # Set up model
-        self.sampleModel = TableModel(undoStack=self.undoStack)
-        self.sampleModel.removeRows(0, 1)
+        self.undoStack = undo.UndoStack(app_config['undo']['memory_limit_mb'] * 1024 * 1024)
+        # Set up model, restoring the previous session if it did not close
+        # cleanly
+        samples, restoredRows = self.openJournal(create_store())
+        self.sampleModel = TableModel(undoStack=self.undoStack, samples=samples)
+        if not restoredRows:
+            self.sampleModel.removeRows(0, 1)
+        # Set up the cache of the last export
+        self.exportCache = ExportCache()
+        # Filters on the rows shown in the table
+        self.rowFilters = []
+        startupTimer.mark(u"Table model")
+        # Turning sorting on in the views sorts by the header's sort
+        # indicator, which must not reorder rows restored from the previous
+        # session or reopened from a kept database
+        self.sampleModel.sortSuspended = True
         # Set up the main GUI window
         self.setupUi(self.sampleModel, self)
+        startupTimer.mark(u"Main window")
         # Initialise global variables
         settings.FROZEN_COLUMNS = self.spinBoxFrozenColumns.value()
         # Set up the table views
@@ -466,6 +1101,7 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
         self.tableViewData.frozenTableView.setItemDelegate(TableDelegate(True))
         self.tableViewData.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
         self.tableViewData.setSortingEnabled(True)
+        self.sampleModel.sortSuspended = False
         # Connect signals
         self.tableViewData.selectionModel().selectionChanged.connect(self.selectionChanged)
         self.filePickerBtn.clicked.connect(self.filePicker)
@@ -478,6 +1114,9 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
         self.pushButtonFillSampleLocation.clicked.connect(self.fillSampleLocation)
         self.spinBoxFrozenColumns.valueChanged.connect(self.tableViewData.updateFrozenColumns)
         self.spinBoxFrozenColumns.valueChanged.connect(self.updateGlobalFrozenColumns)
+        self.sampleModel.rowsInserted.connect(self.filterRowsInserted)
+        self.sampleModel.rowsRemoved.connect(self.refreshFilter)
+        self.sampleModel.rowsPermuted.connect(self.refreshFilter)
 
         # Add items to the instrument picker
         instruments = ['']
@@ -490,11 +1129,8 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
         dateFormats = ['dd/MM/yyyy', 'MM/dd/yyyy', 'yyyy-MM-dd']
         self.dateFormatComboBox.addItems(dateFormats)
 
-        # Set up the help documentation
-        self.helpBrowser = QtGui.QTextBrowser()
-        self.helpBrowser.setSource(QtCore.QUrl('help.html'))
-        self.helpBrowser.setWindowTitle(u"FDF Utility Help Documentation")
-        self.helpBrowser.setMinimumSize(500, 500)
+        # Set up the help documentation, which is built when first shown
+        self.helpBrowser = None
         self.actionHelp.triggered.connect(self.showHelp)
 
         # Set up the about documentation
@@ -503,9 +1139,20 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
         # Ensure the window is deleted on close to prevent threading errors
         self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
 
+        # Check we are using the latest version of FDF without waiting for
+        # the network
+        self.checkVersion()
+        startupTimer.mark(u"Widgets and signals")
+
     ##########################################################################
     # Reimplemented methods
     ##########################################################################
+    def closeEvent(self, event):
+        # A version check still waiting on the network runs in a daemon
+        # thread, so it does not hold up closing
+        self.sampleModel.closeStore()
+        event.accept()
+
     def contextMenuEvent(self, event):
         if event.Reason() == QtGui.QContextMenuEvent.Mouse:
             menu = QtGui.QMenu(self)
@@ -515,6 +1162,20 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
             menu.addAction(u"Copy", self.copy, QtGui.QKeySequence.Copy)
             menu.addAction(u"Cut", self.copy, QtGui.QKeySequence.Cut)
             menu.addAction(u"Paste", self.paste, QtGui.QKeySequence.Paste)
+            menu.addSeparator()
+            menu.addAction(u"Sort by station, date, time and sequence", self.sortSamples)
+            menu.addSeparator()
+            menu.addAction(u"Fill down", self.fillDown, QtGui.QKeySequence(QtCore.Qt.CTRL + QtCore.Qt.Key_D))
+            menu.addAction(u"Fill series", self.fillSeries)
+            menu.addAction(u"Assign sequence numbers", self.assignSequenceNumbers)
+            menu.addAction(u"Regenerate sampling numbers", self.regenerateSamplingNumbers)
+            menu.addSeparator()
+            menu.addAction(u"Filter by selection", self.filterBySelection)
+            menu.addAction(u"Clear filter", self.clearFilter)
+            menu.addSeparator()
+            menu.addAction(u"Next error", self.nextError, QtGui.QKeySequence(QtCore.Qt.Key_F8))
+            menu.addAction(u"Previous error", self.previousError,
+                           QtGui.QKeySequence(QtCore.Qt.SHIFT + QtCore.Qt.Key_F8))
             menu.popup(QtGui.QCursor.pos())
 
     def keyPressEvent(self, event):
@@ -534,6 +1195,12 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
             self.keyPressEnter()
         elif event.key() == QtCore.Qt.Key_Escape:
             self.clearSelection()
+        elif event.key() == QtCore.Qt.Key_F8 and event.modifiers() & QtCore.Qt.ShiftModifier:
+            self.previousError()
+        elif event.key() == QtCore.Qt.Key_F8:
+            self.nextError()
+        elif event.key() == QtCore.Qt.Key_D and event.modifiers() & QtCore.Qt.ControlModifier:
+            self.fillDown()
         else:
             QtGui.QMainWindow.keyPressEvent(self, event)
 
@@ -555,23 +1222,20 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
             # Add data to table
             lists = functions.lord2lorl(dicts, app_config['column_order'])
 
-            fileValid = True
-
-            for i in range(len(lists)):
-                self.sampleModel.insertRows(self.sampleModel.rowCount(), 1)
-                for j in range(len(lists[i])):
-                    index = self.sampleModel.index(self.sampleModel.rowCount() - 1, j)
-                    self.sampleModel.setData(index, lists[i][j], dateFormat=dateFormat)
-                    # If we have an invalid value, change the valid flag so that the message displays
-                    if self.sampleModel.data(index, role=QtCore.Qt.BackgroundRole) == QtGui.QBrush(QtCore.Qt.red):
-                        fileValid = False
-
-            # Add file name to listbox
-            self.listWidgetCurrentFiles.addItem(QtGui.QListWidgetItem(self.fileLineEdit.text()))
+            # The file name is shown in the listbox while the file's rows
+            # are in the table
+            command = CommandAppendRows(self.sampleModel, lists, "Add file", dateFormat=dateFormat,
+                                        fileName=self.fileLineEdit.text(), fileList=self.listWidgetCurrentFiles)
+            self.undoStack.push(command)
+            # If we have an invalid or unreadable value, change the valid flag so that the message displays
+            fileValid = command.invalid == 0 and command.unreadable == 0
 
             if not fileValid:
-                txt = u"The chosen file has invalid values.\n\n" \
-                      u"Please review the cells in red highlight before exporting."
+                txt = u"The chosen file has invalid values.\n\n"
+                if command.unreadable:
+                    txt += u"%d value(s) could not be read as a date, time or number and have been " \
+                           u"left empty.\n\n" % command.unreadable
+                txt += u"Please review the cells in red highlight before exporting."
                 msg = QtGui.QMessageBox()
                 msg.setIcon(QtGui.QMessageBox.Warning)
                 msg.setText(txt)
@@ -589,37 +1253,74 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
 
     def checkVersion(self):
         """
-        Checks the version of FDF utility to ensure it is up-to-date.
-        Displays a message if the utility is out of date.
+        Checks the version of FDF utility in a background thread to ensure
+        it is up-to-date. checkVersionFinished displays a message if the
+        utility is out of date.
         """
-        version_url = u'https://raw.githubusercontent.com/dlzharris/fdf/master/current_version.txt'
-        package_url = u'https://github.com/dlzharris/fdf/releases'
-
-        try:
-            proxy = urllib2.ProxyHandler({'http': 'oranprodproxy.dpi.nsw.gov.au:8080',
-                                          'https': 'oranprodproxy.dpi.nsw.gov.au:8080'})
-            opener = urllib2.build_opener(proxy)
-            urllib2.install_opener(opener)
-            if __status__ == 'Development':
-                current_version = __version__
-            else:
-                current_version = yaml.load(urllib2.urlopen(version_url).read())['version_stable']
-        except urllib2.URLError:
+        self.versionOutdated = False
+        self.versionWorker = None
+        if __status__ == 'Development':
             return None
-
+        self.versionWorker = VersionCheckWorker(app_config['version_check'])
+        # The version is emitted from the worker's thread
+        self.versionWorker.checked.connect(self.checkVersionFinished, QtCore.Qt.QueuedConnection)
+        self.versionWorker.start()
+
+    def checkVersionFinished(self, current_version):
+        """Displays a message if the utility is out of date. The utility
+        closes if nothing has been done yet, otherwise exporting is disabled
+        so that work in progress is not lost without warning."""
+        package_url = app_config['version_check']['package_url']
         if __version__ != current_version:
+            # The check finishes in the background, so the user may already
+            # have started work
+            unused = not self.sampleModel.totalRowCount() and not self.undoStack.count()
             txt = u"There is a newer version of this application available. " \
                   u"You can no longer use the current version. <br><br>" \
                   u"Please download the latest version (zip file) from <a href='{url}'>{url}</a>. " \
                   u"Installation instructions can be found in the README.md file at the same location.<br><br>" \
-                  u"This application will now exit.".format(url=package_url)
+                  .format(url=package_url)
+            if unused:
+                txt += u"This application will now exit."
+            else:
+                txt += u"Exporting has been disabled. Your data has not been changed, and can be copied " \
+                       u"to another application before you close this one."
+            self.versionOutdated = True
+            self.pushButtonExportData.setEnabled(False)
             msg = QtGui.QMessageBox()
             msg.setIcon(QtGui.QMessageBox.Information)
             msg.setText(txt)
             msg.setTextFormat(QtCore.Qt.RichText)
             msg.setWindowTitle(u"New version available!")
             msg.exec_()
-            sys.exit()
+            if unused:
+                self.close()
+
+    def applyFilter(self):
+        """Shows only the rows matching the current filters, loading enough
+        rows to show the first page of matches."""
+        if not self.rowFilters:
+            self.tableViewData.setFilteredRows(None)
+            self.statusbar.clearMessage()
+            return None
+        rows = self.sampleModel.searchIndex.find(self.rowFilters)
+        if rows:
+            self.sampleModel.fetchTo(rows[min(len(rows), app_config['table']['page_rows']) - 1])
+        self.tableViewData.setFilteredRows(rows)
+        self.statusbar.showMessage(u"Showing %d of %d rows where %s" % (
+            len(rows), self.sampleModel.totalRowCount(),
+            u"; ".join(get_filter_description(rowFilter) for rowFilter in self.rowFilters)))
+
+    def assignSequenceNumbers(self):
+        """Numbers the samples at the locations of the selected rows in order."""
+        rows, columns = self.selectedRowsAndColumns()
+        if rows:
+            self.sampleModel.assignSequenceNumbers(rows)
+
+    def clearFilter(self):
+        """Shows all rows of the table."""
+        self.rowFilters = []
+        self.applyFilter()
 
     def clearSelection(self):
         selection = self.tableViewData.selectionModel()
@@ -629,76 +1330,59 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
     def copy(self):
         """Implements Excel-style copy."""
         # Find the selected cells
-        selection = self.tableViewData.selectionModel()
-        indexes = selection.selectedIndexes()
+        indexes = self.selectedIndexes()
         if len(indexes) < 1:
             # Nothing selected
             return None
 
-        # Start copying
-        text = ''
-        rows = [r.row() for r in indexes]
-        cols = [c.column() for c in indexes]
-        for r in range(min(rows), max(rows) + 1):
-            for c in range(min(cols), max(cols) + 1):
-                item = self.sampleModel.data(self.sampleModel.index(r, c))
-                text += item
-                if c != max(cols):
-                    text += '\t'
-            if r != max(rows):
-                text += '\n'
-        QtGui.QApplication.clipboard().setText(text)
+        # Copy the values of the selected block, leaving out rows hidden by
+        # a filter. They are only formatted as text when the clipboard is
+        # read.
+        rows = self.visibleRows(min(r.row() for r in indexes), max(r.row() for r in indexes))
+        cols = range(min(c.column() for c in indexes), max(c.column() for c in indexes) + 1)
+        block = [self.sampleModel.getRange(row, cols[0], 1, len(cols))[0] for row in rows]
+        mimeData = clipboard.TableMimeData(cols, block)
+        QtGui.QApplication.clipboard().setMimeData(mimeData)
         return rows, cols
 
     def cut(self):
         """Implements Excel-style cut."""
         # Copy the selected cells
-        rows, cols = self.copy()
-        # Prepare the undo macro
-        self.undoStack.beginMacro("Cut data")
-        # Begin cut operations
-        for r in range(min(rows), max(rows) + 1):
-            for c in range(min(cols), max(cols) + 1):
-                index = self.sampleModel.index(r, c)
-                value = QtCore.QString("")
-                previous = self.sampleModel.data(index)
-                command = CommandSetData(self.sampleModel, index, value, previous)
-                self.undoStack.push(command)
-        self.undoStack.endMacro()
+        copied = self.copy()
+        if copied is None:
+            return None
+        rows, cols = copied
+        # Clear the copied block as a single undoable step
+        cells = [(r, c) for r in rows for c in cols]
+        self.undoStack.push(CommandSetCells(self.sampleModel, cells, u"", "Cut data"))
 
     def delete(self):
         """Deletes data from currently selected cells."""
         # Find the selected cells
-        selection = self.tableViewData.selectionModel()
-        indexes = selection.selectedIndexes()
+        indexes = self.selectedIndexes()
         if len(indexes) < 1:
             # Nothing selected
             return None
 
-        # Prepare undo macro
-        self.undoStack.beginMacro("Delete data")
-        # Start deleting
-        for i in indexes:
-            value = QtCore.QString("")
-            previous = self.sampleModel.data(i)
-            command = CommandSetData(self.sampleModel, i, value, previous)
-            self.undoStack.push(command)
-        self.undoStack.endMacro()
+        cells = [(i.row(), i.column()) for i in indexes]
+        self.undoStack.push(CommandSetCells(self.sampleModel, cells, u"", "Delete data"))
 
         return None
 
     def delRows(self):
-        """Deletes selected rows from the table."""
-        rows = self.tableViewData.selectionModel().selectedRows()
-        # Reverse the order of rows so we delete from the bottom up
-        # to avoid errors.
-        rows.reverse()
-        # TODO: implement undo here
-        for row in rows:
-            self.sampleModel.removeRow(row.row())
+        """Deletes selected rows from the table, other than rows hidden by a
+        filter."""
+        rows = [index.row() for index in self.tableViewData.selectionModel().selectedRows()
+                if not self.tableViewData.isRowHidden(index.row())]
+        if not rows:
+            return None
+        self.undoStack.push(CommandRemoveRows(self.sampleModel, rows))
 
     def exportData(self):
-        """Exports data to csv file."""
+        """Exports data to csv file in a background thread."""
+        if self.versionOutdated:
+            # A newer version is required to export
+            return None
         dataValid, txt = self.validateExport()
         if not dataValid:
             msg = QtGui.QMessageBox()
@@ -710,145 +1394,323 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
 
         # If the data is valid, keep going with the export.
         fileName = QtGui.QFileDialog.getSaveFileName(caption=u'Save file', selectedFilter=u'*.csv')
+        if not fileName:
+            return None
 
-        # Take a row and append each item to a list.
-        tableData = []
-        for row in range(self.sampleModel.rowCount()):
-            tableData.append([])
-            for column in range(self.sampleModel.columnCount()):
-                index = self.sampleModel.index(row, column)
-                tableData[row].append(str(self.sampleModel.data(index)))
-        # Transform the list to a dictionary for dictWriter
-        tableData = functions.lorl2lord(tableData, app_config['column_order'])
-        # Reformat the data in parameter-oriented format
-        data_reformatted = functions.prepare_dictionary(tableData, 'YYYY-MM-DD')
-        # Prepare the message box for confirmation after export
+        # Show the progress of the export. The dialog is not modal so the
+        # table can still be used while a large export runs.
+        self.exportProgressDialog = QtGui.QProgressDialog(u"Preparing export...", u"Cancel", 0, 0, self)
+        self.exportProgressDialog.setWindowTitle(u"Exporting data")
+        self.exportProgressDialog.setWindowModality(QtCore.Qt.NonModal)
+        self.exportProgressDialog.setAutoClose(False)
+        self.exportProgressDialog.setAutoReset(False)
+        self.exportProgressDialog.canceled.connect(self.exportCancel)
+        self.exportProgressDialog.show()
+        self.pushButtonExportData.setEnabled(False)
+        # Resetting clears the export cache, which the worker is using
+        self.pushButtonResetData.setEnabled(False)
+
+        # Run the export from a snapshot of the table in a worker thread,
+        # only transforming the sampling events changed since the last export
+        self.exportThread = QtCore.QThread(self)
+        self.exportWorker = ExportWorker(self.sampleModel.snapshot(), self.exportCache, str(fileName),
+                                         self.chkBoxSampleOriented.isChecked())
+        self.exportWorker.moveToThread(self.exportThread)
+        self.exportWorker.progress.connect(self.exportProgress)
+        self.exportWorker.succeeded.connect(self.exportSucceeded)
+        self.exportWorker.failed.connect(self.exportFailed)
+        self.exportWorker.cancelled.connect(self.exportFinished)
+        self.exportThread.started.connect(self.exportWorker.run)
+        self.exportThread.start()
+
+    def exportCancel(self):
+        """Cancels the running export. Any partially written files are removed."""
+        self.exportProgressDialog.setLabelText(u"Cancelling export...")
+        self.exportWorker.cancel()
+
+    def exportFailed(self, txt):
+        """Displays the error from a failed export."""
+        self.exportFinished()
         msg = QtGui.QMessageBox()
-        # Write the data to csv
-        try:
-            # Write to sample oriented file for QA
-            if self.chkBoxSampleOriented.isChecked():
-                fn = os.path.splitext(str(fileName))[0] + '_sampleOriented' + '.csv'
-                functions.write_to_csv(tableData, fn, app_config['column_order'])
-            # Write to parameter oriented file for import to KiWQM
-            if functions.write_to_csv(data_reformatted, fileName, app_config['csv_fieldnames']):
-                msg.setIcon(QtGui.QMessageBox.Information)
-                msg.setText(u"Data exported successfully!")
-                msg.setWindowTitle(u"Export successful!")
-                msg.exec_()
-                return None
-        except IOError:
-            msg.setIcon(QtGui.QMessageBox.Warning)
-            msg.setText(u"There was an error exporting your file.")
-            msg.setWindowTitle(u"Export error!")
-            msg.exec_()
+        msg.setIcon(QtGui.QMessageBox.Warning)
+        msg.setText(txt)
+        msg.setWindowTitle(u"Export error!")
+        msg.exec_()
+
+    def exportFinished(self):
+        """Cleans up the export worker and progress dialog once an export ends."""
+        self.exportThread.quit()
+        self.exportThread.wait()
+        self.exportProgressDialog.close()
+        self.pushButtonExportData.setEnabled(not self.versionOutdated)
+        self.pushButtonResetData.setEnabled(True)
+
+    def exportProgress(self, phase, done, total):
+        """Displays the progress of the running export."""
+        labels = {
+            'prepare': u"Preparing samples...",
+            'transform': u"Transforming sampling events...",
+            'write': u"Writing files..."
+        }
+        if not self.exportProgressDialog.wasCanceled():
+            self.exportProgressDialog.setLabelText(labels[str(phase)])
+        self.exportProgressDialog.setMaximum(total)
+        self.exportProgressDialog.setValue(done)
+
+    def exportSucceeded(self):
+        """Confirms a successful export to the user."""
+        self.exportFinished()
+        msg = QtGui.QMessageBox()
+        msg.setIcon(QtGui.QMessageBox.Information)
+        msg.setText(u"Data exported successfully!")
+        msg.setWindowTitle(u"Export successful!")
+        msg.exec_()
+
+    def filterBySelection(self):
+        """
+        Filters the table to the rows matching the selected values. For each
+        selected column, rows are kept if they hold one of the selected
+        values in that column, or, for dates, times and numbers, if they fall
+        between the smallest and largest selected values. The filter is
+        combined with the filters on other columns.
+        :return: None
+        """
+        selectedValues = {}
+        for index in self.selectedIndexes():
+            selectedValues.setdefault(index.column(), set()).add(
+                self.sampleModel.getValue(index.row(), index.column()))
+        if not selectedValues:
+            return None
+        filters = dict((rowFilter[0], rowFilter) for rowFilter in self.rowFilters)
+        for column, values in selectedValues.iteritems():
+            present = [value for value in values if value is not None]
+            if self.sampleModel.getKind(column) == KIND_TEXT or len(values) == 1 or not present:
+                filters[column] = (column, FILTER_IN, values)
+            else:
+                filters[column] = (column, FILTER_BETWEEN, (min(present), max(present)))
+        self.rowFilters = [filters[column] for column in sorted(filters)]
+        self.applyFilter()
+
+    def filterRowsInserted(self, parent, first, last):
+        """Applies the filter to rows inserted into the table. Rows added
+        at the end of the table, such as the next page of a large file, are
+        filtered without revisiting the rows above them."""
+        if not self.rowFilters:
             return None
+        if last == self.sampleModel.rowCount() - 1:
+            self.tableViewData.setFilteredRows(self.sampleModel.searchIndex.find(self.rowFilters), first, last)
+        else:
+            self.applyFilter()
 
     def filePicker(self):
         """Shows file picker dialog and name in text box."""
         self.fileLineEdit.setText(QtGui.QFileDialog.getOpenFileName())
 
+    def fillDown(self):
+        """Copies the top selected value down the selection in each column."""
+        rows, columns = self.selectedRowsAndColumns()
+        if len(rows) > 1:
+            self.sampleModel.fillDown(rows, columns)
+
     def fillSampleLocation(self):
-        """Convenience function to fill the selected rows sample and location numbers with ones."""
-        # Get the selected cell or cells
-        selection = self.tableViewData.selectionModel()
-        indexes = selection.selectedIndexes()
-        # Get the location of the top left cell in selection
-        fillStartRow = min(r.row() for r in indexes)
-        fillEndRow = max(r.row() for r in indexes)
-        if len(indexes) < 1:
+        """Convenience function to set the location number of the selected
+        rows to one and number the samples at each location in order."""
+        rows, columns = self.selectedRowsAndColumns()
+        if not rows:
             # Nothing selected
             return None
-
-        # Prepare undo macro
-        self.undoStack.beginMacro("Fill sample and location")
-        for i in range(fillStartRow, fillEndRow + 1):
-            indexLocation = self.sampleModel.createIndex(i, functions.get_column_number('location_id'))
-            indexSample = self.sampleModel.createIndex(i, functions.get_column_number('sample_cid'))
-            previousLocation = self.sampleModel.data(indexLocation)
-            previousSample = self.sampleModel.data(indexSample)
-            command = CommandSetData(self.sampleModel, indexLocation, 1, previousLocation)
-            self.undoStack.push(command)
-            command = CommandSetData(self.sampleModel, indexSample, 1, previousSample)
-            self.undoStack.push(command)
+        column = functions.get_column_number('location_id')
+        self.undoStack.beginMacro(u"Fill sample and location")
+        self.sampleModel.pushValues(rows, [column] * len(rows), [u"1"] * len(rows), u"Fill location")
+        self.sampleModel.assignSequenceNumbers(rows)
         self.undoStack.endMacro()
 
         return None
 
+    def fillSeries(self):
+        """Continues the series started by the top selected values down the
+        selection in each column."""
+        rows, columns = self.selectedRowsAndColumns()
+        if len(rows) > 1:
+            self.sampleModel.fillSeries(rows, columns)
+
     def insertRows(self):
         """Inserts additional rows to the table instance."""
         try:
-            rows = self.tableViewData.selectionModel().selectedRows()
+            rows = [index for index in self.tableViewData.selectionModel().selectedRows()
+                    if not self.tableViewData.isRowHidden(index.row())]
             position = rows[0].row()
             rowCount = len(rows)
         except IndexError:
             position = self.sampleModel.rowCount()
             rowCount = 1
 
-        self.sampleModel.insertRows(position, rowCount)
+        self.undoStack.push(CommandInsertRows(self.sampleModel, position, rowCount))
 
     def keyPressEnter(self):
         """Sets the action of pressing Enter to move the selection to the next row down."""
         currentIndex = self.tableViewData.currentIndex()
         self.tableViewData.setCurrentIndex(self.sampleModel.index(currentIndex.row() + 1, currentIndex.column()))
 
+    def nextError(self, forward=True):
+        """Moves the current cell to the next invalid or missing required cell."""
+        currentIndex = self.tableViewData.currentIndex()
+        if currentIndex.isValid():
+            row, column = currentIndex.row(), currentIndex.column()
+        elif forward:
+            # Start from the first cell of the table
+            row, column = self.sampleModel.totalRowCount() - 1, self.sampleModel.columnCount()
+        else:
+            # Start from the last cell of the table
+            row, column = 0, -1
+        cell = self.sampleModel.validationIndex.findError(row, column, forward)
+        if cell is None:
+            return None
+        # The error may be in a row that has not been fetched yet
+        self.sampleModel.fetchTo(cell[0])
+        index = self.sampleModel.index(*cell)
+        self.tableViewData.setCurrentIndex(index)
+        self.tableViewData.scrollTo(index)
+
+    def openJournal(self, store):
+        """
+        Starts the journal of the changes made to the table, first offering
+        to restore the table from the journal of a session that did not
+        close cleanly.
+        :param store: Store for the table, empty unless it is a kept database
+        :return: Tuple of the store to use for the table, recording its
+        changes if the journal is enabled, and the number of rows restored
+        or reopened
+        """
+        self.journal = None
+        config = app_config['journal']
+        if not config['enabled']:
+            return store, len(store)
+        directory = config['path'] or os.path.join(settings.CACHE_DIR, 'sessions')
+        # Sessions of other running instances are locked, so only sessions
+        # whose process has ended are offered for restore
+        orphans = find_sessions(directory)
+        columns = None
+        if len(store):
+            # A kept database already holds the committed changes of the
+            # previous session, so the journal starts from its rows
+            columns = encode_store(store)
+        else:
+            restorable = [path for path, lock in orphans if has_session(path)]
+            if restorable:
+                columns = self.offerRestore(restorable[0], store)
+        for path, lock in orphans:
+            delete_session(path)
+            lock.release()
+        kinds = [store.kind(column) for column in range(len(column_config))]
+        self.journalFailed.connect(self.journalError, QtCore.Qt.QueuedConnection)
+        try:
+            self.journal = Journal(get_session_path(directory), kinds, columns, config['compact_records'],
+                                   onError=self.journalFailed.emit)
+        except (IOError, OSError, ValueError):
+            self.journalError()
+            return store, len(store)
+        return JournalStore(store, self.journal), len(store)
+
+    def journalError(self):
+        """Warns that changes are no longer being saved for recovery."""
+        msg = QtGui.QMessageBox()
+        msg.setIcon(QtGui.QMessageBox.Warning)
+        msg.setText(u"The changes you make can not be saved for recovery if FDF closes unexpectedly. "
+                    u"Please check there is space available in the session folder given in "
+                    u"app_config.yaml. Your data has not been changed.")
+        msg.setWindowTitle(u"Session recovery unavailable")
+        msg.setStandardButtons(QtGui.QMessageBox.Ok)
+        msg.exec_()
+
+    def offerRestore(self, path, store):
+        """
+        Asks whether to restore the table from a session that did not close
+        cleanly, restoring it into the store if so.
+        :param path: Base path of the session files
+        :param store: Empty store for the table
+        :return: Encoded columns of the restored table, None if the session
+        was not restored
+        """
+        msg = QtGui.QMessageBox()
+        msg.setIcon(QtGui.QMessageBox.Question)
+        msg.setText(u"FDF did not close properly last time. Do you want to restore the data "
+                    u"from the previous session?")
+        msg.setWindowTitle(u"Restore previous session")
+        msg.setStandardButtons(QtGui.QMessageBox.Yes | QtGui.QMessageBox.No)
+        msg.setDefaultButton(QtGui.QMessageBox.Yes)
+        if msg.exec_() == QtGui.QMessageBox.Yes:
+            return restore_session(path, store)
+        return None
+
     def paste(self):
         """Creates Excel-style paste into the table instance from the clipboard."""
         # Get the selected cell or cells
-        selection = self.tableViewData.selectionModel()
-        indexes = selection.selectedIndexes()
+        indexes = self.selectedIndexes()
+        if len(indexes) < 1:
+            # Nothing selected
+            return None
         # Get the location of the top left cell in selection
         pasteStartRow = min(r.row() for r in indexes)
         pasteStartCol = min(c.column() for c in indexes)
         pasteEndRow = max(r.row() for r in indexes)
         pasteEndCol = max(c.column() for c in indexes)
-        if len(indexes) < 1:
-            # Nothing selected
-            return None
-
-        # Excel places an extra newline at the end of everything copied to the
-        # clipboard. To ensure we do not lose data, and to ensure consistency
-        # we remove any extra newline characters from the end of the text.
-        txt = QtGui.QApplication.clipboard().text()
-        if txt.endsWith('\n'):
-            txt.chop(1)
 
         # Parse the clipboard
-        copyDataRows = txt.split('\n')
-        if copyDataRows is None:
+        block = clipboard.parse_tsv(QtGui.QApplication.clipboard().text())
+        if not block:
             # Nothing in the clipboard
             return None
 
-        # Paste data
-        # Special case - only one value selected
-        if len(copyDataRows) == 1 and '\t' not in copyDataRows[0]:
-            copyData = copyDataRows[0]
-            for i in range(pasteEndRow - pasteStartRow + 1):
-                for j in range(pasteEndCol - pasteStartCol + 1):
-                    index = self.sampleModel.index(pasteStartRow + i, pasteStartCol + j)
-                    previous = self.sampleModel.data(index)
-                    command = CommandSetData(self.sampleModel, index, copyData,
-                                             previous, dateFormat=self.dateFormatComboBox.currentText())
-                    self.undoStack.push(command)
+        # Special case - only one value, which fills the selection
+        if len(block) == 1 and len(block[0]) == 1:
+            block = [block[0] * (pasteEndCol - pasteStartCol + 1)
+                     for row in self.visibleRows(pasteStartRow, pasteEndRow)]
+
+        # Paste data as a single undoable step. The block's rows go to the
+        # rows shown in the table, skipping rows hidden by a filter.
+        dateFormat = self.dateFormatComboBox.currentText()
+        # Load the rows the block reaches, and more for rows hidden by a
+        # filter, so that only rows past the end of the table are left out
+        lastRow = pasteStartRow + len(block) - 1
+        while True:
+            self.sampleModel.fetchTo(lastRow)
+            rows = self.visibleRows(pasteStartRow, self.sampleModel.rowCount() - 1, len(block))
+            if len(rows) >= len(block) or self.sampleModel.rowCount() >= self.sampleModel.totalRowCount():
+                break
+            lastRow = self.sampleModel.rowCount() - 1 + len(block) - len(rows)
+        if not rows:
+            return None
+        # Rows of the block past the last target row are left out, so they
+        # are not written into the hidden rows below it
+        block = block[:len(rows)]
+        if rows[-1] - rows[0] == len(rows) - 1:
+            command = CommandSetRange(self.sampleModel, pasteStartRow, pasteStartCol, block, "Paste data",
+                                      dateFormat=dateFormat)
         else:
-            # Prepare the undo macro
-            self.undoStack.beginMacro("Paste data")
-            # Paste data in rows, starting from top and moving left to right
-            for i in range(len(copyDataRows)):
-                copyDataCols = copyDataRows[i].split('\t')
-                for j in range(len(copyDataCols)):
-                    index = self.sampleModel.index(pasteStartRow + i, pasteStartCol + j)
-                    previous = self.sampleModel.data(index)
-                    command = CommandSetData(self.sampleModel, index, copyDataCols[j],
-                                             previous, dateFormat=self.dateFormatComboBox.currentText())
-                    self.undoStack.push(command)
-            self.undoStack.endMacro()
+            columnCount = self.sampleModel.columnCount()
+            cells = [(row, column, value) for row, values in zip(rows, block)
+                     for column, value in enumerate(values[:max(0, columnCount - pasteStartCol)], start=pasteStartCol)]
+            command = CommandSetCells(self.sampleModel, [(row, column) for row, column, value in cells],
+                                      description="Paste data", values=[value for row, column, value in cells],
+                                      dateFormat=dateFormat)
+        self.undoStack.push(command)
 
         return None
 
+    def previousError(self):
+        """Moves the current cell to the previous invalid or missing required cell."""
+        self.nextError(forward=False)
+
     def redo(self):
         self.undoStack.redo()
 
+    def regenerateSamplingNumbers(self):
+        """Derives the sampling numbers of the selected rows, or of every row
+        if nothing is selected, from their station, date and sample type."""
+        rows, columns = self.selectedRowsAndColumns()
+        self.sampleModel.regenerateSamplingNumbers(rows or range(self.sampleModel.totalRowCount()))
+
     def resetData(self):
         """Resets all data in the table instance after confirming with the user."""
         txt = u"All data will be lost. Are you sure you want to continue?"
@@ -861,11 +1723,34 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
         retVal = msg.exec_()
         if retVal == QtGui.QMessageBox.Ok:
             self.sampleModel.resetData()
+            self.undoStack.clear()
+            self.clearFilter()
+            self.exportCache.clear()
             self.listWidgetCurrentFiles.clear()
             return None
         else:
             return None
 
+    def refreshFilter(self):
+        """Applies the filter again after rows have been removed or moved."""
+        if self.rowFilters:
+            self.applyFilter()
+
+    def selectedRowsAndColumns(self):
+        """Returns sorted lists of the selected rows and columns, leaving out
+        rows hidden by a filter."""
+        indexes = self.selectedIndexes()
+        return (sorted(set(index.row() for index in indexes)),
+                sorted(set(index.column() for index in indexes)))
+
+    def selectedIndexes(self):
+        """Returns the selected cells, leaving out rows hidden by a filter.
+        QTableView.selectedIndexes already skips hidden rows, unlike the
+        selection model, whose selections made with the keyboard or by
+        dragging the headers also cover hidden rows. Every edit reads the
+        selection from here."""
+        return self.tableViewData.selectedIndexes()
+
     def selectionChanged(self):
         self.sampleModel.layoutChanged.emit()
 
@@ -883,11 +1768,21 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
 
     def showHelp(self):
         """Displays the HTML help documentation."""
+        if self.helpBrowser is None:
+            self.helpBrowser = QtGui.QTextBrowser()
+            self.helpBrowser.setSource(QtCore.QUrl.fromLocalFile(settings.resource_path('help.html')))
+            self.helpBrowser.setWindowTitle(u"FDF Utility Help Documentation")
+            self.helpBrowser.setMinimumSize(500, 500)
         self.helpBrowser.show()
 
+    def sortSamples(self):
+        """Sorts the table into sampling event order: by station, date, time and sequence number."""
+        columns = [functions.get_column_number(name) for name in ('station_number', 'date', 'time', 'sample_cid')]
+        self.sampleModel.sortRows(columns, [QtCore.Qt.AscendingOrder] * len(columns))
+
     def swapDayMonth(self):
         """Swap the day and month values of selected indices."""
-        self.sampleModel.swapMonthDay(self.tableViewData.selectedIndexes())
+        self.sampleModel.swapMonthDay(self.selectedIndexes())
 
     def undo(self):
         self.undoStack.undo()
@@ -896,12 +1791,28 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
         """Update the number of frozen columns at the left of the table."""
         settings.FROZEN_COLUMNS = frozenColumns
 
+    def visibleRows(self, first, last, limit=None):
+        """
+        Returns the rows between first and last that are not hidden by a
+        filter.
+        :param first: First row
+        :param last: Last row
+        :param limit: Maximum number of rows returned, None for no limit
+        :return: List of row numbers
+        """
+        rows = []
+        for row in xrange(first, last + 1):
+            if not self.tableViewData.isRowHidden(row):
+                rows.append(row)
+                if limit is not None and len(rows) >= limit:
+                    break
+        return rows
+
     def validateExport(self):
         """Validates the table data for completeness and for fitting to business rules"""
         dataValid = True
         model = self.sampleModel
-        rows = model.rowCount()
-        columns = model.columnCount()
+        rows = model.totalRowCount()
 
         # Test for presence of data
         if rows == 0:
@@ -910,28 +1821,10 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
             return dataValid, msg
 
         # Test for red cells (previously validated)
-        invalidColumns = []
-        for i in range(columns):
-            for j in range(rows):
-                index = model.index(j, i)
-                if model.data(index, role=QtCore.Qt.BackgroundRole) == QtGui.QBrush(QtCore.Qt.red):
-                    invalidColumns.append(i)
-                    break
+        invalidColumns = model.validationIndex.invalidColumns()
 
         # Test for incomplete required fields
-        incompleteColumns = []
-        for i in range(columns):
-            for j in range(rows):
-                index = model.index(j, i)
-                if model.data(index) == "":
-                    if model.data(model.index(j, functions.get_column_number('sample_collected'))) == "NO":
-                        if column_config[i]['required_if_not_sampled']:
-                            incompleteColumns.append(i)
-                            break
-                    else:
-                        if column_config[i]['required']:
-                            incompleteColumns.append(i)
-                            break
+        incompleteColumns = model.validationIndex.incompleteColumns()
 
         # Test matrix consistency
         matrixConsistent = model.checkMatrixConsistency()
@@ -982,13 +1875,56 @@ class MainApp(fdfGui.Ui_MainWindow, QtGui.QMainWindow):
 ##############################################################################
 # Main application
 ##############################################################################
+class StartupTimer(object):
+    """
+    Records the time taken by each phase of startup, from the launch of the
+    application to the main window being shown.
+    """
+    def __init__(self, startTime):
+        self.startTime = startTime
+        self.phases = []
+        self._lastTime = startTime
+
+    def mark(self, phase):
+        """Records the end of a phase of startup."""
+        now = time.time()
+        self.phases.append((phase, now - self._lastTime))
+        self._lastTime = now
+
+    def report(self):
+        """Returns a report of the time taken by each phase."""
+        lines = [u"%-24s %7.3f s" % (phase, seconds) for phase, seconds in self.phases]
+        lines.append(u"%-24s %7.3f s" % (u"Total", self._lastTime - self.startTime))
+        return u"\n".join(lines)
+
+    def total(self):
+        return self._lastTime - self.startTime
+
+
+# Imports, including the configuration, are the first phase of startup
+startupTimer = StartupTimer(LAUNCH_TIME)
+startupTimer.mark(u"Imports and configuration")
+
+
 def main():
     """
     Run the Field Data Formatter app
     """
+    # Required for the export worker processes in the PyInstaller build
+    multiprocessing.freeze_support()
     app = QtGui.QApplication(sys.argv)
+    startupTimer.mark(u"Qt application")
     window = MainApp()
     window.show()
+    startupTimer.mark(u"Window shown")
+    if app_config['startup']['timing_report']:
+        try:
+            settings.make_cache_dir()
+            with open(os.path.join(settings.CACHE_DIR, 'startup_timing.txt'), 'w') as f:
+                f.write(startupTimer.report().encode('utf-8'))
+        except (IOError, OSError):
+            pass
+        window.statusbar.showMessage(u"Started in %.2f s" % startupTimer.total())
     sys.exit(app.exec_())
 
 
@@ -29,6 +29,11 @@ class FreezeTableWidget(QtGui.QTableView):
         self.setModel(self.model)
         # Set the number of frozen columns
         self.frozenColumns = 3
+        # Total width of the frozen columns, kept up to date as columns are
+        # resized or frozen
+        self.frozenWidth = 0
+        # Rows shown by the current filter, None to show all rows
+        self.filteredRows = None
         # Create a second QTableView with original table as parent
         self.frozenTableView = QtGui.QTableView(self)
         # Set the model for the frozen table
@@ -46,7 +51,9 @@ class FreezeTableWidget(QtGui.QTableView):
         # Use the same selection model as the main table
         self.frozenTableView.setSelectionModel(self.selectionModel())
         # Hide the non-frozen columns
-        self.setHiddenColumns(self.frozenColumns)
+        for column in range(self.frozenColumns, self.model.columnCount()):
+            self.frozenTableView.setColumnHidden(column, True)
+        self.updateFrozenWidth()
         # Remove the scroll bar
         self.frozenTableView.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
         self.frozenTableView.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
@@ -66,6 +73,7 @@ class FreezeTableWidget(QtGui.QTableView):
         self.frozenTableView.verticalScrollBar().valueChanged.connect(self.verticalScrollBar().setValue)
         self.verticalScrollBar().valueChanged.connect(self.frozenTableView.verticalScrollBar().setValue)
         self.model.verticalHeaderChanged.connect(self.updateFrozenTableGeometry)
+        self.verticalHeader().geometriesChanged.connect(self.updateFrozenTableGeometry)
 
     ##########################################################################
     # Reimplemented methods
@@ -76,11 +84,10 @@ class FreezeTableWidget(QtGui.QTableView):
         current = QtGui.QTableView.moveCursor(self, cursorAction, modifiers)
 
         if cursorAction == self.MoveLeft and current.column() > (self.frozenColumns - 1) and \
-                        self.visualRect(current).topLeft().x() < sum([self.frozenTableView.columnWidth(i)
-                                                                      for i in range(self.frozenColumns)]):
+                        self.visualRect(current).topLeft().x() < self.frozenWidth:
             newValue = self.horizontalScrollBar().value() \
                        + self.visualRect(current).topLeft().x() \
-                       - sum([self.frozenTableView.columnWidth(i) for i in range(self.frozenColumns)])
+                       - self.frozenWidth
 
             self.horizontalScrollBar().setValue(newValue)
 
@@ -108,30 +115,49 @@ class FreezeTableWidget(QtGui.QTableView):
     def updateSectionWidth(self, logicalIndex, oldSize, newSize):
         if logicalIndex < self.frozenColumns:
             self.frozenTableView.setColumnWidth(logicalIndex, newSize)
+            self.frozenWidth += newSize - oldSize
             self.updateFrozenTableGeometry()
 
     ##########################################################################
     # Private methods
     ##########################################################################
-    def setHiddenColumns(self, frozenColumns):
-        """Hides all non-frozen columns in frozen table"""
-        for column in range(self.frozenColumns, self.model.columnCount()):
-            self.frozenTableView.setColumnHidden(column, True)
-            self.frozenTableView.setColumnWidth(column, self.columnWidth(column))
-        self.updateFrozenTableGeometry()
+    def setFilteredRows(self, rows, first=0, last=None):
+        """Shows only the filtered rows in both tables, or all rows if rows
+        is None. Only the rows between first and last are updated."""
+        self.filteredRows = None if rows is None else set(rows)
+        if last is None:
+            last = self.model.rowCount() - 1
+        for row in range(first, last + 1):
+            hidden = self.filteredRows is not None and row not in self.filteredRows
+            if self.isRowHidden(row) != hidden:
+                self.setRowHidden(row, hidden)
+                self.frozenTableView.setRowHidden(row, hidden)
 
     def updateFrozenColumns(self, frozenColumns):
-        """Updates the number of frozen columns"""
-        for column in range(self.model.columnCount()):
-            self.frozenTableView.setColumnHidden(column, False)
-            self.frozenTableView.setColumnWidth(column, self.columnWidth(column))
+        """Updates the number of frozen columns, showing or hiding only the
+        columns that change"""
+        for column in range(min(self.frozenColumns, frozenColumns), max(self.frozenColumns, frozenColumns)):
+            frozen = column < frozenColumns
+            if frozen:
+                self.frozenTableView.setColumnWidth(column, self.columnWidth(column))
+            self.frozenTableView.setColumnHidden(column, not frozen)
         self.frozenColumns = frozenColumns
-        self.setHiddenColumns(frozenColumns)
+        self.updateFrozenWidth()
+        # Cells that are no longer frozen need to be drawn by the main table
+        self.viewport().update()
 
     def updateFrozenTableGeometry(self):
-        """Sets the frozen table in the correct location and size"""
-        self.frozenTableView.setGeometry(
+        """Sets the frozen table in the correct location and size, if it has
+        changed"""
+        geometry = QtCore.QRect(
             self.verticalHeader().width() + self.frameWidth(),
-            self.frameWidth(), sum([self.frozenTableView.columnWidth(i) for i in range(self.frozenColumns)]),
+            self.frameWidth(), self.frozenWidth,
             self.viewport().height() + self.horizontalHeader().height()
         )
+        if geometry != self.frozenTableView.geometry():
+            self.frozenTableView.setGeometry(geometry)
+
+    def updateFrozenWidth(self):
+        """Recalculates the total width of the frozen columns"""
+        self.frozenWidth = sum(self.frozenTableView.columnWidth(i) for i in range(self.frozenColumns))
+        self.updateFrozenTableGeometry()
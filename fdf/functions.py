@@ -17,19 +17,28 @@ ValidityError: Custom exception for file format errors
 
 Functions:
 check_file_validity: check the validity of the instrument file
+format_export_value: format a typed table value as text for export
 get_column_number: get the column number for the table instance of a
     parameter or metadata field
+get_event_groups: group samples into sampling events
+get_event_key: get the key identifying the sampling event of an export row
 get_fraction_number: generate the field fraction number for a sample
 get_mga_coordinates: get the MGA94 easting and northing from lat/lon coordinates
 get_new_dict_key: update the dictionary key to a friendlier version
 get_replicate_number: get the replicate number corresponding to the sample type
+get_sampling_number: get the sampling number for a station, date and sample type
 get_sampling_time: get the sampling time for a group of samples
 load_instrument_file: load the instrument file to memory
 lord2lorl: transform data from a list of dictionaries to a list of lists
 lorl2lord: transform data from a list of lists to a list of dictionaries
+map_distinct: apply a function once per distinct value of a list
 parse_datetime_from_string: parse a datetime object from a string representation
+parse_sample_datetimes: reformat sample dates and times for export
 prepare_dictionary: transform the data set to a list of dictionaries
-resource_path: get absolute path to resource for PyInstaller
+prepare_event: transform the samples of a single sampling event
+prepare_events: transform a list of sampling events, optionally in parallel
+split_into_chunks: split export rows into chunks without breaking sampling events
+write_chunked_csv: write the data to a set of csv files with a manifest
 write_to_csv: write the data to a csv file for import to KiWQM
 """
 
@@ -38,20 +47,20 @@ import codecs
 import copy
 import csv
 import datetime
-from itertools import islice
+import hashlib
+import io
+from itertools import islice, izip
+import multiprocessing
 import os
 import re
-import sys
 import time
 
-# Related third party imports
-import chardet
-from dateutil.parser import parse
-from utm import from_latlon
-import xlrd
+# Related third party imports: chardet, dateutil, utm and xlrd are imported
+# on first use to keep application startup fast
 
 # Local application imports
-from settings import app_config, column_config, station_list
+from settings import app_config, column_config
+from stations import get_station_index
 
 __author__ = 'Daniel Harris'
 __date__ = '6 December 2017'
@@ -167,6 +176,7 @@ def load_instrument_file(instrument_file, file_source, date_format):
     # If we are importing a Hanna instrument file we use a different import
     # routine
     elif file_source in app_config['sources']['hanna']:
+        import xlrd
         # Check the validity of the file
         with xlrd.open_workbook(instrument_file) as wb:
             try:
@@ -176,6 +186,7 @@ def load_instrument_file(instrument_file, file_source, date_format):
             data = load_hanna_instrument_file(wb, file_source)
             return data
 
+    import chardet
     charset = chardet.detect(open(instrument_file, "rb").read())
     encoding = charset['encoding']
     bom = u'\ufeff'  # Byte Order Mark for utf16-le
@@ -372,11 +383,14 @@ def load_instrument_file(instrument_file, file_source, date_format):
                     new_line['station_number'] = str(int(new_line['station_number']))
                 except ValueError:
                     pass
-                if new_line['station_number'].split(' ', 1)[0] in station_list:
+                # Only an exact station number is accepted, so that a short
+                # or mistyped field is left for the user to enter rather
+                # than matched to the wrong station
+                if new_line['station_number'].split(' ', 1)[0] in get_station_index():
                     station_number = new_line['station_number'].split(' ', 1)[0]
                 else:
                     station_number = ""
-            except KeyError:
+            except (KeyError, UnicodeError):
                 station_number = ""
             new_line['station_number'] = station_number
 
@@ -428,6 +442,7 @@ def load_hanna_instrument_file(wb, file_source):
     # Open the Excel workbook. We assume that the data is on the second
     # worksheet (first worksheet is instrument metadata).
     #wb = xlrd.open_workbook(instrument_file)
+    import xlrd
     ds = wb.sheet_by_index(1)  # Data sheet
 
     # Initialise the data container
@@ -502,6 +517,29 @@ def lorl2lord(lorl, colkeys):
     return [dict(zip(colkeys, row)) for row in lorl]
 
 
+def format_export_value(column, value):
+    """
+    Formats a typed table value (see TableModel.snapshot) as text for export.
+    Dates and times use the KiWQM export formats and measured parameters are
+    formatted to the precision specified in column_config.
+    :param column: Column number of the value
+    :param value: Value to be formatted
+    :return: String representation of the value
+    """
+    if value is None:
+        return ""
+    elif isinstance(value, datetime.date):
+        return value.strftime(app_config['datetime_formats']['date']['export'])
+    elif isinstance(value, datetime.time):
+        return value.strftime(app_config['datetime_formats']['time']['export_sample'])
+    elif isinstance(value, float) and value and 'lower_limit' in column_config[column]:
+        return '%.*f' % (column_config[column]['precision'], value)
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    else:
+        return str(value)
+
+
 def get_column_number(column_name):
     """
     Gets the column number for a given column name
@@ -512,6 +550,16 @@ def get_column_number(column_name):
     return [k for k, v in column_config.iteritems() if v['name'] == column_name][0]
 
 
+def get_event_key(row):
+    """
+    Gets the key identifying the sampling event a parameter-oriented export
+    row belongs to. All rows sharing a key must be imported to KiWQM together.
+    :param row: Dictionary representing one row of the export
+    :return: Tuple of (sampling_number, event_time)
+    """
+    return row.get('sampling_number', ""), row.get('event_time', "")
+
+
 def get_fraction_number(field_dict):
     """
     Return the fraction number for the field sample.
@@ -548,6 +596,7 @@ def get_mga_coordinates(latitude, longitude):
     :param longitude: Longitude as GDA94
     :return: Tuple as (easting, northing, map_zone)
     """
+    from utm import from_latlon
     return from_latlon(latitude, longitude)[:3]
 
 
@@ -610,6 +659,25 @@ def get_replicate_number(rep_code):
     return replicate_numbers[rep_code]
 
 
+def get_sampling_number(station_number, date, sample_type):
+    """
+    Get the sampling number used to identify a sampling, in the format
+    STATION#-DDMMYY[-SAMPLE_TYPE]. The sample type is only included for
+    quality control samples.
+    :param station_number: Station number of the sample
+    :param date: Sample date as a datetime.date object
+    :param sample_type: Sample type code
+    :return: Unicode string of the sampling number, empty if the station
+    number or date is missing.
+    """
+    if (not station_number) or (not date):
+        return u""
+    date = date.strftime(app_config['datetime_formats']['date']['sampling_number'])
+    if sample_type in ["QR", "QB", "QT"]:
+        return u"%s-%s-%s" % (station_number, date, sample_type)
+    return u"%s-%s" % (station_number, date)
+
+
 def get_sampling_time(sample_set, station, sample_date, date_format):
     """
     Find the sampling time for a set of samples collected at the same station
@@ -631,6 +699,26 @@ def get_sampling_time(sample_set, station, sample_date, date_format):
     return sampling_time
 
 
+def map_distinct(function, values):
+    """
+    Apply a function to a list of values, calling it only once for each
+    distinct value. Used for expensive conversions (such as date parsing) of
+    columns with many repeated values.
+    :param function: Function to apply
+    :param values: List of hashable values
+    :return: List of results, in the same order as values
+    """
+    results = {}
+    mapped = []
+    for value in values:
+        try:
+            mapped.append(results[value])
+        except KeyError:
+            results[value] = function(value)
+            mapped.append(results[value])
+    return mapped
+
+
 def parse_datetime_from_string(date, time, dayfirst=True, yearfirst=False):
     """
     Wrapper function for dateutil.parser.parse.
@@ -641,26 +729,42 @@ def parse_datetime_from_string(date, time, dayfirst=True, yearfirst=False):
     :return: Datetime object containing date and time information
     """
     try:
+        from dateutil.parser import parse
         datetime_concat = " ".join([str(date), str(time)])
         dt = parse(datetime_concat, dayfirst=dayfirst, yearfirst=yearfirst, default=None)
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, OverflowError):
         raise DatetimeError
     return dt
 
 
-def prepare_dictionary(data_list, date_format):
+def get_event_groups(data_list):
     """
-    Transform the orientation of the field data to "parameter oriented"
-    as used in KiWQM. The original dictionary orientation is one sample
-    per list entry, while the new orientation is one sample value per
-    list entry.
-    :param data_list: The list of dictionaries to be transformed.
-    :return: A list of dictionaries containing data in "parameter
-    oriented" format.
+    Group samples into sampling events. A sampling event consists of all
+    samples collected at the same station on the same date; event time,
+    replicate numbers and fraction numbers are all computed within an event.
+    :param data_list: The list of sample dictionaries to be grouped.
+    :return: List of lists of indexes into data_list, one list per sampling
+    event, in order of first appearance.
+    """
+    events = {}
+    event_order = []
+    for i, sample in enumerate(data_list):
+        key = (sample['station_number'], sample['date'])
+        if key not in events:
+            events[key] = []
+            event_order.append(key)
+        events[key].append(i)
+    return [events[key] for key in event_order]
+
+
+def parse_sample_datetimes(data_list, date_format):
+    """
+    Reformat the date and time of each sample to the export formats used in
+    KiWQM. The dictionaries are updated in place.
+    :param data_list: The list of sample dictionaries to be updated.
+    :param date_format: Date format of the sample dates.
+    :return: None
     """
-    # Create the container for the parameter-oriented data
-    data_list_param_oriented = []
-    # Parse the sample date and time
     for sample in data_list:
         try:
             dt_dayfirst = True if date_format[:2] == 'dd' else False
@@ -670,10 +774,52 @@ def prepare_dictionary(data_list, date_format):
             sample['sample_time'] = sample_dt.strftime(app_config['datetime_formats']['time']['export_sample'])
         except DatetimeError:
             raise
+
+
+def prepare_dictionary(data_list, date_format, processes=1):
+    """
+    Transform the orientation of the field data to "parameter oriented"
+    as used in KiWQM. The original dictionary orientation is one sample
+    per list entry, while the new orientation is one sample value per
+    list entry.
+    :param data_list: The list of dictionaries to be transformed.
+    :param processes: Number of worker processes to use for the
+    transformation (see prepare_events).
+    :return: A list of dictionaries containing data in "parameter
+    oriented" format.
+    """
+    # Parse the sample date and time
+    parse_sample_datetimes(data_list, date_format)
+    # Transform each sampling event and return the results in sample order
+    sample_rows = [None] * len(data_list)
+    groups = get_event_groups(data_list)
+    events = prepare_events([[data_list[i] for i in indexes] for indexes in groups], date_format, processes)
+    for indexes, event_rows in zip(groups, events):
+        for i, rows in zip(indexes, event_rows):
+            sample_rows[i] = rows
+
+    return [row for rows in sample_rows for row in rows]
+
+
+def prepare_event(samples, date_format):
+    """
+    Transform the samples of a single sampling event to "parameter
+    oriented" format. The sample dates and times must already be in
+    export format (see parse_sample_datetimes).
+    :param samples: The list of sample dictionaries in the sampling event.
+    :param date_format: Date format of the sample dates.
+    :return: A list with one entry per sample, each a list of dictionaries
+    containing the sample's data in "parameter oriented" format.
+    """
+    # Create the container for the parameter-oriented data
+    data_list_param_oriented = []
     # Each item in the list is a single dictionary representing a single sample
-    for sample in data_list:
+    for sample in samples:
+        sample_rows = []
+        data_list_param_oriented.append(sample_rows)
+
         # Get the sampling event time
-        sample['event_time'] = get_sampling_time(data_list, sample['station_number'], sample['date'], date_format)
+        sample['event_time'] = get_sampling_time(samples, sample['station_number'], sample['date'], date_format)
 
         # If no sample or data was collected, prepare a shortened dictionary
         if sample['sample_collected'] == 'NO':
@@ -683,7 +829,7 @@ def prepare_dictionary(data_list, date_format):
             sample_param_oriented["units"] = 'SCAL'
             sample_param_oriented["method"] = 'NULL_METHOD'
             # Add the dictionary to the parameter-oriented container
-            data_list_param_oriented.append(sample_param_oriented)
+            sample_rows.append(sample_param_oriented)
             continue
 
         # Get replicate number
@@ -701,7 +847,7 @@ def prepare_dictionary(data_list, date_format):
         rep_depth_tolerance = 0.15
         min_depth = float(sample['depth_upper']) - rep_depth_tolerance
         max_depth = float(sample['depth_upper']) + rep_depth_tolerance
-        reps_in_sampling = [r['sample_time'] for r in data_list if
+        reps_in_sampling = [r['sample_time'] for r in samples if
                             r['sampling_number'] == sample['sampling_number'] and
                             r['location_id'] == sample['location_id'] and
                             r['sample_type'] == sample['sample_type'] and
@@ -744,7 +890,7 @@ def prepare_dictionary(data_list, date_format):
                 # If the value is empty, skip to the next value
                 if sample_param_oriented["value"] != "":
                     # Add the dictionary to the parameter-oriented container
-                    data_list_param_oriented.append(sample_param_oriented)
+                    sample_rows.append(sample_param_oriented)
                 else:
                     pass
             # If the parameter wasn't found in the list, skip to the next one
@@ -754,17 +900,202 @@ def prepare_dictionary(data_list, date_format):
     return data_list_param_oriented
 
 
-def resource_path(relative_path):
+def prepare_events(events, date_format, processes=1, progress=None):
     """
-    Get absolute path to resource. This is necessary for
-    bundling PyInstaller exes.
+    Transform a list of sampling events to "parameter oriented" format.
+    Sampling events are independent of each other, so with more than one
+    process the events are partitioned into shards of similar size and
+    transformed across a process pool. Each worker receives its shard as
+    a compact columnar batch.
+    :param events: List of sampling events, each a list of sample
+    dictionaries with dates and times in export format.
+    :param date_format: Date format of the sample dates.
+    :param processes: Number of worker processes to use. 1 transforms the
+    events in the current process; 0 uses one process per CPU.
+    :param progress: Optional function called with the number of events
+    transformed so far and the total number of events.
+    :return: List with the output of prepare_event for each event, in the
+    same order as events.
     """
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    if processes == 1 or len(events) < 2:
+        event_rows = []
+        for samples in events:
+            event_rows.append(prepare_event(samples, date_format))
+            if progress:
+                progress(len(event_rows), len(events))
+        return event_rows
+
+    # Partition the events into shards, largest events first into the
+    # least loaded shard, keeping the events in each shard in order.
+    shards = [[] for i in range(min(len(events), processes * 4))]
+    shard_sizes = [0] * len(shards)
+    for i in sorted(range(len(events)), key=lambda i: len(events[i]), reverse=True):
+        shard = shard_sizes.index(min(shard_sizes))
+        shards[shard].append(i)
+        shard_sizes[shard] += len(events[i])
+    for shard in shards:
+        shard.sort()
+    batches = [_get_event_batch([events[i] for i in shard], date_format) for shard in shards]
+
+    # Merge the results back into the order of the events as each shard
+    # is completed
+    event_rows = [None] * len(events)
+    done = 0
+    pool = multiprocessing.Pool(processes)
     try:
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.abspath(".")
-    return os.path.join(base_path, relative_path)
+        for shard, result in izip(shards, pool.imap(_prepare_event_batch, batches)):
+            for i, rows in zip(shard, result):
+                event_rows[i] = rows
+            done += len(shard)
+            if progress:
+                progress(done, len(events))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return event_rows
+
+
+def _get_event_batch(events, date_format):
+    """
+    Pack a list of sampling events into a columnar batch for a worker
+    process. Missing dictionary items are stored as None.
+    :param events: List of sampling events, each a list of sample dictionaries
+    :param date_format: Date format of the sample dates
+    :return: Tuple of (fieldnames, columns, number of samples in each event,
+    date format)
+    """
+    fieldnames = sorted(set(key for samples in events for sample in samples for key in sample))
+    columns = zip(*[[sample.get(key) for key in fieldnames] for samples in events for sample in samples])
+    return fieldnames, columns, [len(samples) for samples in events], date_format
+
+
+def _prepare_event_batch(batch):
+    """
+    Worker process function to unpack a columnar batch of sampling events
+    (see _get_event_batch) and transform each event.
+    :param batch: Columnar batch of sampling events
+    :return: List with the output of prepare_event for each event in the batch
+    """
+    fieldnames, columns, event_lengths, date_format = batch
+    samples = [dict((key, value) for key, value in zip(fieldnames, values) if value is not None)
+               for values in zip(*columns)]
+    event_rows = []
+    start = 0
+    for length in event_lengths:
+        event_rows.append(prepare_event(samples[start:start + length], date_format))
+        start += length
+    return event_rows
+
+
+def split_into_chunks(data_list, fieldnames_list, max_rows=0, max_bytes=0):
+    """
+    Split a list of export rows into chunks that fit within a row and/or byte
+    budget. Rows are grouped by sampling event (see get_event_key) and an
+    event is never split across chunks; an event larger than the budget is
+    placed in a chunk of its own.
+    :param data_list: List of dictionaries to be written
+    :param fieldnames_list: List of fieldnames to be used when writing
+    :param max_rows: Maximum number of data rows per chunk (0 for no limit)
+    :param max_bytes: Maximum size in bytes of a chunk, including the header
+        line (0 for no limit)
+    :return: List of chunks, each a dictionary with the csv 'content' (str),
+        the number of 'rows' and the number of 'events' in the chunk
+    """
+    # Group the rows by event, keeping events in order of first appearance
+    events = {}
+    event_order = []
+    for row in data_list:
+        key = get_event_key(row)
+        if key not in events:
+            events[key] = []
+            event_order.append(key)
+        events[key].append(row)
+
+    header = _csv_content([], fieldnames_list, header=True)
+
+    chunks = []
+    current = None
+    for key in event_order:
+        rows = events[key]
+        content = _csv_content(rows, fieldnames_list)
+        if current is not None:
+            rows_exceeded = max_rows and current['rows'] + len(rows) > max_rows
+            bytes_exceeded = max_bytes and current['bytes'] + len(content) > max_bytes
+            if rows_exceeded or bytes_exceeded:
+                current = None
+        if current is None:
+            current = {'parts': [header], 'bytes': len(header), 'rows': 0, 'events': 0}
+            chunks.append(current)
+        current['parts'].append(content)
+        current['bytes'] += len(content)
+        current['rows'] += len(rows)
+        current['events'] += 1
+
+    return [{'content': ''.join(c['parts']), 'rows': c['rows'], 'events': c['events']} for c in chunks]
+
+
+def write_chunked_csv(data_list, out_filepath, fieldnames_list, max_rows=0, max_bytes=0):
+    """
+    Write a list of data dictionaries to a set of csv files, each within the
+    given row and byte budget, so that they can be imported to KiWQM (and
+    retried) independently. A manifest listing each chunk with its row count
+    and SHA-256 checksum is written alongside the chunks.
+    :param data_list: List of dictionaries to be written. Each dictionary
+        represents one line of data to be written
+    :param out_filepath: Path of the export file. Chunks are written as
+        <name>_001.csv, <name>_002.csv... and the manifest as
+        <name>_manifest.csv
+    :param fieldnames_list: List of fieldnames to be used when writing
+    :param max_rows: Maximum number of data rows per chunk (0 for no limit)
+    :param max_bytes: Maximum size in bytes of a chunk (0 for no limit)
+    :return: List of file paths of the chunks written
+    """
+    base, ext = os.path.splitext(str(out_filepath))
+    ext = ext or '.csv'
+    chunks = split_into_chunks(data_list, fieldnames_list, max_rows, max_bytes)
+
+    manifest = []
+    file_paths = []
+    for n, chunk in enumerate(chunks, start=1):
+        file_path = '%s_%03d%s' % (base, n, ext)
+        with open(file_path, 'wb') as f:
+            f.write(chunk['content'])
+        file_paths.append(file_path)
+        manifest.append({
+            'file_name': os.path.basename(file_path),
+            'events': chunk['events'],
+            'rows': chunk['rows'],
+            'bytes': len(chunk['content']),
+            'sha256': hashlib.sha256(chunk['content']).hexdigest()
+        })
+
+    write_to_csv(manifest, base + '_manifest' + ext, ['file_name', 'events', 'rows', 'bytes', 'sha256'])
+    return file_paths
+
+
+def _csv_content(data_list, fieldnames_list, header=False):
+    """
+    Render a list of data dictionaries to csv text in the same format as
+    write_to_csv.
+    :param data_list: List of dictionaries to be rendered
+    :param fieldnames_list: List of fieldnames to be used when rendering
+    :param header: Boolean indicating if the header line should be included
+    :return: String of csv content
+    """
+    buf = io.BytesIO()
+    writer = csv.DictWriter(
+        buf,
+        delimiter=',',
+        extrasaction='ignore',
+        fieldnames=fieldnames_list
+    )
+    if header:
+        writer.writeheader()
+    writer.writerows(data_list)
+    return buf.getvalue()
 
 
 def write_to_csv(data_list, out_filepath, fieldnames_list):
@@ -0,0 +1,493 @@
+"""
+Module: journal.py
+Crash-safe journal of the changes made to the sample table, used to restore
+an editing session after FDF closes unexpectedly.
+
+Author: Daniel Harris
+Title: Data & Procedures Officer
+Organisation: DPI Water
+Date modified: 19/10/2026
+
+External dependencies: None
+
+Classes:
+Journal: Append-only journal of table changes, written in batches by a
+    background thread and compacted into snapshots
+JournalStore: Sample store that records every change in a journal
+SessionLock: Exclusive lock on the files of a session, held by the process
+    that owns the session
+
+Functions:
+apply_record: apply a journal record to a table of encoded columns
+delete_session: delete the snapshot and journal files of a session
+encode_store: encode the table held in a store to start a journal from
+encode_value: encode a value for the journal
+find_sessions: find the sessions left by processes that are no longer
+    running
+get_session_path: get the base path of the session files of this process
+has_session: check whether a journal was left by a session that did not
+    close cleanly
+read_session: read the table saved by a journal
+restore_session: restore the table saved by a journal into a store
+"""
+
+# Standard library imports
+import marshal
+import os
+import Queue
+import threading
+
+# Local application imports
+from settings import column_config
+from storage import KIND_TEXT, BaseStore
+
+__author__ = 'Daniel Harris'
+__date__ = '19 October 2026'
+__email__ = 'daniel.harris@dpi.nsw.gov.au'
+__status__ = 'Production'
+__version__ = '1.1.1'
+
+
+# Journal record types
+RECORD_EXTEND = 'e'
+RECORD_INSERT = 'i'
+RECORD_PERMUTE = 'p'
+RECORD_REMOVE = 'r'
+RECORD_SET = 's'
+
+# Journal marker of a clean shut down, after which the files are deleted
+_CLOSE = object()
+
+# Start of the names of the session files
+SESSION_PREFIX = 'session_'
+
+
+def apply_record(columns, kinds, record):
+    """
+    Applies a journal record to a table held as a list of columns of
+    encoded values.
+    :param columns: List of the encoded values of each column, changed in
+    place
+    :param kinds: Storage kind of each column
+    :param record: Journal record tuple
+    :return: None
+    """
+    recordType = record[0]
+    if recordType == RECORD_SET:
+        row, column, value = record[1:]
+        columns[column][row] = value
+    elif recordType == RECORD_EXTEND:
+        for values, newValues in zip(columns, record[1]):
+            values.extend(newValues)
+    elif recordType == RECORD_INSERT:
+        position, count = record[1:]
+        for values, kind in zip(columns, kinds):
+            values[position:position] = [u"" if kind == KIND_TEXT else None] * count
+    elif recordType == RECORD_REMOVE:
+        position, count = record[1:]
+        for values in columns:
+            del values[position:position + count]
+    elif recordType == RECORD_PERMUTE:
+        order = record[1]
+        for column, values in enumerate(columns):
+            columns[column] = [values[i] for i in order]
+
+
+def delete_session(path):
+    """
+    Deletes the snapshot and journal files of a session, ignoring files
+    that cannot be deleted.
+    :param path: Base path of the session files
+    :return: None
+    """
+    snapshotPath, journalPath = get_paths(path)
+    for filePath in (snapshotPath, snapshotPath + '.tmp', journalPath):
+        try:
+            if os.path.exists(filePath):
+                os.remove(filePath)
+        except OSError:
+            pass
+
+
+def encode_store(store):
+    """
+    Encodes the table held in a store, such as a kept SQLite database, to
+    start a journal from.
+    :param store: SampleStore or SqliteStore holding the table
+    :return: List of the encoded values of each column
+    """
+    return [[encode_value(store.kind(column), value) for value in store.column(column)]
+            for column in range(len(column_config))]
+
+
+def encode_value(kind, value):
+    """
+    Encodes a value for the journal, in the same way as the stores.
+    :param kind: Storage kind of the value's column
+    :param value: Value as a Python type
+    :return: Encoded value
+    """
+    if kind == KIND_TEXT:
+        return value
+    elif value is None or value == "":
+        return None
+    return BaseStore._encode(kind, value)
+
+
+def find_sessions(directory):
+    """
+    Finds the sessions in a folder that were left by processes that are no
+    longer running. The session of a running process is locked by it, so
+    sessions of other instances of the application are left alone.
+    :param directory: Folder of the session files
+    :return: List of (base path, SessionLock) tuples, the most recently
+    saved session first. The caller holds the lock on each session until it
+    releases it.
+    """
+    if not os.path.isdir(directory):
+        return []
+    paths = set(os.path.join(directory, name.split('.')[0]) for name in os.listdir(directory)
+                if name.startswith(SESSION_PREFIX))
+    sessions = []
+    for path in paths:
+        lock = SessionLock(path)
+        if lock.acquire():
+            sessions.append((path, lock))
+    sessions.sort(key=lambda session: get_session_time(session[0]), reverse=True)
+    return sessions
+
+
+def get_paths(path):
+    """Returns the paths of the snapshot and journal files of a session."""
+    return path + '.snapshot', path + '.journal'
+
+
+def get_session_path(directory):
+    """
+    Gets the base path of the session files of this process, so that each
+    instance of the application journals to its own files.
+    :param directory: Folder of the session files
+    :return: Base path of the session files
+    """
+    return os.path.join(directory, '%s%d' % (SESSION_PREFIX, os.getpid()))
+
+
+def get_session_time(path):
+    """Returns the time a session's files were last written, zero if it has
+    none."""
+    snapshotPath, journalPath = get_paths(path)
+    times = [os.path.getmtime(filePath) for filePath in (snapshotPath, snapshotPath + '.tmp', journalPath)
+             if os.path.exists(filePath)]
+    return max(times) if times else 0
+
+
+def has_session(path):
+    """
+    Checks whether a journal was left by a session that did not close
+    cleanly.
+    :param path: Base path of the session files
+    :return: True if there is a session to restore
+    """
+    snapshotPath = get_paths(path)[0]
+    return os.path.exists(snapshotPath) or os.path.exists(snapshotPath + '.tmp')
+
+
+def read_session(path, kinds):
+    """
+    Reads the table saved by a journal: the last snapshot, with the journal
+    records written since the snapshot applied to it. A record cut short by
+    a crash, and any record after it, is ignored.
+    :param path: Base path of the session files
+    :param kinds: Storage kind of each column
+    :return: List of the encoded values of each column, None if there is no
+    snapshot
+    """
+    snapshotPath, journalPath = get_paths(path)
+    if not os.path.exists(snapshotPath):
+        # A crash while replacing the snapshot leaves only the new one
+        snapshotPath += '.tmp'
+    try:
+        with open(snapshotPath, 'rb') as f:
+            generation, columns = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    try:
+        with open(journalPath, 'rb') as f:
+            # Records written before the snapshot belong to an older
+            # generation and are already part of it
+            if marshal.load(f) == generation:
+                while True:
+                    apply_record(columns, kinds, marshal.load(f))
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+    return columns
+
+
+def restore_session(path, store):
+    """
+    Restores the table saved by a journal into an empty store.
+    :param path: Base path of the session files
+    :param store: Empty store to restore the table into
+    :return: List of the encoded values of each column, to start a new
+    journal from, None if there was nothing to restore
+    """
+    kinds = [store.kind(column) for column in range(len(column_config))]
+    columns = read_session(path, kinds)
+    if columns is None:
+        return None
+    store.extend([[None if value is None else BaseStore._decode(kind, value) for value in values]
+                  if kind != KIND_TEXT else values
+                  for values, kind in zip(columns, kinds)])
+    return columns
+
+
+class Journal(object):
+    """
+    Append-only journal of the changes made to the table. Records are
+    queued by the editing thread and written by a background thread in
+    batches, so recording a change costs no more than adding it to a queue.
+    When enough records have been written, the background thread applies
+    them to the last snapshot and writes a new snapshot, starting the
+    journal again. Snapshots and records are written with marshal.
+
+    Each snapshot carries a generation number, and each journal file starts
+    with the generation of the snapshot it follows, so a crash part way
+    through writing a snapshot never applies records twice.
+
+    The session files are locked for as long as the journal is open. If the
+    files cannot be written, journaling stops, the incomplete files are
+    deleted and onError is called once from the background thread.
+    """
+    def __init__(self, path, kinds, columns=None, compactRecords=100000, onError=None):
+        """
+        :param path: Base path of the session files
+        :param kinds: Storage kind of each column
+        :param columns: Encoded values of each column of the table the
+        journal starts from, None for an empty table
+        :param compactRecords: Number of records after which a new snapshot
+        is written
+        :param onError: Function called if journaling stops
+        """
+        self.path = path
+        self.compactRecords = compactRecords
+        self.failed = False
+        self._kinds = kinds
+        self._onError = onError
+        self._queue = Queue.Queue()
+        self._generation = 0
+        self._records = []
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        self._lock = SessionLock(path)
+        if not self._lock.acquire():
+            raise IOError("Session files are in use: %s" % path)
+        self._journal = None
+        try:
+            self.writeSnapshot(columns if columns is not None else [[] for kind in kinds])
+        except (IOError, OSError, ValueError):
+            if self._journal is not None:
+                self._journal.close()
+            delete_session(path)
+            self._lock.release()
+            raise
+        self._thread = threading.Thread(target=self.run, name='Journal')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """Writes the remaining records, then deletes the session files
+        after a clean shut down."""
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self._lock.release()
+
+    def record(self, record):
+        """Queues a record to be written by the background thread."""
+        if not self.failed:
+            self._queue.put(record)
+
+    ##########################################################################
+    # Private methods
+    ##########################################################################
+    def compact(self):
+        """Applies the records written since the last snapshot to it and
+        writes a new snapshot."""
+        with open(get_paths(self.path)[0], 'rb') as f:
+            generation, columns = marshal.load(f)
+        for record in self._records:
+            apply_record(columns, self._kinds, record)
+        self.writeSnapshot(columns)
+
+    def run(self):
+        """Writes queued records until the journal is closed, stopping
+        journaling if the files cannot be written."""
+        try:
+            self.writeRecords()
+        except Exception:
+            # Includes IOError and OSError, and ValueError from marshal
+            self.failed = True
+            if self._journal is not None:
+                try:
+                    self._journal.close()
+                except (IOError, OSError):
+                    pass
+            # The files are incomplete, so must not be offered for restore
+            delete_session(self.path)
+            if self._onError is not None:
+                self._onError()
+
+    def writeRecords(self):
+        """Writes queued records in batches until the journal is closed."""
+        while True:
+            batch = [self._queue.get()]
+            # Take everything queued while the last batch was written
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            closing = batch[-1] is _CLOSE
+            if closing:
+                batch.pop()
+            for record in batch:
+                marshal.dump(record, self._journal)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            if closing:
+                self._journal.close()
+                delete_session(self.path)
+                return None
+            self._records.extend(batch)
+            if len(self._records) >= self.compactRecords:
+                self.compact()
+
+    def writeSnapshot(self, columns):
+        """Writes a snapshot of the table and starts a new journal file
+        after it."""
+        snapshotPath, journalPath = get_paths(self.path)
+        self._generation += 1
+        with open(snapshotPath + '.tmp', 'wb') as f:
+            marshal.dump((self._generation, columns), f)
+            f.flush()
+            os.fsync(f.fileno())
+        # Replace the previous snapshot in a single step
+        if os.path.exists(snapshotPath):
+            os.remove(snapshotPath)
+        os.rename(snapshotPath + '.tmp', snapshotPath)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(journalPath, 'wb')
+        marshal.dump(self._generation, self._journal)
+        self._journal.flush()
+        self._records = []
+
+
+class SessionLock(object):
+    """
+    Exclusive lock on the files of a session, taken on a lock file beside
+    them. The operating system releases the lock when the process holding
+    it ends, so a session that can be locked belongs to no running process.
+    """
+    def __init__(self, path):
+        """
+        :param path: Base path of the session files
+        """
+        self.path = path + '.lock'
+        self._file = None
+
+    def acquire(self):
+        """
+        Takes the lock without waiting.
+        :return: True if the lock was taken, False if another process holds
+        it or the lock file cannot be opened
+        """
+        try:
+            f = open(self.path, 'a+')
+        except IOError:
+            return False
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    def release(self):
+        """Releases the lock and deletes the lock file."""
+        if self._file is None:
+            return None
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        except (IOError, OSError):
+            pass
+        self._file.close()
+        self._file = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class JournalStore(object):
+    """
+    Sample store that records every change made through it in a journal,
+    and passes all calls on to the store it wraps.
+    """
+    def __init__(self, store, journal):
+        """
+        :param store: SampleStore or SqliteStore holding the table
+        :param journal: Journal to record the changes in
+        """
+        self._store = store
+        self._journal = journal
+
+    def __getattr__(self, name):
+        # Reads are passed on to the wrapped store
+        return getattr(self._store, name)
+
+    def __len__(self):
+        return len(self._store)
+
+    def close(self):
+        """Closes the journal, deleting its files, and the store."""
+        self._journal.close()
+        self._store.close()
+
+    def extend(self, columns):
+        self._store.extend(columns)
+        self._journal.record((RECORD_EXTEND, [[self.encodeValue(column, value) for value in values]
+                                              for column, values in enumerate(columns)]))
+
+    def insert(self, position, count):
+        self._store.insert(position, count)
+        self._journal.record((RECORD_INSERT, position, count))
+
+    def permute(self, order):
+        self._store.permute(order)
+        self._journal.record((RECORD_PERMUTE, list(order)))
+
+    def remove(self, position, count):
+        self._store.remove(position, count)
+        self._journal.record((RECORD_REMOVE, position, count))
+
+    def set(self, row, column, value):
+        self._store.set(row, column, value)
+        self._journal.record((RECORD_SET, row, column, self.encodeValue(column, value)))
+
+    ##########################################################################
+    # Private methods
+    ##########################################################################
+    def encodeValue(self, column, value):
+        """Encodes a value for the journal, in the same way as the stores."""
+        return encode_value(self._store.kind(column), value)
@@ -0,0 +1,189 @@
+"""
+Module: search.py
+Per-column indexes for finding and filtering the rows of the sample table.
+
+Author: Daniel Harris
+Title: Data & Procedures Officer
+Organisation: DPI Water
+Date modified: 19/10/2026
+
+External dependencies: None
+
+Classes:
+SearchIndex: Hash and sorted indexes over the columns of the sample table
+
+Functions:
+get_filter_description: describe a filter for display to the user
+"""
+
+# Standard library imports
+import bisect
+
+# Local application imports
+from settings import column_config
+from storage import KIND_TEXT
+
+__author__ = 'Daniel Harris'
+__date__ = '19 October 2026'
+__email__ = 'daniel.harris@dpi.nsw.gov.au'
+__status__ = 'Production'
+__version__ = '1.1.1'
+
+
+# Filter operators
+FILTER_IN = 'in'
+FILTER_BETWEEN = 'between'
+
+
+def get_filter_description(rowFilter):
+    """
+    Describes a filter for display to the user.
+    :param rowFilter: Filter as a (column, operator, operand) tuple
+    :return: Unicode string describing the filter
+    """
+    column, operator, operand = rowFilter
+    name = column_config[column]['display_name']
+    if operator == FILTER_BETWEEN:
+        low, high = operand
+        return u"%s between %s and %s" % (name, low, high)
+    return u"%s is %s" % (name, u" or ".join(sorted(unicode(value) or u"(blank)" for value in operand)))
+
+
+class SearchIndex(object):
+    """
+    Indexes over the columns of the sample table for finding the rows that
+    match a set of filters without scanning the table. Text columns, such
+    as the list columns, are indexed by a hash of their values, and dates,
+    times and numbers by a sorted list of their values. Indexes are built
+    the first time a column is searched and kept up to date as cells are
+    edited. Inserting, removing or reordering rows discards them, to be
+    rebuilt on the next search.
+
+    A filter is a (column, operator, operand) tuple. With FILTER_IN the
+    operand is a set of values, and with FILTER_BETWEEN it is a (low, high)
+    tuple where either bound may be None. A row matches a list of filters if
+    it matches every filter in the list.
+    """
+    def __init__(self, samples):
+        """
+        :param samples: SampleStore of the table
+        """
+        self._samples = samples
+        # Column values as at the time each index was built or updated
+        self._values = {}
+        # Hash indexes: value -> set of row numbers
+        self._hashes = {}
+        # Sorted indexes: sorted list of (value, row number), excluding
+        # missing values, and the set of rows with missing values
+        self._sorted = {}
+        self._missing = {}
+
+    def find(self, filters):
+        """
+        Finds the rows that match every filter. Each filter is looked up in
+        its column's index and the matching rows are intersected, starting
+        from the filter with the fewest matches.
+        :param filters: List of (column, operator, operand) filters
+        :return: Sorted list of the matching row numbers
+        """
+        if not filters:
+            return range(len(self._samples))
+        candidates = sorted((self.lookup(rowFilter) for rowFilter in filters), key=len)
+        rows = candidates[0].intersection(*candidates[1:]) if len(candidates) > 1 else candidates[0]
+        return sorted(rows)
+
+    def insert(self, position, count):
+        self.clear()
+
+    def permute(self, order):
+        self.clear()
+
+    def remove(self, position, count):
+        self.clear()
+
+    def update(self, row, column):
+        """
+        Updates the index of a column after a cell has been edited.
+        :param row: Row number of the edited cell
+        :param column: Column number of the edited cell
+        :return: None
+        """
+        values = self._values.get(column)
+        if values is None:
+            return None
+        old, new = values[row], self.indexValue(column, self._samples.get(row, column))
+        if old == new:
+            return None
+        values[row] = new
+        if column in self._hashes:
+            index = self._hashes[column]
+            rows = index[old]
+            rows.discard(row)
+            if not rows:
+                del index[old]
+            index.setdefault(new, set()).add(row)
+        else:
+            index = self._sorted[column]
+            if old is None:
+                self._missing[column].discard(row)
+            else:
+                del index[bisect.bisect_left(index, (old, row))]
+            if new is None:
+                self._missing[column].add(row)
+            else:
+                bisect.insort(index, (new, row))
+
+    ##########################################################################
+    # Private methods
+    ##########################################################################
+    def buildIndex(self, column):
+        """Builds the index of a column from the store."""
+        values = [self.indexValue(column, value) for value in self._samples.column(column)]
+        self._values[column] = values
+        if self._samples.kind(column) == KIND_TEXT:
+            index = {}
+            for row, value in enumerate(values):
+                index.setdefault(value, set()).add(row)
+            self._hashes[column] = index
+        else:
+            self._sorted[column] = sorted((value, row) for row, value in enumerate(values) if value is not None)
+            self._missing[column] = set(row for row, value in enumerate(values) if value is None)
+
+    def clear(self):
+        """Discards all indexes."""
+        self._values = {}
+        self._hashes = {}
+        self._sorted = {}
+        self._missing = {}
+
+    def indexValue(self, column, value):
+        """Returns the value used to index a cell, treating an empty cell in
+        a text column as an empty string."""
+        if self._samples.kind(column) == KIND_TEXT and value is None:
+            return u""
+        return value
+
+    def lookup(self, rowFilter):
+        """Returns the set of rows matching a single filter."""
+        column, operator, operand = rowFilter
+        if column not in self._values:
+            self.buildIndex(column)
+        if column in self._hashes:
+            index = self._hashes[column]
+            if operator == FILTER_IN:
+                return set().union(*[index.get(self.indexValue(column, value), ()) for value in operand])
+            low, high = operand
+            return set().union(*[rows for value, rows in index.iteritems()
+                                 if (low is None or value >= low) and (high is None or value <= high)])
+        if operator == FILTER_IN:
+            return set().union(*[self._missing[column] if value is None else self.lookupRange(column, value, value)
+                                 for value in operand])
+        return self.lookupRange(column, *operand)
+
+    def lookupRange(self, column, low, high):
+        """Returns the set of rows of a sorted index with values between low
+        and high inclusive, either of which may be None."""
+        index = self._sorted[column]
+        first = 0 if low is None else bisect.bisect_left(index, (low,))
+        last = len(index) if high is None else bisect.bisect_right(index, (high, len(index) + len(self._samples)))
+        return set(row for value, row in index[first:last])
@@ -8,8 +8,21 @@ Organisation: DPI Water
 Date modified: 13/12/2016
 
 External dependencies: PyYAML
+
+Functions:
+get_cache_dir: get the per-user directory of the application's caches
+load_config: load a YAML configuration file through the compiled cache
+make_cache_dir: create the cache directory if it does not exist
+resource_path: get absolute path to resource for PyInstaller
 """
 
+# Standard library imports
+import cPickle
+import hashlib
+import os
+import sys
+
+# Related third party imports
 import yaml
 
 __author__ = 'Daniel Harris'
@@ -19,10 +32,91 @@ __status__ = 'Development'
 __version__ = '1.0.0'
 
 
+# Use the C YAML parser when PyYAML has been built with LibYAML
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def get_cache_dir():
+    """
+    Get the directory of the compiled configuration and other caches. The
+    caches are pickled, so they are kept in a directory belonging to the
+    user rather than the shared temporary directory, where another user
+    could plant a file to be unpickled.
+    :return: %LOCALAPPDATA%\FDF\cache on Windows, otherwise fdf in
+    $XDG_CACHE_HOME or ~/.cache
+    """
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+        return os.path.join(base, 'FDF', 'cache')
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'fdf')
+
+
+def make_cache_dir():
+    """
+    Create the cache directory, accessible only to the user, if it does not
+    exist.
+    """
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR, 0o700)
+
+
+def resource_path(relative_path):
+    """
+    Get absolute path to resource. This is necessary for
+    bundling PyInstaller exes.
+    """
+    try:
+        # PyInstaller creates a temp folder and stores path in _MEIPASS
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+    return os.path.join(base_path, relative_path)
+
+
+def load_config(relative_path):
+    """
+    Loads a YAML configuration file. The parsed configuration is kept in a
+    pickled cache, which is used instead of parsing the file again while
+    the file's modification time and size, or failing that its contents,
+    are unchanged.
+    :param relative_path: Path of the configuration file relative to the
+    application
+    :return: Parsed configuration
+    """
+    path = resource_path(relative_path)
+    cachePath = os.path.join(CACHE_DIR, os.path.basename(relative_path) + '.pickle')
+    stat = os.stat(path)
+    try:
+        with open(cachePath, 'rb') as f:
+            mtime, size, digest, config = cPickle.load(f)
+    except Exception:
+        # A missing or unreadable cache is rebuilt
+        mtime = size = digest = config = None
+    if (mtime, size) == (stat.st_mtime, stat.st_size):
+        return config
+
+    with open(path, 'rb') as f:
+        source = f.read()
+    sourceDigest = hashlib.md5(source).hexdigest()
+    if sourceDigest != digest:
+        config = yaml.load(source, Loader=YAML_LOADER)
+    try:
+        make_cache_dir()
+        with open(cachePath, 'wb') as f:
+            cPickle.dump((stat.st_mtime, stat.st_size, sourceDigest, config), f, cPickle.HIGHEST_PROTOCOL)
+    except (IOError, OSError):
+        pass
+    return config
+
+
+# Directory of the compiled configuration and other caches
+CACHE_DIR = get_cache_dir()
+
 # Set up global configurations
-app_config = yaml.load(open('config/app_config.yaml').read())
-column_config = yaml.load(open('config/column_config.yaml').read())
-station_list = yaml.load(open('config/station_list.yaml').read())
+app_config = load_config('config/app_config.yaml')
+column_config = load_config('config/column_config.yaml')
+station_list = load_config('config/station_list.yaml')
 
 # Global variable for frozen columns
-FROZEN_COLUMNS = 3
\ No newline at end of file
+FROZEN_COLUMNS = 3
@@ -0,0 +1,178 @@
+"""
+Module: stations.py
+Lookup of water quality monitoring stations by number or name.
+
+Author: Daniel Harris
+Title: Data & Procedures Officer
+Organisation: DPI Water
+Date modified: 19/10/2026
+
+External dependencies: None
+
+Classes:
+StationIndex: Prefix index of station numbers and trigram index of station
+    names
+
+Functions:
+get_station_index: get the station index, loading it from the on-disk cache
+    when the station list has not changed
+"""
+
+# Standard library imports
+import bisect
+import cPickle
+import os
+
+# Local application imports
+from settings import CACHE_DIR, make_cache_dir, resource_path, station_list
+
+__author__ = 'Daniel Harris'
+__date__ = '19 October 2026'
+__email__ = 'daniel.harris@dpi.nsw.gov.au'
+__status__ = 'Production'
+__version__ = '1.1.1'
+
+
+STATION_LIST_PATH = 'config/station_list.yaml'
+CACHE_PATH = os.path.join(CACHE_DIR, 'station_index.pickle')
+
+# Index shared by the application, loaded on first use
+_stationIndex = None
+
+
+def get_station_index():
+    """
+    Gets the station index. The index is built once from the station list
+    and saved to the user's cache directory, and is loaded from there on
+    later runs for as long as the station list file is unchanged.
+    :return: StationIndex
+    """
+    global _stationIndex
+    if _stationIndex is None:
+        try:
+            stat = os.stat(resource_path(STATION_LIST_PATH))
+            key = (stat.st_mtime, stat.st_size)
+        except OSError:
+            key = None
+        try:
+            with open(CACHE_PATH, 'rb') as f:
+                cachedKey, index = cPickle.load(f)
+            if key is None or cachedKey != key:
+                index = None
+        except Exception:
+            # A missing or unreadable cache is rebuilt
+            index = None
+        if index is None:
+            index = StationIndex(station_list)
+            if key is not None:
+                try:
+                    make_cache_dir()
+                    with open(CACHE_PATH, 'wb') as f:
+                        cPickle.dump((key, index), f, cPickle.HIGHEST_PROTOCOL)
+                except (IOError, OSError):
+                    pass
+        _stationIndex = index
+    return _stationIndex
+
+
+class StationIndex(object):
+    """
+    Index of the monitoring stations. Station numbers are held in a sorted
+    list, so the numbers starting with a prefix are found with two binary
+    searches. Station names are indexed by their three letter substrings
+    (trigrams), so the names containing some text are found by intersecting
+    the stations of each trigram of the text rather than by scanning every
+    name.
+    """
+    def __init__(self, stations):
+        """
+        :param stations: Dictionary of station numbers to station names
+        """
+        items = sorted((unicode(number), unicode(name or u"").upper()) for number, name in stations.iteritems())
+        self._numbers = [number for number, name in items]
+        self._names = [name for number, name in items]
+        # Trigram -> sorted list of positions in self._numbers
+        self._trigrams = {}
+        for position, name in enumerate(self._names):
+            for trigram in self.trigrams(name):
+                self._trigrams.setdefault(trigram, []).append(position)
+
+    def __contains__(self, number):
+        return self.findNumber(number) is not None
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def complete(self, text, limit=50):
+        """
+        Finds the stations matching partially typed text: stations whose
+        number starts with the text, followed by stations whose name
+        contains the text.
+        :param text: Partially typed station number or name
+        :param limit: Maximum number of stations returned
+        :return: List of (station number, station name) tuples
+        """
+        text = unicode(text).strip().upper()
+        if not text:
+            return []
+        positions = self.matchNumbers(text)[:limit]
+        if len(positions) < limit:
+            found = set(positions)
+            positions.extend([position for position in self.matchNames(text)
+                              if position not in found][:limit - len(positions)])
+        return [(self._numbers[position], self._names[position]) for position in positions]
+
+    def name(self, number):
+        """
+        Gets the name of a station.
+        :param number: Station number
+        :return: Station name, None if there is no such station
+        """
+        position = self.findNumber(number)
+        return None if position is None else self._names[position]
+
+    ##########################################################################
+    # Private methods
+    ##########################################################################
+    def findNumber(self, number):
+        """Returns the position of a station number, or None."""
+        number = unicode(number).strip()
+        position = bisect.bisect_left(self._numbers, number)
+        if position < len(self._numbers) and self._numbers[position] == number:
+            return position
+        return None
+
+    def matchNames(self, text, limit=None):
+        """Returns the positions of the stations whose name contains the
+        text, in station number order."""
+        trigrams = self.trigrams(text)
+        if not trigrams:
+            # Too short to use the trigram index
+            candidates = xrange(len(self._names))
+        else:
+            lists = sorted((self._trigrams.get(trigram, []) for trigram in trigrams), key=len)
+            candidates = lists[0]
+            if len(lists) > 1:
+                common = set(lists[1]).intersection(*lists[2:])
+                candidates = [position for position in candidates if position in common]
+        matches = []
+        for position in candidates:
+            if text in self._names[position]:
+                matches.append(position)
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
+
+    def matchNumbers(self, prefix, limit=None):
+        """Returns the positions of the station numbers starting with a
+        prefix, in order."""
+        first = bisect.bisect_left(self._numbers, prefix)
+        last = bisect.bisect_left(self._numbers, prefix + u'\uffff')
+        if limit is not None:
+            last = min(last, first + limit)
+        return range(first, last)
+
+    @staticmethod
+    def trigrams(text):
+        """Returns the set of three character substrings of the text."""
+        return set(text[i:i + 3] for i in range(len(text) - 2))
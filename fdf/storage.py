@@ -0,0 +1,537 @@
+"""
+Module: storage.py
+Columnar storage for the sample table data.
+
+Author: Daniel Harris
+Title: Data & Procedures Officer
+Organisation: DPI Water
+Date modified: 19/10/2026
+
+External dependencies: None
+
+Classes:
+BaseStore: Behaviour shared by the storage backends
+SampleStore: Typed, column-oriented storage of the sample table in memory
+SqliteStore: Storage of the sample table in a SQLite database
+
+Functions:
+create_store: create the storage backend selected in app_config.yaml
+get_column_kind: get the storage kind of a table column
+get_text_sort_key: get the sort key of a text value
+"""
+
+# Standard library imports
+import array
+import collections
+import datetime
+import os
+import tempfile
+from itertools import izip
+
+# Local application imports
+from settings import app_config, column_config
+
+__author__ = 'Daniel Harris'
+__date__ = '19 October 2026'
+__email__ = 'daniel.harris@dpi.nsw.gov.au'
+__status__ = 'Production'
+__version__ = '1.1.1'
+
+
+# Storage kinds of the table columns
+KIND_NUMBER = 'number'
+KIND_DATE = 'date'
+KIND_TIME = 'time'
+KIND_TEXT = 'text'
+
+
+def get_column_kind(column):
+    """
+    Gets the storage kind of a table column.
+    :param column: Column number as defined in column_config.yaml
+    :return: KIND_DATE or KIND_TIME for the date and time columns,
+    KIND_NUMBER for measured parameters (those with a lower_limit) and
+    KIND_TEXT for all other columns.
+    """
+    if column_config[column]['name'] == 'date':
+        return KIND_DATE
+    elif column_config[column]['name'] == 'time':
+        return KIND_TIME
+    elif 'lower_limit' in column_config[column]:
+        return KIND_NUMBER
+    else:
+        return KIND_TEXT
+
+
+def create_store():
+    """
+    Creates the storage backend selected in the storage section of
+    app_config.yaml.
+    :return: SqliteStore if the sqlite backend is selected, otherwise a
+    SampleStore
+    """
+    config = app_config['storage']
+    if config['backend'] == 'sqlite':
+        return SqliteStore(config['sqlite_path'] or None, config['page_rows'], config['cache_pages'])
+    return SampleStore()
+
+
+def get_text_sort_key(value, present, missing):
+    """
+    Gets the sort key of a text value. Text that reads as a number sorts
+    numerically ahead of other text, which sorts case-insensitively.
+    :param value: Text value
+    :param present: Flag placed first in the keys of non-empty values
+    :param missing: Flag placed first in the keys of empty values
+    :return: Sort key tuple
+    """
+    if value is None or value == "":
+        return missing, 0, u""
+    try:
+        return present, 0, float(value)
+    except (ValueError, TypeError):
+        return present, 1, unicode(value).lower()
+
+
+class BaseStore(object):
+    """
+    Behaviour shared by the storage backends. Subclasses store the values
+    of each row and provide get, set, column, extend, insert, remove,
+    permute and sortKeys.
+    """
+    def __init__(self):
+        self._kinds = [get_column_kind(column) for column in range(len(column_config))]
+
+    def close(self):
+        """Releases any resources held by the store."""
+        pass
+
+    def flush(self):
+        """Makes the changes since the last flush permanent."""
+        pass
+
+    def kind(self, column):
+        """Returns the storage kind of a column."""
+        return self._kinds[column]
+
+    def sortOrder(self, columns):
+        """
+        Gets the order of the rows sorted by one or more columns. The sort is
+        stable, so rows with equal keys keep their current order.
+        :param columns: List of (column number, descending) tuples, most
+        significant column first
+        :return: List of the current row numbers in their sorted order
+        """
+        order = range(len(self))
+        # Sort by the least significant column first, relying on stability
+        for column, descending in reversed(columns):
+            keys = self.sortKeys(column, descending)
+            order.sort(key=keys.__getitem__, reverse=descending)
+        return order
+
+    @staticmethod
+    def _decode(kind, value):
+        """Decodes a stored date, time or number to its Python type."""
+        if kind == KIND_DATE:
+            return datetime.date.fromordinal(value)
+        elif kind == KIND_TIME:
+            return datetime.time(value // 3600, value // 60 % 60, value % 60)
+        return value
+
+    @staticmethod
+    def _encode(kind, value):
+        """Encodes a date, time or number for storage."""
+        if kind == KIND_DATE:
+            return value.toordinal()
+        elif kind == KIND_TIME:
+            return value.hour * 3600 + value.minute * 60 + value.second
+        return float(value)
+
+
+class SampleStore(BaseStore):
+    """
+    Column-oriented storage of the sample table. Numeric columns are held in
+    arrays of doubles, dates as day ordinals and times as seconds since
+    midnight, each with a mask marking which values are present. Text
+    columns are held in lists. Values are read and written as Python types:
+    float, datetime.date and datetime.time (None when missing) and unicode
+    text.
+    """
+    def __init__(self):
+        super(SampleStore, self).__init__()
+        self._values = []
+        self._masks = []
+        for kind in self._kinds:
+            if kind == KIND_NUMBER:
+                self._values.append(array.array('d'))
+                self._masks.append(bytearray())
+            elif kind in (KIND_DATE, KIND_TIME):
+                self._values.append(array.array('i'))
+                self._masks.append(bytearray())
+            else:
+                self._values.append([])
+                self._masks.append(None)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def get(self, row, column):
+        """
+        Gets a single value from the store.
+        :param row: Row number
+        :param column: Column number
+        :return: Value as a Python type, None if the value is missing
+        """
+        mask = self._masks[column]
+        if mask is None:
+            return self._values[column][row]
+        elif not mask[row]:
+            return None
+        return self._decode(self._kinds[column], self._values[column][row])
+
+    def set(self, row, column, value):
+        """
+        Sets a single value in the store.
+        :param row: Row number
+        :param column: Column number
+        :param value: Value as a Python type. None or an empty string marks a
+        date, time or numeric value as missing.
+        :return: None
+        """
+        kind = self._kinds[column]
+        if kind == KIND_TEXT:
+            self._values[column][row] = value
+        elif value is None or value == "":
+            self._values[column][row] = 0
+            self._masks[column][row] = 0
+        else:
+            self._values[column][row] = self._encode(kind, value)
+            self._masks[column][row] = 1
+
+    def column(self, column):
+        """
+        Gets all values of a column.
+        :param column: Column number
+        :return: Tuple of values as Python types, None where missing
+        """
+        mask = self._masks[column]
+        if mask is None:
+            return tuple(self._values[column])
+        kind = self._kinds[column]
+        if kind == KIND_NUMBER:
+            return tuple(value if present else None for value, present in izip(self._values[column], mask))
+        return tuple(self._decode(kind, value) if present else None
+                     for value, present in izip(self._values[column], mask))
+
+    def extend(self, columns):
+        """
+        Appends rows to the end of the store.
+        :param columns: List of the values of each column, as Python types.
+        None or an empty string marks a date, time or numeric value as
+        missing.
+        :return: None
+        """
+        count = len(columns[0]) if columns else 0
+        for column, kind in enumerate(self._kinds):
+            values = columns[column]
+            if kind == KIND_TEXT:
+                self._values[column].extend(values)
+            else:
+                present = [value is not None and value != "" for value in values]
+                self._values[column].extend(self._encode(kind, value) if isPresent else 0
+                                            for value, isPresent in izip(values, present))
+                self._masks[column].extend(bytearray(present))
+        self._length += count
+
+    def insert(self, position, count):
+        """
+        Inserts empty rows.
+        :param position: Row number of the first row to insert
+        :param count: Number of rows to insert
+        :return: None
+        """
+        for column, kind in enumerate(self._kinds):
+            values = self._values[column]
+            if kind == KIND_TEXT:
+                values[position:position] = [u""] * count
+            else:
+                values[position:position] = array.array(values.typecode, [0]) * count
+                self._masks[column][position:position] = bytearray(count)
+        self._length += count
+
+    def remove(self, position, count):
+        """
+        Removes rows.
+        :param position: Row number of the first row to remove
+        :param count: Number of rows to remove
+        :return: None
+        """
+        for column in range(len(self._kinds)):
+            del self._values[column][position:position + count]
+            if self._masks[column] is not None:
+                del self._masks[column][position:position + count]
+        self._length -= count
+
+    def sortKeys(self, column, descending=False):
+        """
+        Gets keys for sorting the rows by a column. Keys are built from the
+        stored values, so dates, times and numbers sort by value. Text that
+        reads as a number sorts numerically ahead of other text, which sorts
+        case-insensitively. Missing values sort last in either direction.
+        :param column: Column number
+        :param descending: True if the keys are for a descending sort
+        :return: List of sort keys, one per row
+        """
+        # Flags that place missing values after present values
+        present, missing = (1, 0) if descending else (0, 1)
+        mask = self._masks[column]
+        if mask is not None:
+            return [(present, value) if isPresent else (missing, 0)
+                    for value, isPresent in izip(self._values[column], mask)]
+        return [get_text_sort_key(value, present, missing) for value in self._values[column]]
+
+    def permute(self, order):
+        """
+        Reorders the rows.
+        :param order: List of the current row numbers in their new order
+        :return: None
+        """
+        for column, kind in enumerate(self._kinds):
+            values = self._values[column]
+            if kind == KIND_TEXT:
+                self._values[column] = [values[i] for i in order]
+            else:
+                self._values[column] = array.array(values.typecode, (values[i] for i in order))
+                mask = self._masks[column]
+                self._masks[column] = bytearray(mask[i] for i in order)
+
+
+class SqliteStore(BaseStore):
+    """
+    Storage of the sample table in a SQLite database, for working sets too
+    large to hold in memory. Each row is stored with a fixed id and the
+    order of the rows is held in memory as an array of ids, so rows can be
+    inserted, removed and sorted without rewriting the database. Rows are
+    read a page at a time into a least recently used cache. Edits are
+    written through to the database and committed as a single transaction
+    on flush. Values are read and written as the same Python types as
+    SampleStore.
+
+    Only the cell values are moved out of memory. The row order, and the
+    per-row indexes kept by TableModel (row versions and the validation,
+    sampling event and search indexes), still hold an entry per row in
+    memory, and reading a whole column with column or sortKeys loads it
+    into memory for the duration of the call.
+
+    A database given by path is kept when the store is closed, and its rows
+    are reopened, in the order they were added, the next time the store is
+    created. A temporary database is rebuilt each time.
+    """
+    # Maximum number of parameters in a single SQLite statement
+    MAX_PARAMETERS = 900
+
+    def __init__(self, path=None, pageRows=256, cachePages=64):
+        """
+        :param path: Path of the database file, which is kept on close. A
+        temporary file, deleted on close, is used if no path is given.
+        :param pageRows: Number of rows read from the database at a time
+        :param cachePages: Number of pages kept in the cache
+        """
+        super(SqliteStore, self).__init__()
+        self._temporary = path is None
+        if self._temporary:
+            handle, path = tempfile.mkstemp(suffix='.sqlite', prefix='fdf_')
+            os.close(handle)
+        self._path = path
+        self._pageRows = pageRows
+        self._cachePages = cachePages
+        self._cache = collections.OrderedDict()
+        self._names = ['"%s"' % column_config[column]['name'] for column in range(len(column_config))]
+
+        # Imported here as only the sqlite backend needs it
+        import sqlite3
+        self._connection = sqlite3.connect(path)
+        if self._temporary:
+            # The temporary database does not need to survive a crash
+            self._connection.execute('PRAGMA synchronous = OFF')
+        # Inserted rows start with empty text and missing values, as in SampleStore
+        definitions = [name + (" DEFAULT ''" if kind == KIND_TEXT else '') for name, kind in izip(self._names, self._kinds)]
+        self._connection.execute('CREATE TABLE IF NOT EXISTS samples (id INTEGER PRIMARY KEY, %s)'
+                                 % ', '.join(definitions))
+        # A kept database may predate columns added to column_config.yaml
+        existing = set('"%s"' % result[1] for result in self._connection.execute('PRAGMA table_info(samples)'))
+        for definition, name in izip(definitions, self._names):
+            if name not in existing:
+                self._connection.execute('ALTER TABLE samples ADD COLUMN %s' % definition)
+        for name in ('station_number', 'date', 'sampling_number'):
+            self._connection.execute('CREATE INDEX IF NOT EXISTS samples_%s ON samples ("%s")' % (name, name))
+        self._connection.commit()
+        self._order = array.array('l', (result[0] for result in
+                                        self._connection.execute('SELECT id FROM samples ORDER BY id')))
+        self._nextId = self._order[-1] + 1 if self._order else 1
+
+    def __len__(self):
+        return len(self._order)
+
+    def close(self):
+        """Closes the database, deleting it if it is temporary."""
+        self._connection.close()
+        if self._temporary and os.path.exists(self._path):
+            os.remove(self._path)
+
+    def column(self, column):
+        """
+        Gets all values of a column.
+        :param column: Column number
+        :return: Tuple of values as Python types, None where missing
+        """
+        values = dict(self._connection.execute('SELECT id, %s FROM samples' % self._names[column]))
+        return tuple(self.decodeValue(column, values[rowId]) for rowId in self._order)
+
+    def extend(self, columns):
+        """
+        Appends rows to the end of the store.
+        :param columns: List of the values of each column, as Python types.
+        None or an empty string marks a date, time or numeric value as
+        missing.
+        :return: None
+        """
+        count = len(columns[0]) if columns else 0
+        ids = range(self._nextId, self._nextId + count)
+        encoded = [[self.encodeValue(column, value) for value in values] for column, values in enumerate(columns)]
+        self._connection.executemany(
+            'INSERT INTO samples (id, %s) VALUES (?, %s)' % (', '.join(self._names), ', '.join('?' * len(self._names))),
+            izip(ids, *encoded))
+        self._connection.commit()
+        self._nextId += count
+        self._order.extend(ids)
+        self._cache.clear()
+
+    def flush(self):
+        """Commits the edits made since the last flush."""
+        self._connection.commit()
+
+    def get(self, row, column):
+        """
+        Gets a single value from the store.
+        :param row: Row number
+        :param column: Column number
+        :return: Value as a Python type, None if the value is missing
+        """
+        return self.getPage(row // self._pageRows)[row % self._pageRows][column]
+
+    def insert(self, position, count):
+        """
+        Inserts empty rows.
+        :param position: Row number of the first row to insert
+        :param count: Number of rows to insert
+        :return: None
+        """
+        ids = range(self._nextId, self._nextId + count)
+        self._connection.executemany('INSERT INTO samples (id) VALUES (?)', ((rowId,) for rowId in ids))
+        self._connection.commit()
+        self._nextId += count
+        self._order[position:position] = array.array('l', ids)
+        self._cache.clear()
+
+    def permute(self, order):
+        """
+        Reorders the rows.
+        :param order: List of the current row numbers in their new order
+        :return: None
+        """
+        self._order = array.array('l', (self._order[i] for i in order))
+        self._cache.clear()
+
+    def remove(self, position, count):
+        """
+        Removes rows.
+        :param position: Row number of the first row to remove
+        :param count: Number of rows to remove
+        :return: None
+        """
+        ids = self._order[position:position + count]
+        for start in range(0, len(ids), self.MAX_PARAMETERS):
+            chunk = ids[start:start + self.MAX_PARAMETERS]
+            self._connection.execute('DELETE FROM samples WHERE id IN (%s)' % ', '.join('?' * len(chunk)), chunk)
+        self._connection.commit()
+        del self._order[position:position + count]
+        self._cache.clear()
+
+    def set(self, row, column, value):
+        """
+        Sets a single value in the store. The change is committed on the
+        next flush.
+        :param row: Row number
+        :param column: Column number
+        :param value: Value as a Python type. None or an empty string marks a
+        date, time or numeric value as missing.
+        :return: None
+        """
+        encoded = self.encodeValue(column, value)
+        self._connection.execute('UPDATE samples SET %s = ? WHERE id = ?' % self._names[column],
+                                 (encoded, self._order[row]))
+        page = self._cache.get(row // self._pageRows)
+        if page is not None:
+            page[row % self._pageRows][column] = self.decodeValue(column, encoded)
+
+    def sortKeys(self, column, descending=False):
+        """
+        Gets keys for sorting the rows by a column, following the same rules
+        as SampleStore.sortKeys.
+        :param column: Column number
+        :param descending: True if the keys are for a descending sort
+        :return: List of sort keys, one per row
+        """
+        # Flags that place missing values after present values
+        present, missing = (1, 0) if descending else (0, 1)
+        values = dict(self._connection.execute('SELECT id, %s FROM samples' % self._names[column]))
+        if self._kinds[column] == KIND_TEXT:
+            return [get_text_sort_key(values[rowId], present, missing) for rowId in self._order]
+        return [(missing, 0) if values[rowId] is None else (present, values[rowId]) for rowId in self._order]
+
+    ##########################################################################
+    # Private methods
+    ##########################################################################
+    def decodeValue(self, column, value):
+        """Decodes a value read from the database to its Python type."""
+        if value is None or self._kinds[column] == KIND_TEXT:
+            return value
+        return self._decode(self._kinds[column], value)
+
+    def encodeValue(self, column, value):
+        """Encodes a value for writing to the database. Text read from a
+        file as a byte string is decoded, as SQLite only accepts unicode."""
+        if self._kinds[column] == KIND_TEXT:
+            if isinstance(value, str):
+                try:
+                    return value.decode('utf-8')
+                except UnicodeDecodeError:
+                    return value.decode('latin-1')
+            return value
+        elif value is None or value == "":
+            return None
+        return self._encode(self._kinds[column], value)
+
+    def getPage(self, page):
+        """Returns a page of decoded rows, reading it from the database if it
+        is not in the cache."""
+        try:
+            rows = self._cache.pop(page)
+        except KeyError:
+            ids = self._order[page * self._pageRows:(page + 1) * self._pageRows]
+            values = {}
+            for start in range(0, len(ids), self.MAX_PARAMETERS):
+                chunk = ids[start:start + self.MAX_PARAMETERS]
+                for result in self._connection.execute(
+                        'SELECT id, %s FROM samples WHERE id IN (%s)' % (', '.join(self._names),
+                                                                        ', '.join('?' * len(chunk))), chunk):
+                    values[result[0]] = result[1:]
+            rows = [[self.decodeValue(column, value) for column, value in enumerate(values[rowId])]
+                    for rowId in ids]
+            # Drop the least recently used page
+            if len(self._cache) >= self._cachePages:
+                self._cache.popitem(last=False)
+        self._cache[page] = rows
+        return rows
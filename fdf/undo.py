@@ -0,0 +1,173 @@
+"""
+Module: undo.py
+Undo stack with a memory budget for the table edits.
+
+Author: Daniel Harris
+Title: Data & Procedures Officer
+Organisation: DPI Water
+Date modified: 19/10/2026
+
+External dependencies: None
+
+Classes:
+MacroCommand: Group of commands undone and redone as a single step
+UndoStack: Undo stack that drops the oldest history when it grows beyond
+    its memory budget
+
+Functions:
+get_block_size: estimate the memory used by a block of values
+"""
+
+# Standard library imports
+import sys
+
+__author__ = 'Daniel Harris'
+__date__ = '19 October 2026'
+__email__ = 'daniel.harris@dpi.nsw.gov.au'
+__status__ = 'Production'
+__version__ = '1.1.1'
+
+
+# Estimated size of a command that does not report its own size
+DEFAULT_COMMAND_SIZE = 1024
+
+
+def get_block_size(block):
+    """
+    Estimate the memory used by a block of values.
+    :param block: List of rows, each a sequence of values
+    :return: Estimated size in bytes
+    """
+    size = sys.getsizeof(block)
+    for values in block:
+        size += sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values)
+    return size
+
+
+class MacroCommand(object):
+    """
+    Group of commands undone and redone as a single step.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.commands = []
+
+    def byteSize(self):
+        return sum(UndoStack.commandSize(command) for command in self.commands)
+
+    def redo(self):
+        for command in self.commands:
+            command.redo()
+
+    def undo(self):
+        for command in reversed(self.commands):
+            command.undo()
+
+
+class UndoStack(object):
+    """
+    Undo stack for the table edits, used in the same way as QUndoStack.
+    Commands report an estimate of their memory use through a byteSize
+    method. When the history grows beyond the memory budget the oldest
+    commands are dropped, always keeping the most recent command so the
+    last edit can be undone.
+    """
+    def __init__(self, memoryLimit=0):
+        """
+        :param memoryLimit: Memory budget of the history in bytes, zero for
+        no limit
+        """
+        self.memoryLimit = memoryLimit
+        self._commands = []
+        self._sizes = []
+        self._totalSize = 0
+        # Number of commands currently applied
+        self._index = 0
+        self._macro = None
+        self._macroDepth = 0
+
+    def beginMacro(self, text):
+        """Starts a group of commands to be undone as a single step. Macros
+        can be nested, in which case the outermost macro is kept."""
+        if not self._macroDepth:
+            self._macro = MacroCommand(text)
+        self._macroDepth += 1
+
+    def canRedo(self):
+        return self._index < len(self._commands)
+
+    def canUndo(self):
+        return self._index > 0
+
+    def clear(self):
+        """Discards the history."""
+        self._commands = []
+        self._sizes = []
+        self._totalSize = 0
+        self._index = 0
+
+    def count(self):
+        return len(self._commands)
+
+    def endMacro(self):
+        """Ends a group of commands started by beginMacro."""
+        self._macroDepth -= 1
+        if not self._macroDepth:
+            macro, self._macro = self._macro, None
+            if macro.commands:
+                self.addCommand(macro)
+
+    def index(self):
+        return self._index
+
+    def push(self, command):
+        """Applies a command and adds it to the history (or the open
+        macro), discarding any commands that had been undone."""
+        command.redo()
+        if self._macro is not None:
+            self._macro.commands.append(command)
+        else:
+            self.addCommand(command)
+
+    def redo(self):
+        if self.canRedo():
+            self._commands[self._index].redo()
+            self._index += 1
+
+    def totalSize(self):
+        """Returns the estimated memory used by the history in bytes."""
+        return self._totalSize
+
+    def undo(self):
+        if self.canUndo():
+            self._index -= 1
+            self._commands[self._index].undo()
+
+    ##########################################################################
+    # Private methods
+    ##########################################################################
+    def addCommand(self, command):
+        """Adds an applied command to the history and enforces the memory
+        budget."""
+        # Commands that were undone can no longer be redone
+        self._totalSize -= sum(self._sizes[self._index:])
+        del self._commands[self._index:]
+        del self._sizes[self._index:]
+
+        size = self.commandSize(command)
+        self._commands.append(command)
+        self._sizes.append(size)
+        self._totalSize += size
+        self._index += 1
+
+        # Drop the oldest history first
+        while self.memoryLimit and self._totalSize > self.memoryLimit and len(self._commands) > 1:
+            self._totalSize -= self._sizes.pop(0)
+            del self._commands[0]
+            self._index -= 1
+
+    @staticmethod
+    def commandSize(command):
+        """Returns the estimated memory used by a command in bytes."""
+        byteSize = getattr(command, 'byteSize', None)
+        return byteSize() if byteSize else DEFAULT_COMMAND_SIZE
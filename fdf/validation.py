@@ -0,0 +1,456 @@
+"""
+Module: validation.py
+Validation of the sample table data, and an index of the invalid and
+missing required cells that is kept up to date as the table is edited.
+
+Author: Daniel Harris
+Title: Data & Procedures Officer
+Organisation: DPI Water
+Date modified: 19/10/2026
+
+External dependencies: None
+
+Classes:
+EventIndex: Index of the sampling events of the sample table, used to check
+    the matrix and sequence number rules
+ValidationIndex: Index of the invalid and missing required cells of the
+    sample table
+
+Functions:
+validate_value: validate a single table value
+"""
+
+# Standard library imports
+import datetime
+
+# Local application imports
+import functions
+from settings import column_config
+
+__author__ = 'Daniel Harris'
+__date__ = '19 October 2026'
+__email__ = 'daniel.harris@dpi.nsw.gov.au'
+__status__ = 'Production'
+__version__ = '1.1.1'
+
+
+def validate_value(column, value):
+    """
+    Validates a value from the table's storage.
+    :param column: Column number as defined in column_config.yaml
+    :param value: Value as the Python type used in storage
+    :return: Tooltip text describing why the value is invalid, None if the
+    value is valid
+    """
+    # Zero values must be test first because second test will return False
+    if value == 0 and 'lower_limit' in column_config[column]:
+        text = "Given value is zero (0). A value of zero generally indicates a sensor failure, " \
+               "or a non-measured parameter. Please review and adjust before continuing."
+        return text
+
+    elif value:
+        if column == functions.get_column_number('date') and value > datetime.date.today():
+            text = "The entered date is in the future. Sampling dates must be in the past.\n" \
+                   "Please enter a different date."
+            return text
+
+        if 'lower_limit' in column_config[column]:
+            if value < column_config[column]['lower_limit'] or value > column_config[column]['upper_limit']:
+                lowerLimit = column_config[column]['lower_limit']
+                upperLimit = column_config[column]['upper_limit']
+                text = "Value out of range.\nAcceptable range is between %s and %s" % (lowerLimit, upperLimit)
+                return text
+
+        if 'list_items' in column_config[column] and value not in column_config[column]['list_items']:
+            text = "Value is not a valid value from the drop down list.\n" \
+                   "Please select a valid value from the list."
+            return text
+
+    return None
+
+
+class ValidationIndex(object):
+    """
+    Index of the invalid and missing required cells of the sample table.
+    Each row holds a bitmask of its invalid columns and a bitmask of its
+    missing required columns, and a count of the flagged rows is kept for
+    each column. The index is updated as cells are edited and rows are
+    inserted, removed or reordered, so the columns with errors are known
+    without scanning the table.
+    """
+    def __init__(self, samples):
+        """
+        :param samples: SampleStore holding the table data. The index must
+        be told of every change made to the store.
+        """
+        self._samples = samples
+        columns = range(len(column_config))
+        self._columnCount = len(column_config)
+        self._collectedColumn = functions.get_column_number('sample_collected')
+        # Columns that can hold an invalid value
+        self._ruleColumns = [column for column in columns
+                             if 'lower_limit' in column_config[column] or
+                             'list_items' in column_config[column] or
+                             column == functions.get_column_number('date')]
+        # Required columns for samples that were and were not collected
+        self._requiredColumns = [column for column in columns if column_config[column]['required']]
+        self._requiredNotSampledColumns = [column for column in columns
+                                           if column_config[column]['required_if_not_sampled']]
+        self._invalid = []
+        self._missing = []
+        self._invalidCounts = [0] * self._columnCount
+        self._missingCounts = [0] * self._columnCount
+        self.insert(0, len(samples))
+
+    def __len__(self):
+        return len(self._invalid)
+
+    def errorCount(self):
+        """Returns the number of invalid and missing required cells."""
+        return sum(self._invalidCounts) + sum(self._missingCounts)
+
+    def findError(self, row, column, forward=True):
+        """
+        Finds the next invalid or missing required cell after a given cell,
+        searching row by row and wrapping around the end of the table.
+        :param row: Row of the cell to search from
+        :param column: Column of the cell to search from
+        :param forward: Search forward if True, otherwise backward
+        :return: Tuple of the row and column of the cell found, None if the
+        table has no errors
+        """
+        rowCount = len(self._invalid)
+        if not rowCount or not self.errorCount():
+            return None
+        for i in range(rowCount + 1):
+            r = (row + i) % rowCount if forward else (row - i) % rowCount
+            mask = self._invalid[r] | self._missing[r]
+            if not mask:
+                continue
+            columns = [c for c in range(self._columnCount) if mask >> c & 1]
+            # Only part of the starting row is searched before wrapping
+            # around and the remainder after
+            if i == 0:
+                columns = [c for c in columns if (c > column if forward else c < column)]
+            elif i == rowCount:
+                columns = [c for c in columns if (c <= column if forward else c >= column)]
+            if columns:
+                return r, columns[0] if forward else columns[-1]
+        return None
+
+    def incompleteColumns(self):
+        """Returns a list of the required columns with one or more missing
+        values."""
+        return [column for column, count in enumerate(self._missingCounts) if count]
+
+    def insert(self, position, count):
+        """
+        Adds rows to the index after they have been inserted in the store.
+        :param position: Row number of the first inserted row
+        :param count: Number of rows inserted
+        :return: Number of invalid cells in the inserted rows
+        """
+        rows = range(position, position + count)
+        invalid = [self.invalidMask(row) for row in rows]
+        missing = [self.missingMask(row) for row in rows]
+        self._invalid[position:position] = invalid
+        self._missing[position:position] = missing
+        self.countMasks(self._invalidCounts, invalid, 1)
+        self.countMasks(self._missingCounts, missing, 1)
+        return sum(bin(mask).count('1') for mask in invalid)
+
+    def invalidColumns(self):
+        """Returns a list of the columns with one or more invalid values."""
+        return [column for column, count in enumerate(self._invalidCounts) if count]
+
+    def permute(self, order):
+        """
+        Reorders the rows after the store has been reordered.
+        :param order: List of the previous row numbers in their new order
+        :return: None
+        """
+        self._invalid = [self._invalid[i] for i in order]
+        self._missing = [self._missing[i] for i in order]
+
+    def remove(self, position, count):
+        """
+        Removes rows from the index.
+        :param position: Row number of the first row removed
+        :param count: Number of rows removed
+        :return: None
+        """
+        self.countMasks(self._invalidCounts, self._invalid[position:position + count], -1)
+        self.countMasks(self._missingCounts, self._missing[position:position + count], -1)
+        del self._invalid[position:position + count]
+        del self._missing[position:position + count]
+
+    def update(self, row, column):
+        """
+        Updates the index after a cell has changed in the store.
+        :param row: Row of the cell
+        :param column: Column of the cell
+        :return: None
+        """
+        bit = 1 << column
+        if column in self._ruleColumns:
+            invalid = self._invalid[row] & ~bit
+            if validate_value(column, self._samples.get(row, column)):
+                invalid |= bit
+            self.replaceMask(self._invalid, self._invalidCounts, row, invalid)
+        # Whether a sample was collected changes which columns are required
+        if column == self._collectedColumn:
+            missing = self.missingMask(row)
+        else:
+            missing = self._missing[row] & ~bit
+            if self.isMissing(row, column):
+                missing |= bit
+        self.replaceMask(self._missing, self._missingCounts, row, missing)
+
+    ##########################################################################
+    # Private methods
+    ##########################################################################
+    @staticmethod
+    def countMasks(counts, masks, sign):
+        """Adds (or with a sign of -1, subtracts) the bits set in each mask
+        to the per column counts."""
+        for mask in masks:
+            column = 0
+            while mask:
+                if mask & 1:
+                    counts[column] += sign
+                mask >>= 1
+                column += 1
+
+    def invalidMask(self, row):
+        """Returns the bitmask of the invalid columns of a row."""
+        mask = 0
+        for column in self._ruleColumns:
+            if validate_value(column, self._samples.get(row, column)):
+                mask |= 1 << column
+        return mask
+
+    def isMissing(self, row, column):
+        """Returns True if a cell is empty and required for its sample."""
+        if self._samples.get(row, self._collectedColumn) == "NO":
+            required = column_config[column]['required_if_not_sampled']
+        else:
+            required = column_config[column]['required']
+        value = self._samples.get(row, column)
+        return bool(required) and (value is None or value == "")
+
+    def missingMask(self, row):
+        """Returns the bitmask of the missing required columns of a row."""
+        if self._samples.get(row, self._collectedColumn) == "NO":
+            columns = self._requiredNotSampledColumns
+        else:
+            columns = self._requiredColumns
+        mask = 0
+        for column in columns:
+            value = self._samples.get(row, column)
+            if value is None or value == "":
+                mask |= 1 << column
+        return mask
+
+    def replaceMask(self, masks, counts, row, mask):
+        """Replaces the mask of a row, updating the per column counts."""
+        if masks[row] != mask:
+            self.countMasks(counts, [masks[row]], -1)
+            self.countMasks(counts, [mask], 1)
+            masks[row] = mask
+
+
+class EventIndex(object):
+    """
+    Index of the samples in each sampling event, used to check the KiWQM
+    rules that apply across the samples of an event: all samples with the
+    same MP number and sampling number must use a single matrix, and the
+    collected samples at each location of a sampling must have distinct
+    sequence numbers starting at 1 and incrementing sequentially. The
+    matrices of each sampling and the sequence numbers at each location are
+    counted, and the counts are updated as the table is edited so that only
+    the sampling containing an edited row needs to be checked again.
+    """
+    def __init__(self, samples):
+        """
+        :param samples: SampleStore holding the table data. The index must
+        be told of every change made to the store.
+        """
+        self._samples = samples
+        self._mpColumn = functions.get_column_number('mp_number')
+        self._samplingColumn = functions.get_column_number('sampling_number')
+        self._locationColumn = functions.get_column_number('location_id')
+        self._sequenceColumn = functions.get_column_number('sample_cid')
+        self._matrixColumn = functions.get_column_number('sample_matrix')
+        self._collectedColumn = functions.get_column_number('sample_collected')
+        self._keyColumns = (self._mpColumn, self._samplingColumn, self._locationColumn,
+                            self._sequenceColumn, self._matrixColumn, self._collectedColumn)
+        # Index entry of each row: (matrix key, matrix, sequence key,
+        # sequence number)
+        self._entries = []
+        # Sampling (mp_number, sampling_number) -> count of each matrix
+        self._matrices = {}
+        # Location (mp_number, sampling_number, location_id) -> count of
+        # each sequence number
+        self._sequences = {}
+        # Samplings and locations breaking the rules
+        self._matrixErrors = set()
+        self._sequenceErrors = set()
+        self.insert(0, len(samples))
+
+    def hasMatrixErrors(self):
+        """Returns True if any sampling uses more than one matrix."""
+        return bool(self._matrixErrors)
+
+    def hasSequenceErrors(self):
+        """Returns True if the sequence numbers at any location are not
+        distinct or not sequential from 1."""
+        return bool(self._sequenceErrors)
+
+    def isKeyColumn(self, column):
+        """Returns True if the column is used by the sampling event rules."""
+        return column in self._keyColumns
+
+    def insert(self, position, count):
+        """
+        Adds rows to the index after they have been inserted in the store.
+        :param position: Row number of the first inserted row
+        :param count: Number of rows inserted
+        :return: True if a sampling or location changed between valid and
+        invalid
+        """
+        entries = [self.rowEntry(row) for row in range(position, position + count)]
+        self._entries[position:position] = entries
+        return self.countEntries(entries, 1)
+
+    def permute(self, order):
+        """
+        Reorders the rows after the store has been reordered.
+        :param order: List of the previous row numbers in their new order
+        :return: None
+        """
+        self._entries = [self._entries[i] for i in order]
+
+    def remove(self, position, count):
+        """
+        Removes rows from the index.
+        :param position: Row number of the first row removed
+        :param count: Number of rows removed
+        :return: True if a sampling or location changed between valid and
+        invalid
+        """
+        entries = self._entries[position:position + count]
+        del self._entries[position:position + count]
+        return self.countEntries(entries, -1)
+
+    def sequenceKeys(self):
+        """
+        Gets the location of each row, as used to check sequence numbers.
+        :return: List of (mp_number, sampling_number, location_id) tuples,
+        None for rows where no sample was collected
+        """
+        return [entry[2] for entry in self._entries]
+
+    def update(self, row, column):
+        """
+        Updates the index after a cell has changed in the store.
+        :param row: Row of the cell
+        :param column: Column of the cell
+        :return: True if a sampling or location changed between valid and
+        invalid
+        """
+        if column not in self._keyColumns:
+            return False
+        entry = self.rowEntry(row)
+        if entry == self._entries[row]:
+            return False
+        changed = self.countEntries([self._entries[row]], -1)
+        self._entries[row] = entry
+        return self.countEntries([entry], 1) or changed
+
+    def validate(self, row, column):
+        """
+        Checks a cell of the matrix or sequence number column against the
+        sampling event rules.
+        :param row: Row of the cell
+        :param column: Column of the cell
+        :return: Tooltip text describing the broken rule, None if the cell
+        does not break a rule
+        """
+        matrixKey, matrix, sequenceKey, sequence = self._entries[row]
+        if column == self._matrixColumn and matrixKey in self._matrixErrors:
+            return "More than one matrix has been defined for this sampling event.\n" \
+                   "Please ensure that only a single matrix is used for all samples in a sampling event."
+        if column == self._sequenceColumn and sequenceKey in self._sequenceErrors:
+            return "The sequence numbers at this location in the sampling event are not distinct, " \
+                   "or do not start at 1 and increment sequentially."
+        return None
+
+    ##########################################################################
+    # Private methods
+    ##########################################################################
+    def countEntries(self, entries, sign):
+        """
+        Adds (or with a sign of -1, removes) row entries to the counts of
+        each sampling and location, and checks the samplings and locations
+        whose counts have changed.
+        :return: True if a sampling or location changed between valid and
+        invalid
+        """
+        matrixKeys = set()
+        sequenceKeys = set()
+        for matrixKey, matrix, sequenceKey, sequence in entries:
+            self.countValue(self._matrices, matrixKey, matrix, sign)
+            matrixKeys.add(matrixKey)
+            if sequenceKey is not None:
+                self.countValue(self._sequences, sequenceKey, sequence, sign)
+                sequenceKeys.add(sequenceKey)
+
+        changed = False
+        for key in matrixKeys:
+            changed |= self.flagError(self._matrixErrors, key, len(self._matrices.get(key, ())) > 1)
+        for key in sequenceKeys:
+            counts = self._sequences.get(key, {})
+            sequential = all(counts.get(n) == 1 for n in range(1, len(counts) + 1))
+            changed |= self.flagError(self._sequenceErrors, key, not sequential)
+        return changed
+
+    @staticmethod
+    def countValue(groups, key, value, sign):
+        """Adds (or removes) a value to the counts of a group, dropping
+        empty counts and groups."""
+        counts = groups.setdefault(key, {})
+        counts[value] = counts.get(value, 0) + sign
+        if not counts[value]:
+            del counts[value]
+            if not counts:
+                del groups[key]
+
+    @staticmethod
+    def flagError(errors, key, isError):
+        """Adds or removes a key from a set of errors, returning True if the
+        set changed."""
+        if isError == (key in errors):
+            return False
+        if isError:
+            errors.add(key)
+        else:
+            errors.discard(key)
+        return True
+
+    def rowEntry(self, row):
+        """Returns the index entry of a row."""
+        get = self._samples.get
+        mp = get(row, self._mpColumn)
+        sampling = get(row, self._samplingColumn)
+        matrixKey = (mp, sampling)
+        if get(row, self._collectedColumn) == "NO":
+            sequenceKey = sequence = None
+        else:
+            sequenceKey = (mp, sampling, get(row, self._locationColumn))
+            try:
+                sequence = int(get(row, self._sequenceColumn))
+            except (ValueError, TypeError):
+                # Missing or non-numeric sequence numbers are counted as an
+                # invalid sequence number
+                sequence = None
+        return matrixKey, get(row, self._matrixColumn), sequenceKey, sequence
@@ -0,0 +1,161 @@
+"""
+Module: versioncheck.py
+Checks in the background whether a newer version of FDF has been released.
+
+Author: Daniel Harris
+Title: Data & Procedures Officer
+Organisation: DPI Water
+Date modified: 19/10/2026
+
+External dependencies: PyQt4, PyYAML
+
+Classes:
+VersionCheckWorker: Looks up the current released version in a background
+    thread
+
+Functions:
+fetch_current_version: download the current released version
+get_current_version: get the current released version, from the cache if it
+    is recent enough
+read_cached_version: read the cached current version
+write_cached_version: write the current version to the cache
+"""
+
+# Standard library imports
+import cPickle
+import os
+import threading
+import time
+import urllib2
+
+# Related third party imports
+import yaml
+from PyQt4 import QtCore
+
+# Local application imports
+from settings import CACHE_DIR
+
+__author__ = 'Daniel Harris'
+__date__ = '19 October 2026'
+__email__ = 'daniel.harris@dpi.nsw.gov.au'
+__status__ = 'Production'
+__version__ = '1.1.1'
+
+
+CACHE_PATH = os.path.join(CACHE_DIR, 'current_version.pickle')
+
+
+def fetch_current_version(url, proxy=None, timeout=5):
+    """
+    Downloads the current released version from the version file.
+    :param url: URL of the version file
+    :param proxy: host:port of the HTTP proxy, None to connect directly
+    :param timeout: Timeout of the request in seconds
+    :return: Current stable version string
+    """
+    handlers = []
+    if proxy:
+        handlers.append(urllib2.ProxyHandler({'http': proxy, 'https': proxy}))
+    else:
+        # Do not pick up a proxy from the environment
+        handlers.append(urllib2.ProxyHandler({}))
+    opener = urllib2.build_opener(*handlers)
+    response = opener.open(url, timeout=timeout)
+    try:
+        return unicode(yaml.safe_load(response.read())['version_stable'])
+    finally:
+        response.close()
+
+
+def get_current_version(url, proxy=None, timeout=5, ttl=0, cachePath=CACHE_PATH):
+    """
+    Gets the current released version, using the cached version if it was
+    fetched from the same URL within the time to live.
+    :param url: URL of the version file
+    :param proxy: host:port of the HTTP proxy, None to connect directly
+    :param timeout: Timeout of the request in seconds
+    :param ttl: Time to live of the cached version in seconds
+    :param cachePath: Path of the cache file
+    :return: Current stable version string
+    """
+    cached = read_cached_version(cachePath)
+    if cached is not None:
+        fetched, cachedUrl, version = cached
+        if cachedUrl == url and 0 <= time.time() - fetched < ttl:
+            return version
+    version = fetch_current_version(url, proxy, timeout)
+    write_cached_version(url, version, cachePath)
+    return version
+
+
+def read_cached_version(cachePath=CACHE_PATH):
+    """
+    Reads the cached current version.
+    :param cachePath: Path of the cache file
+    :return: Tuple of (time fetched, URL fetched from, version), None if
+    there is no cache
+    """
+    try:
+        with open(cachePath, 'rb') as f:
+            fetched, url, version = cPickle.load(f)
+    except Exception:
+        # Includes caches written in an older format
+        return None
+    return fetched, url, version
+
+
+def write_cached_version(url, version, cachePath=CACHE_PATH):
+    """
+    Writes the current version to the cache, ignoring any error.
+    :param url: URL the version was fetched from
+    :param version: Current stable version string
+    :param cachePath: Path of the cache file
+    :return: None
+    """
+    try:
+        directory = os.path.dirname(cachePath)
+        if directory and not os.path.isdir(directory):
+            # Readable only by the user, as the cache is unpickled
+            os.makedirs(directory, 0o700)
+        with open(cachePath, 'wb') as f:
+            cPickle.dump((time.time(), url, version), f, cPickle.HIGHEST_PROTOCOL)
+    except (IOError, OSError):
+        pass
+
+
+class VersionCheckWorker(QtCore.QObject):
+    """
+    Looks up the current released version in a background thread so the
+    application never waits on the network. Emits checked with the version
+    on success. Failures, such as being offline or timing out, are ignored.
+
+    The lookup runs in a daemon thread rather than a QThread. The request
+    timeout does not cover the DNS lookup, so a lookup can outlast the
+    window, and a daemon thread neither holds up closing the window nor
+    has to be waited on before the application exits.
+    """
+    checked = QtCore.pyqtSignal(unicode)
+
+    def __init__(self, config, parent=None):
+        """
+        :param config: version_check section of app_config.yaml
+        """
+        super(VersionCheckWorker, self).__init__(parent)
+        self.config = config
+
+    def run(self):
+        try:
+            version = get_current_version(self.config['url'], self.config['proxy'] or None,
+                                          self.config['timeout'], self.config['cache_ttl_hours'] * 3600)
+        except Exception:
+            # Any failure leaves the version unchecked until the next launch
+            pass
+        else:
+            # Delivered to the GUI thread through a queued connection
+            self.checked.emit(version)
+
+    def start(self):
+        """Starts the lookup in a background thread."""
+        thread = threading.Thread(target=self.run, name='VersionCheck')
+        thread.daemon = True
+        thread.start()